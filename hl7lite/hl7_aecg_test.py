@@ -2,7 +2,7 @@ from enum import Enum
 from hl7lite.hl7_ds import HL7ECGData
 from datetime import timedelta
 import numpy as np
-from hl7lite.hl7_datatypes import fix_time, parse_time
+from hl7lite.hl7_datatypes import parse_time
 
 import logging
 log = logging.getLogger(__name__)
@@ -11,12 +11,12 @@ log = logging.getLogger(__name__)
 
 
 def compute_duration(time1: str, time2: str):
-    return parse_time(fix_time(time2)) - parse_time(fix_time(time1))
+    return parse_time(time2) - parse_time(time1)
 
 
 def compare_times(time1: str, time2: str):
-    t1 = parse_time(fix_time(time1))
-    t2 = parse_time(fix_time(time2))
+    t1 = parse_time(time1)
+    t2 = parse_time(time2)
     if t1 < t2:
         return 1
     elif t1 == t2:
@@ -24,6 +24,17 @@ def compare_times(time1: str, time2: str):
     else:
         return -1
 
+
+# the time to compare DTM strings by:  the same instant can be sent with different offsets (e.g. -0359 and -0400),
+# so times are compared as epoch ns.  missing or unparseable times are kept as is, for the missing time checks.
+def _time_key(time_str):
+    if (not isinstance(time_str, str)) or (len(time_str) == 0):
+        return time_str
+    try:
+        return parse_time(time_str, as_epoch_ns=True)
+    except ValueError:
+        return time_str
+
 #%%
 class VerifyResultType(Enum):
     OK = "PASS"
@@ -60,9 +71,9 @@ def _verify_hl7_msg(msg: HL7ECGData, check_start_times: bool = False, verbose:bo
     envs = set()
     all_starts = []
     all_ends = []
-    starts = set()
-    ends = set()
-    event_times = set()
+    starts = {}        # time key -> DTM string, see _time_key
+    ends = {}
+    event_times = {}
     durations = []
     mshtime_gt_start = []
     mshtime_gt_end = []
@@ -85,11 +96,11 @@ def _verify_hl7_msg(msg: HL7ECGData, check_start_times: bool = False, verbose:bo
         wavetypes.add(signal.type)
         
         if (signal.type in ['monitoring of patient', 'MDC_EVT_ALARM']) and ((signal.end_t is None) or (len(signal.end_t) == 0)):
-            event_times.add(signal.start_t)
+            event_times.setdefault(_time_key(signal.start_t), signal.start_t)
             delays.append(compute_duration(signal.start_t,msg.msh_time ))
         else:
-            starts.add(signal.start_t)
-            ends.add(signal.end_t)
+            starts.setdefault(_time_key(signal.start_t), signal.start_t)
+            ends.setdefault(_time_key(signal.end_t), signal.end_t)
             dur = compute_duration(signal.start_t, signal.end_t)
             durations.append(dur)
             all_ends.append(signal.end_t)
@@ -100,11 +111,11 @@ def _verify_hl7_msg(msg: HL7ECGData, check_start_times: bool = False, verbose:bo
             pd_samp_ms = None
             samp = None
             for key, obx in signal.attributes.items():
-                if (obx['valtype'] == "NA"):
-                    samp = len(obx['value'])
+                if (obx.valtype == "NA"):
+                    samp = len(obx.value)
                 elif "TIME_PD_SAMP" in key:
                     # type conversion handled by hl7_parser
-                    pd_samp_ms = obx['value']
+                    pd_samp_ms = obx.value
                     
             if (pd_samp_ms is None) or (samp is None):
                 raise ValueError(f"ERROR: missing pd_samp_ms or samp. {msg}")
@@ -120,17 +131,19 @@ def _verify_hl7_msg(msg: HL7ECGData, check_start_times: bool = False, verbose:bo
         # all_envs = []
         # env_vs_obx = []
         obx_times = set()
+        start_key = _time_key(signal.start_t)
         all_obx_times = []
         time_vs_obx = []
         bad_parse = []
         for key, obx in signal.attributes.items():
             # all_envs.append(obx['control_id'])
             # env_vs_obx.append(signal.env == obx['control_id'])
-            obx_time = obx['obx_time']
-            obx_times.add(obx_time)
+            obx_time = obx.obx_time
+            obx_key = _time_key(obx_time)
+            obx_times.add(obx_key)
             all_obx_times.append(obx_time)
-            time_vs_obx.append(signal.start_t == obx_time)
-            bad_parse.append(obx['value'] == ')')
+            time_vs_obx.append(start_key == obx_key)
+            bad_parse.append(obx.value == ')')
             
         # if not all(env_vs_obx):
         #     selected = [v for k,v in zip(env_vs_obx, all_envs) if not k]
@@ -183,17 +196,17 @@ def _verify_hl7_msg(msg: HL7ECGData, check_start_times: bool = False, verbose:bo
     # check if all signals in a message have the same starting and ending time
     if check_start_times and (len(starts) > 1):
         if verbose:
-            log.warning(f"WARNING: not all OBR wave have the same start_time {starts}")
+            log.warning(f"WARNING: not all OBR wave have the same start_time {set(starts.values())}")
         warns.add(VerifyResultType.WARN_OBR_MULTIPLE_START)
         
     if check_start_times and (len(ends) > 1):
         if verbose:
-            log.warning(f"WARNING: not all OBR wave have the same end_time {ends}")
+            log.warning(f"WARNING: not all OBR wave have the same end_time {set(ends.values())}")
         warns.add(VerifyResultType.WARN_OBR_MULTIPLE_END)
 
     if len(event_times) > 1:
         if verbose:
-            log.error(f"ERROR: not all OBR event times are the same {event_times}")
+            log.error(f"ERROR: not all OBR event times are the same {set(event_times.values())}")
         warns.add(VerifyResultType.WARN_OBR_MULTIPLE_EVENT_TIMES)
     
     zerodur = timedelta(seconds= 0)
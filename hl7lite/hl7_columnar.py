@@ -0,0 +1,271 @@
+from array import array
+import numpy as np
+import pandas as pd
+
+from hl7lite.hl7_datatypes import missing_values
+
+import logging
+log = logging.getLogger(__name__)
+
+
+#%%
+# columnar accumulation of extracted rows, as an alternative to the per-row dicts from to_row_dicts.
+# rows are appended straight into per-column buffers, at the level where the value changes:
+#   message level:  1 entry per HL7 message (MSH/PID/PV1 values and file info)
+#   signal level:   1 entry per OBR (src, msg_type, start_t, end_t, and the patient info, which can be backfilled per OBR start time)
+#   row level:      1 entry per output row (OBX)
+# each signal points to its message, and each row points to its signal.  the message and signal level columns are expanded
+# to rows with 1 take per column when the DataFrame (or column set) is built, so there is no dict per row, and no pivoting.
+#
+# times are stored as epoch int64 nanoseconds, missing is missing_values[int] (the same bit pattern as NaT).
+# strings are interned per batch, so repeated bed ids, channel names, units etc. share one object.
+# values are kept as a ragged buffer:  a reference to each row's list or array, plus the row lengths.
+
+# output columns, in to_row_dicts order followed by the extract_bed_channel_data file columns.
+MESSAGE_COLUMNS = ('msh_time', 'profile', 'hl7_type', 'control_id', 'deployment', 'hospital', 'bed_unit', 'bed_id')
+PATIENT_COLUMNS = ('pid', 'visit_id', 'first_name', 'last_name', 'middle_initial')
+SIGNAL_COLUMNS = ('src', 'msg_type', 'start_t', 'end_t')
+ROW_COLUMNS = ('channel', 'channel_id', 'channel_type', 'obx_start_t', 'values', 'value_type', 'UoM', 'ref_range', 'pd_samp_ms', 'nsamp')
+FILE_COLUMNS = ('seg_id', 'dir', 'file')
+BATCH_COLUMNS = MESSAGE_COLUMNS + PATIENT_COLUMNS + SIGNAL_COLUMNS + ROW_COLUMNS + FILE_COLUMNS
+
+TIME_COLUMNS = ('msh_time', 'start_t', 'end_t', 'obx_start_t')
+
+_MISSING_TIME = missing_values[int]
+
+
+def _as_epoch_ns(t) -> int:
+    # times from _get_time_repr(time_as_epoch=True) are already ints.  np.datetime64 and NaT are accepted as well.
+    if isinstance(t, (int, np.integer)):
+        return int(t)
+    if (t is None) or pd.isna(t):
+        return _MISSING_TIME
+    return int(np.datetime64(t, 'ns').astype(np.int64))
+
+
+# copy of an array('q') buffer.  the copy keeps the buffer resizable for later appends.
+def _int64(buf) -> np.ndarray:
+    return np.frombuffer(buf, dtype=np.int64).copy() if len(buf) > 0 else np.zeros(0, dtype=np.int64)
+
+
+def _as_float(v) -> float:
+    # pd_samp_ms is a string when not converted (e.g. '4'), or nan when missing.
+    if (v is None) or (isinstance(v, str) and (v.strip() == missing_values[str])):
+        return missing_values[float]
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return missing_values[float]
+
+
+class ColumnarBatch:
+    def __init__(self):
+        self._strings = {}
+
+        # message level
+        self._msg_times = array('q')
+        self._msg_cols = {col: [] for col in MESSAGE_COLUMNS if col not in TIME_COLUMNS}
+        self._seg_id = array('q')
+        self._dir = []
+        self._file = []
+        self._file_info = (-1, missing_values[str], missing_values[str])
+
+        # signal level
+        self._sig_msg = array('q')
+        self._sig_start = array('q')
+        self._sig_end = array('q')
+        self._sig_cols = {col: [] for col in PATIENT_COLUMNS + ('src', 'msg_type')}
+
+        # row level
+        self._row_sig = array('q')
+        self._row_obx_start = array('q')
+        self._row_cols = {col: [] for col in ('channel', 'channel_id', 'channel_type', 'value_type', 'UoM', 'ref_range')}
+        self._values = []
+        self._nvalues = array('q')
+        self._pd_samp_ms = array('d')
+        self._nsamp = array('q')
+
+    def __len__(self):
+        return len(self._row_sig)
+
+    def __repr__(self):
+        return f"ColumnarBatch(messages={len(self._msg_times)}, signals={len(self._sig_msg)}, rows={len(self._row_sig)})"
+
+    @property
+    def num_messages(self):
+        return len(self._msg_times)
+
+    @property
+    def num_signals(self):
+        return len(self._sig_msg)
+
+    def _intern(self, s):
+        if type(s) is not str:
+            return s
+        return self._strings.setdefault(s, s)
+
+    # file info is recorded with each message added after this call.
+    def set_file(self, seg_id: int = -1, dirname: str = missing_values[str], filename: str = missing_values[str]):
+        self._file_info = (int(seg_id), self._intern(dirname), self._intern(filename))
+
+    # returns the message index, to be passed to add_signal.
+    def add_message(self, msh_time, profile, hl7_type, control_id, deployment, hospital, bed_unit, bed_id) -> int:
+        intern = self._intern
+        self._msg_times.append(_as_epoch_ns(msh_time))
+        cols = self._msg_cols
+        cols['profile'].append(intern(profile))
+        cols['hl7_type'].append(hl7_type)   # a list, e.g. ['ORU', 'R01']
+        cols['control_id'].append(control_id)
+        cols['deployment'].append(intern(deployment))
+        cols['hospital'].append(intern(hospital))
+        cols['bed_unit'].append(intern(bed_unit))
+        cols['bed_id'].append(intern(bed_id))
+        seg_id, dirname, filename = self._file_info
+        self._seg_id.append(seg_id)
+        self._dir.append(dirname)
+        self._file.append(filename)
+        return len(self._msg_times) - 1
+
+    # returns the signal index, to be passed to add_row.
+    def add_signal(self, msg_idx: int, src, msg_type, start_t, end_t,
+                   pid, visit_id, first_name, last_name, middle_initial) -> int:
+        intern = self._intern
+        self._sig_msg.append(msg_idx)
+        self._sig_start.append(_as_epoch_ns(start_t))
+        self._sig_end.append(_as_epoch_ns(end_t))
+        cols = self._sig_cols
+        cols['src'].append(intern(src))
+        cols['msg_type'].append(intern(msg_type))
+        cols['pid'].append(intern(pid))
+        cols['visit_id'].append(intern(visit_id))
+        cols['first_name'].append(intern(first_name))
+        cols['last_name'].append(intern(last_name))
+        cols['middle_initial'].append(intern(middle_initial))
+        return len(self._sig_msg) - 1
+
+    def add_row(self, sig_idx: int, channel, channel_id, channel_type, obx_start_t, values, value_type, UoM, ref_range,
+                pd_samp_ms = missing_values[float], nsamp: int = 1):
+        intern = self._intern
+        self._row_sig.append(sig_idx)
+        self._row_obx_start.append(_as_epoch_ns(obx_start_t))
+        cols = self._row_cols
+        cols['channel'].append(intern(channel))
+        cols['channel_id'].append(intern(channel_id))
+        cols['channel_type'].append(intern(channel_type))
+        cols['value_type'].append(intern(value_type))
+        cols['UoM'].append(intern(UoM))
+        cols['ref_range'].append(intern(ref_range))
+        # parquet does not allow mixed types, so scalars are wrapped.  numpy arrays are kept as is.
+        if not isinstance(values, (list, np.ndarray)):
+            values = [values,]
+        self._values.append(values)
+        self._nvalues.append(len(values))
+        self._pd_samp_ms.append(_as_float(pd_samp_ms))
+        self._nsamp.append(int(nsamp))
+
+    # fill in missing patient info for signal sig_idx.  only missing (empty) entries are replaced.
+    def fill_patient_info(self, sig_idx: int, pid, visit_id, first_name, last_name):
+        cols = self._sig_cols
+        for col, val in (('pid', pid), ('visit_id', visit_id), ('first_name', first_name), ('last_name', last_name)):
+            if cols[col][sig_idx] == missing_values[str]:
+                cols[col][sig_idx] = self._intern(val)
+
+    # per signal (hospital, bed_unit, bed_id) and start_t, for patient info lookup.
+    def iter_signal_beds(self):
+        hospital, bed_unit, bed_id = self._msg_cols['hospital'], self._msg_cols['bed_unit'], self._msg_cols['bed_id']
+        for sig_idx, (msg_idx, start_t) in enumerate(zip(self._sig_msg, self._sig_start)):
+            yield sig_idx, (hospital[msg_idx], bed_unit[msg_idx], bed_id[msg_idx]), start_t
+
+    # per signal (hospital, bed_unit, bed_id) list and start_t array (epoch ns), for vectorized patient info lookup.
+    def signal_beds(self):
+        hospital, bed_unit, bed_id = self._msg_cols['hospital'], self._msg_cols['bed_unit'], self._msg_cols['bed_id']
+        return [(hospital[msg_idx], bed_unit[msg_idx], bed_id[msg_idx]) for msg_idx in self._sig_msg], _int64(self._sig_start)
+
+    def extend(self, other: "ColumnarBatch"):
+        # appends another batch, re-basing its message and signal indices.
+        msg_base, sig_base = len(self._msg_times), len(self._sig_msg)
+        intern = self._intern
+        self._msg_times.extend(other._msg_times)
+        for col, vals in other._msg_cols.items():
+            self._msg_cols[col].extend(vals if col == 'hl7_type' else [intern(v) for v in vals])
+        self._seg_id.extend(other._seg_id)
+        self._dir.extend(intern(v) for v in other._dir)
+        self._file.extend(intern(v) for v in other._file)
+
+        self._sig_msg.extend(i + msg_base for i in other._sig_msg)
+        self._sig_start.extend(other._sig_start)
+        self._sig_end.extend(other._sig_end)
+        for col, vals in other._sig_cols.items():
+            self._sig_cols[col].extend(intern(v) for v in vals)
+
+        self._row_sig.extend(i + sig_base for i in other._row_sig)
+        self._row_obx_start.extend(other._row_obx_start)
+        for col, vals in other._row_cols.items():
+            self._row_cols[col].extend(intern(v) for v in vals)
+        self._values.extend(other._values)
+        self._nvalues.extend(other._nvalues)
+        self._pd_samp_ms.extend(other._pd_samp_ms)
+        self._nsamp.extend(other._nsamp)
+
+    # flat values and row offsets, i.e. the values of row i are flat[offsets[i]:offsets[i+1]].
+    # numeric rows are concatenated into a numeric array, anything with strings gives an object array.
+    def ragged_values(self):
+        nvalues = _int64(self._nvalues)
+        offsets = np.zeros(len(nvalues) + 1, dtype=np.int64)
+        np.cumsum(nvalues, out=offsets[1:])
+        if len(self._values) == 0:
+            return np.zeros(0, dtype=np.float64), offsets
+        try:
+            flat = np.concatenate([np.asarray(v) for v in self._values])
+        except ValueError:
+            flat = None
+        if (flat is None) or (flat.dtype.kind not in 'iuf'):
+            flat = np.empty(offsets[-1], dtype=object)
+            for i, v in enumerate(self._values):
+                flat[offsets[i]:offsets[i+1]] = v
+        return flat, offsets
+
+    # parquet-ready column set:  column name to numpy array, 1 entry per row.  times are datetime64[ns] (UTC, naive),
+    # and values is an object array of the per-row lists/arrays.
+    def to_columns(self) -> dict:
+        row_sig = _int64(self._row_sig)
+        sig_msg = _int64(self._sig_msg)
+        row_msg = sig_msg[row_sig]
+
+        def _times(buf, index = None):
+            t = _int64(buf)
+            t = t if index is None else t[index]
+            return t.view('datetime64[ns]')
+
+        def _objects(vals, index = None):
+            arr = np.empty(len(vals), dtype=object)
+            arr[:] = vals
+            return arr if index is None else arr[index]
+
+        cols = {}
+        cols['msh_time'] = _times(self._msg_times, row_msg)
+        for col in MESSAGE_COLUMNS[1:]:
+            cols[col] = _objects(self._msg_cols[col], row_msg)
+        for col in PATIENT_COLUMNS:
+            cols[col] = _objects(self._sig_cols[col], row_sig)
+        cols['src'] = _objects(self._sig_cols['src'], row_sig)
+        cols['msg_type'] = _objects(self._sig_cols['msg_type'], row_sig)
+        cols['start_t'] = _times(self._sig_start, row_sig)
+        cols['end_t'] = _times(self._sig_end, row_sig)
+        cols['channel'] = _objects(self._row_cols['channel'])
+        cols['channel_id'] = _objects(self._row_cols['channel_id'])
+        cols['channel_type'] = _objects(self._row_cols['channel_type'])
+        cols['obx_start_t'] = _times(self._row_obx_start)
+        cols['values'] = _objects(self._values)
+        cols['value_type'] = _objects(self._row_cols['value_type'])
+        cols['UoM'] = _objects(self._row_cols['UoM'])
+        cols['ref_range'] = _objects(self._row_cols['ref_range'])
+        cols['pd_samp_ms'] = np.frombuffer(self._pd_samp_ms, dtype=np.float64).copy() if len(self._pd_samp_ms) > 0 else np.zeros(0, dtype=np.float64)
+        cols['nsamp'] = _int64(self._nsamp)
+        cols['seg_id'] = _int64(self._seg_id)[row_msg]
+        cols['dir'] = _objects(self._dir, row_msg)
+        cols['file'] = _objects(self._file, row_msg)
+        return cols
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.to_columns(), columns=list(BATCH_COLUMNS))
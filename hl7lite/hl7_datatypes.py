@@ -2,10 +2,11 @@ import pandas as pd
 import numpy as np
 # from datetime import datetime, timedelta
 import re
+import warnings
 
 from zoneinfo import ZoneInfo
 
-from hl7lite.parse_time_tz import c_parse_time, c_parse_time_batch
+from hl7lite.parse_time_tz import c_parse_time, c_parse_time_batch, c_parse_time_array
 
 # individually convert is slower than vectorized convert.
 # python's float() function wraps a C double and follows IEEE 754
@@ -138,107 +139,114 @@ def parse_time_python(time_strs, as_epoch_ns: bool = False):
 def parse_time(time_strs, as_epoch_ns: bool = False):
     if isinstance(time_strs, str):
         return c_parse_time(time_strs, as_epoch_ns=as_epoch_ns)
-    else:
+    elif isinstance(time_strs, list):
         return c_parse_time_batch(time_strs, as_epoch_ns=as_epoch_ns)
+    else:
+        # numpy S/U/object arrays and pandas Series:  1 pass over the column, with the fix_time corrections.  empty/missing is NaT.
+        out = c_parse_time_array(time_strs, as_epoch_ns=as_epoch_ns)
+        if isinstance(time_strs, pd.Series):
+            return pd.Series(out, index=time_strs.index, name=time_strs.name)
+        return out
 
 
 float_re = re.compile(r"^[-+]?((\d+\.*\d*)|(\.\d+))$") 
 int_re = re.compile(r"^[-+]?\d+$")
 
     
+# precompiled converters:  the datatype dispatch of convert_field is resolved once per (datatype, as_string),
+# leaving only the str / list-of-str check per call.  each entry is (str converter, list of str converter).
+def _numeric(data: str):
+    return float(data) if '.' in data else int(data)
+
+def _list_of_numeric(data: list):
+    any_floats = any(['.' in datum for datum in data])
+    if any_floats:
+        return list(map(float, data))
+    else:
+        return list(map(int, data))
+
+def _identity(data):
+    return data
+
+def _wrap(data: str):
+    return [data, ]
+
+def _join(data: list):
+    return '^'.join(s for s in data)
+
+def _no_list(datatype):
+    def convert(data: list):
+        raise ValueError(f"Cannot convert list {data} to {datatype} as target type is not a list of elemental types")
+    return convert
+
+_string_converters = {   # as_string=True.  not converting.
+    DataType.STR: (_identity, _join),
+    DataType.STR_OR_LIST: (_identity, _identity),
+    DataType.NUMERIC: (_identity, _no_list(DataType.NUMERIC)),
+    DataType.INT: (_identity, _no_list(DataType.INT)),
+    DataType.FLOAT: (_identity, _no_list(DataType.FLOAT)),
+    DataType.ANY: (_identity, _identity),
+    DataType.LIST_OF_STR: (_wrap, _identity),
+    DataType.LIST_OF_FLOAT: (_wrap, _identity),
+    DataType.LIST_OF_INT: (_wrap, _identity),
+    DataType.LIST_OF_NUMERIC: (_wrap, _identity),
+    DataType.DATETIME: (fix_time, _no_list(DataType.DATETIME)),   # strings are returned with the offset corrected.
+}
+
+_value_converters = {   # as_string=False.  converting.
+    DataType.STR: (_identity, _join),
+    DataType.STR_OR_LIST: (_identity, _identity),
+    DataType.ANY: (_identity, _identity),
+    DataType.LIST_OF_STR: (_wrap, _identity),
+    DataType.DATETIME: (parse_time, _no_list(DataType.DATETIME)),
+    DataType.NUMERIC: (_numeric, _no_list(DataType.NUMERIC)),
+    DataType.INT: (int, _no_list(DataType.INT)),
+    DataType.FLOAT: (float, _no_list(DataType.FLOAT)),
+    DataType.LIST_OF_NUMERIC: (lambda data: [_numeric(data), ], _list_of_numeric),
+    DataType.LIST_OF_INT: (lambda data: [int(data), ], lambda data: [int(datum) for datum in data]),
+    DataType.LIST_OF_FLOAT: (lambda data: [float(data), ], lambda data: [float(datum) for datum in data]),
+}
+
+
+def compile_field_converter(datatype: DataType, as_string : bool = True):
+    """
+    Return a callable data -> converted value, equivalent to convert_field(data, datatype, as_string).
+    """
+    converters = _string_converters if as_string else _value_converters
+    if datatype not in converters:
+        raise ValueError(f"Unsupported datatype {datatype}")
+    on_str, on_list = converters[datatype]
+    container_type = datatype[0][1]
+
+    def convert(data):
+        data_type = type(data)
+        if data_type is str:
+            return on_str(data) if len(data) > 0 else missing_values[container_type]
+        # can assume a list is a list of strings
+        if (data_type is list) and (type(data[0]) is str):
+            return on_list(data)
+        if data is None:
+            raise ValueError(f"Cannot convert None to {datatype}")
+        if as_string:
+            return None   # already converted, e.g. OBX.5
+        raise ValueError(f"Unsupported input type {data_type} for data (should be only str or list of strs): {data} to {datatype}")
+    return convert
+
+_field_converters = {(datatype, as_string): compile_field_converter(datatype, as_string)
+                     for as_string in (True, False)
+                     for datatype in (_string_converters if as_string else _value_converters)}
+
+
 def convert_field(data, datatype: DataType, as_string : bool = True):
     """
     Convert data to the specified DataType.
     data could be string, list of strings, float, int, list of float, or list of ints 
     datatype could be any of the DataType enum values.
     """
-    if data is None:
-        raise ValueError(f"Cannot convert None to {datatype}")
-    
-    ## not checked.  datatype has to be one of the ones defined in DataType
-    # if any(datatype == dt for dt in DataType.__dict__.values()):
-    #     pass
-    # else:
-    #     raise ValueError(f"Unsupported DataType {datatype} for data: {data}")
-    
-    is_str = (type(data) is str)
-    # can assume a list is a list of strings
-    is_list_of_str = (type(data) is list) and (type(data[0]) is str)
-    # is_list_of_str = isinstance(data, list) and ((datalen == 0) or all(isinstance(datum, str) for datum in data))
-
-    container_type = datatype[0][1]
-    # element_type = datatype[0][2]
-    if isinstance(data, str) and len(data) == 0:
-        return missing_values[container_type]
-
-    # ANY type mean no change.  e.g. OBX_5 which is obx value, and is converted previously.
-
-    if as_string:  # not converting.
-        if is_str:
-            match datatype:
-                case DataType.STR | DataType.STR_OR_LIST | DataType.NUMERIC | DataType.INT | DataType.FLOAT | DataType.ANY:
-                    return data
-                case DataType.LIST_OF_STR | DataType.LIST_OF_FLOAT | DataType.LIST_OF_INT | DataType.LIST_OF_NUMERIC:
-                    return [data, ]
-                case DataType.DATETIME:
-                    return fix_time(data)
-                case _:
-                    raise ValueError(f"Unsupported datatype {datatype} for string data: {data}")
-        elif is_list_of_str:
-            match datatype:
-                case DataType.STR_OR_LIST | DataType.LIST_OF_STR | DataType.LIST_OF_FLOAT | DataType.LIST_OF_INT | DataType.LIST_OF_NUMERIC | DataType.ANY:
-                    return data
-                case DataType.STR:
-                    return '^'.join(s for s in data)
-                case DataType.NUMERIC | DataType.INT | DataType.FLOAT | DataType.DATETIME:
-                    raise ValueError(f"Cannot convert list {data} to {datatype} as target type is not a list of elemental types")
-                case _:
-                    raise ValueError(f"Unsupported datatype {datatype} for list data: {data}")
-    else:  # converting.
-        if is_str:
-            match datatype:
-                case DataType.STR | DataType.STR_OR_LIST | DataType.ANY:
-                    return data
-                case DataType.LIST_OF_STR:
-                    return [data, ]
-                case DataType.DATETIME:
-                    return parse_time(fix_time(data))
-                case DataType.NUMERIC:
-                    return float(data) if '.' in data else int(data)
-                case DataType.INT:
-                    return int(data)
-                case DataType.FLOAT:
-                    return float(data)
-                case DataType.LIST_OF_NUMERIC:
-                    return [float(data), ] if '.' in data else [int(data), ]
-                case DataType.LIST_OF_INT:
-                    return [int(data), ]
-                case DataType.LIST_OF_FLOAT:
-                    return [float(data), ]
-                case _:
-                    raise ValueError(f"Unsupported datatype {datatype} for list data: {data}")
-        elif is_list_of_str:
-            match datatype:
-                case DataType.LIST_OF_STR | DataType.STR_OR_LIST | DataType.ANY:
-                    return data
-                case DataType.STR:
-                    return '^'.join(s for s in data)
-                case DataType.LIST_OF_INT:
-                    return [int(datum) for datum in data]
-                case DataType.LIST_OF_FLOAT:
-                    return [float(datum) for datum in data]
-                case DataType.LIST_OF_NUMERIC:
-                    any_floats = any(['.' in datum for datum in data])
-                    if any_floats:
-                        return list(map(float, data))
-                    else:
-                        return list(map(int, data))
-                case DataType.INT | DataType.FLOAT | DataType.NUMERIC | DataType.DATETIME:
-                    raise ValueError(f"Cannot convert list {data} to {datatype} as target type is not a list of elemental types")
-                case _:
-                    raise ValueError(f"Unsupported datatype {datatype} for list data: {data}")
-        else:
-            raise ValueError(f"Unsupported input type {type(data)} for data (should be only str or list of strs): {data} to {datatype}")
+    converter = _field_converters.get((datatype, as_string), None)
+    if converter is None:
+        raise ValueError(f"Unsupported datatype {datatype} for data: {data}")
+    return converter(data)
 
 
     # if as_string:  # not converting.
@@ -322,6 +330,62 @@ def convert_field(data, datatype: DataType, as_string : bool = True):
 
 
 
+# fast path for NA/NR (list of numeric) OBX.5 waveform payloads.
+# convert_field(LIST_OF_NUMERIC) splits the payload into a list of str, scans each element for '.',
+# then maps float or int over it into a list of boxed python numbers.
+# here the raw payload (str or bytes) is parsed by numpy in 1 pass directly into a typed array.
+# integer payloads are downcast to the smallest of int16/int32/int64 that holds the range,
+# decimal payloads are float64 (same values as float()), or float_dtype if specified (e.g. np.float32).
+_INT_DTYPES = (np.int16, np.int32)
+# np.fromstring saturates integers outside the int64 range to the int64 bounds, without an error, where int() is exact.
+# a value at a bound is taken as out of range, so the caller falls back to the int() path.
+_INT64_INFO = np.iinfo(np.int64)
+
+def _int64_saturated(mn, mx) -> bool:
+    return (mn <= _INT64_INFO.min) or (mx >= _INT64_INFO.max)
+
+def convert_numeric_payload(payload, float_dtype = np.float64, sep: str = '^') -> np.ndarray:
+    """
+    Convert a sep ('^') separated numeric payload (str or bytes) into a numpy array.
+    Raises ValueError if any element is not numeric.
+    """
+    if len(payload) == 0:
+        return np.empty(0, dtype=_INT_DTYPES[0])
+
+    if type(payload) is bytes:
+        is_float = b'.' in payload
+        count = payload.count(sep.encode()) + 1
+    else:
+        is_float = '.' in payload
+        count = payload.count(sep) + 1
+    # np.fromstring with sep stops at the first bad element, and only warns.  treat that as an error.
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            out = np.fromstring(payload, dtype = np.float64 if is_float else np.int64, sep = sep)
+        except DeprecationWarning:
+            out = None
+    if (out is None) or (len(out) != count):
+        raise ValueError(f"Cannot convert payload to numeric array: {payload[:50]}")
+
+    if is_float:
+        return out if (float_dtype is None) or (float_dtype == np.float64) else out.astype(float_dtype)
+    
+    mn, mx = out.min(), out.max()
+    if _int64_saturated(mn, mx):
+        raise ValueError(f"Integer payload out of int64 range: {payload[:50]}")
+    return out.astype(narrow_int_dtype(mn, mx), copy = False)
+
+
+# the smallest of int16/int32/int64 that holds the range [mn, mx].
+def narrow_int_dtype(mn, mx):
+    for dtype in _INT_DTYPES:
+        info = np.iinfo(dtype)
+        if (mn >= info.min) and (mx <= info.max):
+            return dtype
+    return np.int64
+
+
 def convert_column(data: pd.Series, datatype: DataType):
     """
     Convert data to the specified DataType.
@@ -1,16 +1,37 @@
 from hl7lite.hl7_datatypes import missing_values
-from hl7lite.hl7_tokenizer import get_with_default
+from hl7lite.hl7_tokenizer import field_accessor, get_tokenizer, find_raw_field, HL7_ENCODING
 from hl7lite.hl7_extractor_common import extract_bed_id, extract_pid
 from hl7lite.hl7_extractor_obx import extract_signal_name, extract_signal_id, extract_signal_uom, extract_pid_from_obx
 from hl7lite.hl7_datatypes import parse_time
 import numpy as np
 import pandas as pd
 from hl7lite.hl7_waveform import channel_to_type
+from hl7lite.hl7_columnar import ColumnarBatch
 import json
 
 import logging
 log = logging.getLogger(__name__)
 
+# compiled field accessors
+_get_msh_send_app = field_accessor('msh', 2)  # MSH.3 sending application
+_get_msh_time = field_accessor('msh', 6, as_string=True)  # MSH.7 message date/time
+_get_msh_type = field_accessor('msh', 8)  # MSH.9 message type
+_get_msh_control_id = field_accessor('msh', 9)  # MSH.10 control id
+_get_msh_deployment = field_accessor('msh', 10)  # MSH.11 production vs test
+_get_msh_profile = field_accessor('msh', 20)  # MSH.21 message profile
+_get_pv1_bed_type = field_accessor('pv1', 2)  # PV1.2 patient class
+_get_pv1_bed = field_accessor('pv1', 3)  # PV1.3 assigned patient location
+_get_obr_src = field_accessor('obr', 3)  # OBR.3 src target
+_get_obr_type = field_accessor('obr', 4)  # OBR.4 universal service identifier
+_get_obr_start_t = field_accessor('obr', 7, as_string=True)  # OBR.7 observation date/time
+_get_obr_end_t = field_accessor('obr', 8, as_string=True)  # OBR.8 observation end date/time
+_get_obr_bed = field_accessor('obr', 10)  # OBR.10 collector identifier
+_get_obr_env = field_accessor('obr', 13)  # OBR.13 environment
+_get_obr_source2 = field_accessor('obr', 21)  # OBR.21 source2
+_get_obx_valtype = field_accessor('obx', 2)  # OBX.2 value type
+_get_obx_time = field_accessor('obx', 14, as_string=True)  # OBX.14 date/time of the observation
+_get_obx_ref_range = field_accessor('obx', 7)  # OBX.7 reference range
+
 # organization:
 # MSH - 1 message
 # PID - patient info - PID_3 is empi_nbr, PID_18 is encounter_id
@@ -131,8 +152,40 @@ class HierarchicalMessage:
 #       OBX.21 may be have a channel id for some devices
 #       or the third entry in OBX.4 may indicate the channel id
 #       or it may need to be assigned 0.
+# 1 OBX of a Signal.  slotted record instead of a dict per OBX;  obx.value style access still works.
+class ObxAttribute:
+    __slots__ = ('valtype', 'type', 'code', 'channel_id', 'obx_time', 'UoM', 'value', 'ref_range')
+
+    def __init__(self, valtype, type, code, channel_id, obx_time, UoM, value, ref_range):
+        self.valtype = valtype
+        self.type = type
+        self.code = code
+        self.channel_id = channel_id
+        self.obx_time = obx_time
+        self.UoM = UoM
+        self.value = value
+        self.ref_range = ref_range
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self):
+        return f"ObxAttribute({self.to_dict()})"
+
+
 class Signal:
     # organization:  metadata include start, end, type, target, source, and each OBX is a separate attribute.
+    __slots__ = ('type', 'start_t', 'end_t', 'bed', 'env', 'source2', 'attributes')
+
     def __init__(self, obr: dict):
         # https://hl7.docs.careevolution.com/segments/obr.html
         # https://hl7.docs.careevolution.com/segments/obx.html
@@ -140,7 +193,7 @@ class Signal:
         
         # OBR.4 universal service identifier
         # get type - rom obr.4 universal service identifier
-        self.type = get_with_default(obr_field_list, 'obr', 4)[1]
+        self.type = _get_obr_type(obr_field_list)[1]
         
         # proceed if type is "MDC_OBS_WAVE_CTS" at OBR level.  this would mean there is an OBX with type NA
         if self.type == 'MDC_OBS_WAVE_CTS':  #"69121^MDC_OBS_WAVE_CTS^MDC":
@@ -162,23 +215,23 @@ class Signal:
         # self.id = get_with_default(obr_field_list, 1, 'int')
         
         # get time - OBR.7 and OBR.8 - Observation Date/Time and Observation End Date/Time
-        self.start_t = get_with_default(obr_field_list, 'obr', 7, as_string = True)
-        self.end_t = get_with_default(obr_field_list, 'obr', 8, as_string = True)
+        self.start_t = _get_obr_start_t(obr_field_list)
+        self.end_t = _get_obr_end_t(obr_field_list)
         
         # get location:  OBR.10 collector identifier
-        self.bed = get_with_default(obr_field_list, 'obr', 10)
-        self.env = get_with_default(obr_field_list, 'obr', 13)
+        self.bed = _get_obr_bed(obr_field_list)
+        self.env = _get_obr_env(obr_field_list)
 
         # src target
-        obr3 = get_with_default(obr_field_list, 'obr', 3)
+        obr3 = _get_obr_src(obr_field_list)
         # self.source1 = f"{obr3[1]}:{obr3[2]}"
-        self.source2 = get_with_default(obr_field_list, 'obr', 21)
+        self.source2 = _get_obr_source2(obr_field_list)
         
         self.attributes = {}
         for obx_fields in obr['obx']:
             #https://hl7.docs.careevolution.com/segments/obx.html
-            valtype = get_with_default(obx_fields, 'obx', 2)  #  OBX.2
-            obx_time = get_with_default(obx_fields, 'obx', 14, as_string=True)  # OBX.14 Date/Time of the Observation
+            valtype = _get_obx_valtype(obx_fields)  #  OBX.2
+            obx_time = _get_obx_time(obx_fields)  # OBX.14 Date/Time of the Observation
 
             (obx_name, code) = extract_signal_name(obx_fields)  # OBX.3 observation identifier
             channel_id = extract_signal_id(obx_fields)
@@ -194,27 +247,19 @@ class Signal:
             # # drop if sig_name is "Patient Monitor, Physiologic Multi-Parameter"
             # if (sig_name == "Patient Monitor, Physiologic Multi-Parameter"):
             #     continue
-            ref_range = get_with_default(obx_fields, 'obx', 7)
+            ref_range = _get_obx_ref_range(obx_fields)
         
-            self.attributes[obx_name] = {'valtype': valtype, 
-                                         'type': obx_name, 
-                                         'code': code,
-                                         'channel_id': channel_id, 
-                                         'obx_time': obx_time, 
-                                         'UoM' : unit_of_meas, 
-                                         'value': data,
-                                         'ref_range': ref_range,
-                                         }
+            self.attributes[obx_name] = ObxAttribute(valtype, obx_name, code, channel_id, obx_time, unit_of_meas, data, ref_range)
 
     def __repr__(self):
         attrs = []
         for key, value in self.attributes.items():
-            obxstr = f"{key}:: valtype: {value['valtype']} type: {value['type']}, code: {value['code']}, chan_id: {value['channel_id']} unit:{value['UoM']} time:{value['obx_time']}"
+            obxstr = f"{key}:: valtype: {value.valtype} type: {value.type}, code: {value.code}, chan_id: {value.channel_id} unit:{value.UoM} time:{value.obx_time}"
             
-            if isinstance(value['value'], list) and (len(value['value']) > 5):
-                obxstr += f"{len(value['value'])} value {value['value'][:5]}..."
+            if isinstance(value.value, (list, np.ndarray)) and (len(value.value) > 5):
+                obxstr += f"{len(value.value)} value {value.value[:5]}..."
             else:
-                obxstr += f"{value['value']}"
+                obxstr += f"{value.value}"
                 
             attrs.append(f"\t\t\t{obxstr}")
         attributes_str = "\n".join(attrs)
@@ -259,22 +304,28 @@ class Signal:
 #   ['']],
 #  [['PV1'], [''], ['I'], ['EUH-4TN-T435'], ['']],
 
+# slotted:  a file's worth of messages is held in memory before the rows are built.
+# keep_message=False drops the parse tree (orig_message) once the fields are extracted.
 class HL7Data:
-    def __init__(self, message: HierarchicalMessage):
-        self.orig_message = message
-        self.msh_time = get_with_default(message.msh, 'msh', 6, as_string=True) #MSH.7
-        self.msh_send_app = get_with_default(message.msh, 'msh', 2) #MSH.3
-        self.control_id = get_with_default(message.msh, 'msh', 9)  # MSH.10
-        self.deployment = get_with_default(message.msh, 'msh', 10)  # MSH.11
-        self.msh_type = get_with_default(message.msh, 'msh', 8) # MSH.9
+    __slots__ = ('orig_message', 'msh_time', 'msh_send_app', 'control_id', 'deployment', 'msh_type',
+                 'pid', 'pid_visit', 'pid_first_name', 'pid_last_name', 'pid_middle_initial', 'msh_profile', 'message_type',
+                 'pv1_bed_type', 'pv1_bed', 'hospital', 'bed_unit', 'bed_id')
+
+    def __init__(self, message: HierarchicalMessage, keep_message: bool = True):
+        self.orig_message = message if keep_message else None
+        self.msh_time = _get_msh_time(message.msh) #MSH.7
+        self.msh_send_app = _get_msh_send_app(message.msh) #MSH.3
+        self.control_id = _get_msh_control_id(message.msh)  # MSH.10
+        self.deployment = _get_msh_deployment(message.msh)  # MSH.11
+        self.msh_type = _get_msh_type(message.msh) # MSH.9
         self.pid, self.pid_visit, self.pid_first_name, self.pid_last_name = extract_pid(message.pid, message.pv1)
         self.pid_middle_initial = missing_values[str]
-        self.msh_profile = get_with_default(message.msh, 'msh', 20)[0] if len(message.msh) > 20 else missing_values[str]
+        self.msh_profile = _get_msh_profile(message.msh)[0] if len(message.msh) > 20 else missing_values[str]
         self.message_type = "Other"
         
         # https://hl7.docs.careevolution.com/segments/pv1.html
-        self.pv1_bed_type = get_with_default(message.pv1, 'pv1', 2)
-        self.pv1_bed = get_with_default(message.pv1, 'pv1', 3)
+        self.pv1_bed_type = _get_pv1_bed_type(message.pv1)
+        self.pv1_bed = _get_pv1_bed(message.pv1)
         self.hospital, self.bed_unit, self.bed_id = extract_bed_id(self.pv1_bed)
 
     def get_pid_loc_mapping(self):
@@ -330,10 +381,25 @@ class HL7Data:
         res = self._to_row_dicts(for_serialization=True, time_as_epoch=time_as_epoch)
         return json.dumps(res) if len(res) > 0 else ''
 
+    # columnar alternative to to_row_dicts.  adds the message level values to batch and returns the message index.
+    # rows are only added per signal (see HL7ORUData), so a message without signals adds no rows.
+    def append_to_batch(self, batch: ColumnarBatch) -> int:
+        return batch.add_message(self._get_time_repr(self.msh_time, time_as_epoch=True),
+                                 self.msh_profile, self.msh_type, self.control_id, self.deployment,
+                                 self.hospital, self.bed_unit, self.bed_id)
+
+    def _add_signal_to_batch(self, batch: ColumnarBatch, msg_idx: int, signal) -> int:
+        return batch.add_signal(msg_idx, signal.source2, signal.type,
+                                self._get_time_repr(signal.start_t, time_as_epoch=True),
+                                self._get_time_repr(signal.end_t, time_as_epoch=True),
+                                self.pid, self.pid_visit, self.pid_first_name, self.pid_last_name, self.pid_middle_initial)
+
 
 class HL7ORUData(HL7Data):
-    def __init__(self, message: HierarchicalMessage):
-        super().__init__(message)
+    __slots__ = ('signals',)
+
+    def __init__(self, message: HierarchicalMessage, keep_message: bool = True):
+        super().__init__(message, keep_message)
         self.signals = []
         for obr in message.obrs:
             # https://hl7.docs.careevolution.com/segments/obr.html
@@ -363,13 +429,13 @@ class HL7ORUData(HL7Data):
             if (channel == missing_values[str]):
                 continue
             
-            channel_id = obx['channel_id']
+            channel_id = obx.channel_id
             
-            values = obx['value']  # type conversion in hl7_parser
-            valtype = obx['valtype']
-            UoM = obx['UoM']
-            ref_range = obx['ref_range']
-            obx_start = obx['obx_time']
+            values = obx.value  # type conversion in hl7_parser
+            valtype = obx.valtype
+            UoM = obx.UoM
+            ref_range = obx.ref_range
+            obx_start = obx.obx_time
             sample_interval_ms = missing_values[float]
 
             nsamples = 1
@@ -402,7 +468,7 @@ class HL7ORUData(HL7Data):
                     'channel_id': channel_id,
                     'channel_type': channel_to_type.get(channel, 'other'),
                     'obx_start_t': HL7Data._get_time_repr(self, obx_start, for_serialization=for_serialization, time_as_epoch=time_as_epoch),
-                    'values': values if type(values) is list else [values,],  # parquet does not allow mixed types.
+                    'values': values if isinstance(values, (list, np.ndarray)) else [values,],  # parquet does not allow mixed types.  numpy arrays are kept as is.
                     'value_type': valtype,  # not used.
                     'UoM': UoM,
                     'ref_range': ref_range,
@@ -420,10 +486,25 @@ class HL7ORUData(HL7Data):
         res = self._to_row_dicts(for_serialization=True, time_as_epoch=time_as_epoch)
         return json.dumps(res) if len(res) > 0 else ''
 
+    # same rows as to_row_dicts, appended to the batch columns.
+    def append_to_batch(self, batch: ColumnarBatch) -> int:
+        msg_idx = HL7Data.append_to_batch(self, batch)
+        for signal in self.signals:
+            sig_idx = self._add_signal_to_batch(batch, msg_idx, signal)
+            for (channel, channel_id, obx_start, values, valtype, UoM, ref_range, _, nsamples) in self._extract_from_signal(signal):
+                if nsamples == 0:
+                    log.error(f"{self.bed_id} empty list {channel}, {signal.start_t}")
+                batch.add_row(sig_idx, channel, channel_id, channel_to_type.get(channel, 'other'),
+                              self._get_time_repr(obx_start, time_as_epoch=True),
+                              values, valtype, UoM, ref_range, missing_values[float], 1)
+        return msg_idx
+
 
 class HL7AlarmData(HL7ORUData):
-    def __init__(self, message: HierarchicalMessage):
-        super().__init__(message)
+    __slots__ = ()
+
+    def __init__(self, message: HierarchicalMessage, keep_message: bool = True):
+        super().__init__(message, keep_message)
         self.message_type = 'Alarm'
 
     def __repr__(self):
@@ -434,8 +515,10 @@ class HL7AlarmData(HL7ORUData):
 
 
 class HL7WaveformData(HL7ORUData):
-    def __init__(self, message: HierarchicalMessage):
-        super().__init__(message)
+    __slots__ = ()
+
+    def __init__(self, message: HierarchicalMessage, keep_message: bool = True):
+        super().__init__(message, keep_message)
         self.message_type = 'Waveform'
 
     def __repr__(self):
@@ -457,19 +540,19 @@ class HL7WaveformData(HL7ORUData):
         # only process waveform types.  assume these are the ones with end_t
         # get the other value
         for name, obx in signal.attributes.items():
-            if (obx['valtype'] == "NA"):
+            if (obx.valtype == "NA"):
                 channel = name
-                channel_id = obx['channel_id']
+                channel_id = obx.channel_id
                 
-                values = obx['value']  # type conversion in hl7_parser
-                valtype = obx['valtype']
-                UoM = obx['UoM']
-                ref_range = obx['ref_range']
+                values = obx.value  # type conversion in hl7_parser
+                valtype = obx.valtype
+                UoM = obx.UoM
+                ref_range = obx.ref_range
 
-                obx_start = obx['obx_time']
+                obx_start = obx.obx_time
             elif "TIME_PD_SAMP" in name:
                 # type convert handled by hl7 parser
-                samp_interval_ms = obx['value'] if obx['value'] != missing_values[str] else missing_values[float]
+                samp_interval_ms = obx.value if obx.value != missing_values[str] else missing_values[float]
 
         if isinstance(values, (list, np.ndarray)):
             nsamples = len(values)
@@ -502,7 +585,7 @@ class HL7WaveformData(HL7ORUData):
                 'channel_id': channel_id,
                 'channel_type': channel_to_type.get(channel, 'other_waveform'),
                 'obx_start_t': HL7Data._get_time_repr(self, obx_start, for_serialization=for_serialization, time_as_epoch=time_as_epoch),
-                'values': values if type(values) is list else [values,],  # parquet does not allow mixed types
+                'values': values if isinstance(values, (list, np.ndarray)) else [values,],  # parquet does not allow mixed types.  numpy arrays are kept as is.
                 'value_type': valtype,
                 'UoM': UoM,
                 'ref_range': ref_range,
@@ -520,11 +603,32 @@ class HL7WaveformData(HL7ORUData):
         res = self._to_row_dicts(for_serialization=True, time_as_epoch=time_as_epoch)
         return json.dumps(res) if len(res) > 0 else ''
 
+    # same rows as to_row_dicts, appended to the batch columns.
+    def append_to_batch(self, batch: ColumnarBatch) -> int:
+        msg_idx = HL7Data.append_to_batch(self, batch)
+        for signal in self.signals:
+            (channel, channel_id, obx_start,
+                values, valtype, UoM, ref_range, samp_interval_ms, nsamples) = self._extract_from_signal(signal)
+            if nsamples == 1:
+                log.warning(f"{self.bed_id} single sample list {channel}, {signal.start_t}")
+            elif nsamples == 0:
+                log.error(f"{self.bed_id} empty list {channel}, {signal.start_t}")
+
+            sig_idx = self._add_signal_to_batch(batch, msg_idx, signal)
+            batch.add_row(sig_idx, channel, channel_id, channel_to_type.get(channel, 'other_waveform'),
+                          self._get_time_repr(obx_start, time_as_epoch=True),
+                          values, valtype, UoM, ref_range,
+                          samp_interval_ms if pd.notna(samp_interval_ms) else missing_values[float],
+                          nsamples if pd.notna(nsamples) else 1)
+        return msg_idx
+
 HL7ECGData = HL7WaveformData
 
 class HL7VitalsData(HL7ORUData):
-    def __init__(self, message: HierarchicalMessage):
-        super().__init__(message)
+    __slots__ = ('pid2', 'pid_visit2', 'pid_first_name2', 'pid_last_name2', 'pid_middle_initial2', 'pid_time2')
+
+    def __init__(self, message: HierarchicalMessage, keep_message: bool = True):
+        super().__init__(message, keep_message)
 
         self.pid2, self.pid_visit2, self.pid_first_name2, \
             self.pid_last_name2, self.pid_middle_initial2, self.pid_time2 = \
@@ -561,8 +665,10 @@ class HL7VitalsData(HL7ORUData):
         return f"Vitals MSH time={self.msh_time}, source={self.msh_profile}, PID={self.pid}, VISIT={self.pid_visit}, PV1 bed={self.bed_id}\n" + "\n".join(signalstr)
 
 class HL7ADTData(HL7Data):
-    def __init__(self, message: HierarchicalMessage):
-        super().__init__(message)
+    __slots__ = ()
+
+    def __init__(self, message: HierarchicalMessage, keep_message: bool = True):
+        super().__init__(message, keep_message)
         self.message_type = 'ADT'
         
     def __repr__(self):
@@ -570,23 +676,82 @@ class HL7ADTData(HL7Data):
 
 
 # dispatcher.
-def hl7_data_factory(omsg: HierarchicalMessage):
+# keep_message=False does not keep omsg in the returned data (orig_message is None).
+def hl7_data_factory(omsg: HierarchicalMessage, keep_message: bool = True):
     hl7_type = omsg.msh[8][0]   # MSH_9
     if hl7_type == "ORU":
         # get the first OBR to determine type
         obr = omsg.obrs[0]['obr']
-        obr_type = get_with_default(obr, 'obr', 4)[0]
+        obr_type = _get_obr_type(obr)[0]
         if obr_type == '182777000':  # monitoring of patient
-            return HL7VitalsData(omsg)
+            return HL7VitalsData(omsg, keep_message)
         elif obr_type == '196616':  # alarm event
-            return HL7AlarmData(omsg)
+            return HL7AlarmData(omsg, keep_message)
         elif obr_type == '69121':  # waveform
-            return HL7WaveformData(omsg)
+            return HL7WaveformData(omsg, keep_message)
         else:
             raise ValueError(f"[ERROR] skipping unknown OBR type {obr_type}.")
         
     elif hl7_type == "ADT":
-        return HL7ADTData(omsg)
+        return HL7ADTData(omsg, keep_message)
     else:
         raise ValueError(f"[ERROR] skipping unknown message type {hl7_type}.")
-        
\ No newline at end of file
+        
+
+
+# message kinds, same as the message_type of the HL7Data subclass that hl7_data_factory would create.
+MESSAGE_KINDS = ('Waveform', 'Vitals', 'Alarm', 'ADT', 'Other')
+_obr_type_to_kind = {
+    '69121': 'Waveform',   # MDC_OBS_WAVE_CTS
+    '182777000': 'Vitals', # monitoring of patient
+    '196616': 'Alarm',     # MDC_EVT_ALARM
+}
+
+# first component of a raw field, decoded.
+def _raw_first_component(hl7_str, seg_start: int, seg_end: int, index: int, field_sep, component_sep) -> str:
+    field = find_raw_field(hl7_str, seg_start, seg_end, index, field_sep)
+    if field is None:
+        return ''
+    comp_end = field.find(component_sep)
+    comp = field if comp_end < 0 else field[:comp_end]
+    return comp.decode(HL7_ENCODING, errors = 'replace') if type(comp) is bytes else comp
+
+# end of the segment that starts at seg_start
+def _raw_segment_end(hl7_str, seg_start: int, end: int, cr, lf) -> int:
+    cr_pos = hl7_str.find(cr, seg_start, end)
+    lf_pos = hl7_str.find(lf, seg_start, end)
+    if cr_pos < 0:
+        return end if lf_pos < 0 else lf_pos
+    return cr_pos if (lf_pos < 0) or (cr_pos < lf_pos) else lf_pos
+
+# pre-classifier:  determine the message kind from the raw message text (str or bytes), without tokenizing.
+# reads MSH.9 and, for ORU, OBR.4 of the first OBR, the same fields hl7_data_factory dispatches on.
+# this lets a reader skip message kinds it does not need (e.g. the large waveform messages in a vitals-only job) before any parsing.
+def classify_raw_message(hl7_str, start: int = 0, end: int = None) -> str:
+    """
+    Return the kind of the message between start and end:  'Waveform', 'Vitals', 'Alarm', 'ADT', or 'Other'.
+    """
+    end = len(hl7_str) if end is None else end
+    tokenizer = get_tokenizer(hl7_str[start + 3:start + 8])
+    if type(hl7_str) is str:
+        field_sep, component_sep, cr, lf, obr = tokenizer.field, tokenizer.component, '\r', '\n', 'OBR'
+    else:   # bytes, or a memory map of the file
+        field_sep, component_sep, cr, lf, obr = tokenizer.field_b, tokenizer.component_b, b'\r', b'\n', b'OBR'
+
+    msh_end = _raw_segment_end(hl7_str, start, end, cr, lf)
+    hl7_type = _raw_first_component(hl7_str, start, msh_end, 8, field_sep, component_sep)  # MSH.9
+    if hl7_type == 'ADT':
+        return 'ADT'
+    elif hl7_type != 'ORU':
+        return 'Other'
+    
+    # first OBR segment:  "OBR|" at the start of a line.
+    obr_label = obr + field_sep
+    pos = hl7_str.find(obr_label, msh_end, end)
+    while (pos >= 0) and (hl7_str[pos - 1:pos] not in (cr, lf)):
+        pos = hl7_str.find(obr_label, pos + 1, end)
+    if pos < 0:
+        return 'Other'
+    obr_type = _raw_first_component(hl7_str, pos, _raw_segment_end(hl7_str, pos, end, cr, lf), 4, field_sep, component_sep)  # OBR.4
+    return _obr_type_to_kind.get(obr_type, 'Other')
+
@@ -1,27 +1,79 @@
 #%%
-from hl7lite.hl7_tokenizer import get_with_default
+from hl7lite.hl7_tokenizer import field_accessor
 from hl7lite.hl7_datatypes import missing_values
 import re
 import json
+import functools
 
 import logging
 log = logging.getLogger(__name__)
 
+# compiled field accessors
+_get_pid_mrn = field_accessor('pid', 3)  # PID.3 patient identifier list
+_get_pid_name = field_accessor('pid', 5)  # PID.5 patient name
+_get_pid_visit = field_accessor('pid', 18)  # PID.18 visit number
+_get_pv1_visit = field_accessor('pv1', 19)  # PV1.19 visit number
+
 #%%
 
 import importlib.resources as _importlib_resources
-with _importlib_resources.open_text("emory", "bed_location_mappings.json") as f:
-    all_bed_location_mappings = json.load(f)
-    _bed_wildcard_to_unit = all_bed_location_mappings["bed_wildcard_to_unit"]
-    _unit_to_canonical = all_bed_location_mappings["unit_to_canonical"]
-    _hospital_to_canonical = all_bed_location_mappings["hospital_to_canonical"]
-
-    _canonical_units = set([unit for _, unit in _unit_to_canonical.values()])
 
-    _canonical_hospitals = set([hosp for hosp, _ in _unit_to_canonical.values()])
+all_bed_location_mappings = {}
+_bed_wildcard_to_unit = {}
+_bed_wildcard_index = {}        # compiled _bed_wildcard_to_unit, see _compile_wildcard_index
+_bed_wildcard_index_short = {}  # same, for bed ids with a single trailing digit
+_bed_wildcard_index_lettered = {}  # same, for NICU bed ids with a trailing room letter (NICU210A)
+_bed_wildcard_prefixes = []     # (prefix, unit) of the wildcards ending in a single '?' (EMS?), longest prefix first
+_unit_to_canonical = {}
+_hospital_to_canonical = {}
+_canonical_units = set()
+_canonical_hospitals = set()
+
+# (re)load the bed/location mappings.  default is emory/bed_location_mappings.json.
+# the mapping dicts and sets are updated in place, so modules that imported them see the new mappings.
+# the extract_bed_id cache is cleared, since cached locations may be resolved differently under the new mappings.
+def reload_bed_location_mappings(mapping_file: str = None):
+    if mapping_file is None:
+        with _importlib_resources.open_text("emory", "bed_location_mappings.json") as f:
+            mappings = json.load(f)
+    else:
+        with open(mapping_file, 'r') as f:
+            mappings = json.load(f)
+
+    all_bed_location_mappings.clear()
+    all_bed_location_mappings.update(mappings)
+    _bed_wildcard_to_unit.clear()
+    _bed_wildcard_to_unit.update(mappings["bed_wildcard_to_unit"])
+    _bed_wildcard_index.clear()
+    _bed_wildcard_index.update(_compile_wildcard_index(_bed_wildcard_to_unit))
+    # room numbers are assumed to vary by 2 digits, even if only 1 is presented:  'ICU 7' matches 'ICU ??'
+    _bed_wildcard_index_short.clear()
+    _bed_wildcard_index_short.update(_compile_wildcard_index({wildcard[:-1] : unit for wildcard, unit in _bed_wildcard_to_unit.items() 
+                                                               if wildcard.endswith('??')}))
+    # NICU beds may have a room letter after the last digit:  'NICU210A' matches 'NICU21??', 'NICU4A' matches 'NICU??'
+    _bed_wildcard_index_lettered.clear()
+    _bed_wildcard_index_lettered.update(_compile_wildcard_index({wildcard[:-1] : unit for wildcard, unit in _bed_wildcard_to_unit.items() 
+                                                                  if wildcard.startswith('NICU') and wildcard.endswith('??')}))
+    # a single trailing '?' matches any rest of the bed id:  'EMS?' matches 'EMS1', 'EMSH' and 'EMS1-01'
+    _bed_wildcard_prefixes.clear()
+    _bed_wildcard_prefixes.extend(sorted(((wildcard[:-1], unit) for wildcard, unit in _bed_wildcard_to_unit.items()
+                                          if wildcard.endswith('?') and not wildcard.endswith('??')), key=lambda x: -len(x[0])))
+    _unit_to_canonical.clear()
+    _unit_to_canonical.update(mappings["unit_to_canonical"])
+    _hospital_to_canonical.clear()
+    _hospital_to_canonical.update(mappings["hospital_to_canonical"])
+
+    _canonical_units.clear()
+    _canonical_units.update([unit for _, unit in _unit_to_canonical.values()])
+
+    _canonical_hospitals.clear()
+    _canonical_hospitals.update([hosp for hosp, _ in _unit_to_canonical.values()])
 
     _hospital_to_canonical.update({hosp : hosp for hosp in _canonical_hospitals})
 
+    _extract_bed_id_cached.cache_clear()
+
+
 
 #%%
 
@@ -40,7 +92,7 @@ def extract_pid(pid: list, pv1: list) -> tuple:
     
     # https://rhapsody.health/resources/hl7-pid-segment/
     # keeping pid 3 internal id, 18 account number (treat as visit id?), 5 patient name
-    _mrn = get_with_default(pid, 'pid', 3)
+    _mrn = _get_pid_mrn(pid)
     if isinstance(_mrn, list) and ((len(_mrn) == 5) or (len(_mrn) == 1)):
         _mrn = _mrn[0]
     elif (isinstance(_mrn, str)):
@@ -50,7 +102,7 @@ def extract_pid(pid: list, pv1: list) -> tuple:
     else:
         raise ValueError(f"Unexpected PID.3 format {pid[3]}. Expected list with 5 or 1 elements, or a non-empty string.")
     
-    name = get_with_default(pid, 'pid', 5)
+    name = _get_pid_name(pid)
     if isinstance(name, str):
         _last_name = name
         _first_name = missing_values[str]
@@ -68,7 +120,7 @@ def extract_pid(pid: list, pv1: list) -> tuple:
         raise ValueError(f"Unexpected PID.5 format {pid[5]}. Expected str or list, got {type(pid[5])}")
     
     # while PV1.19 is supposed to be the visit id, it is a common practice to use pid.18 for visit/csn,
-    _visit = get_with_default(pid, 'pid', 18)  # pid.18 visit number
+    _visit = _get_pid_visit(pid)  # pid.18 visit number
     if isinstance(_visit, str):
         _visit = _visit
     elif isinstance(_visit, list):
@@ -86,7 +138,7 @@ def extract_pid(pid: list, pv1: list) -> tuple:
     
     
     # fallback to pv1_19.   Don't have examples of this.
-    _visit = get_with_default(pv1, 'pv1', 19)  # pv1.19 visit number
+    _visit = _get_pv1_visit(pv1)  # pv1.19 visit number
     if isinstance(_visit, str):
         _visit = _visit
     else:
@@ -113,48 +165,6 @@ def _canonicalize_bed_id_sj(bed_unit: str, bed_id: str) -> str:
     else:
         return bed_id
     
-# cases:
-#   xxxx??, xxxx-??
-#   T4??, t4??-01
-#   ER??01, PA??01
-#   NICU21??, NICU41??
-
-# assume bed room id varies by 2 digits, even if only 1 is presented.
-sub_re = re.compile(r'\d{1,2}$')  # trailing 1 or 2 digits
-# replace 
-EJCHNICUsub_re = re.compile(r'\d[A-Za-z]$') # trailing digit and letter
-EJCHNICUsub2_re = re.compile(r'\d{2}$') # trailing digits
-EUHmatch_re = re.compile(r'^([A-Za-z]\d)\d{2}(-01)?$')  # T4??-01 or T4??
-EDHmatch_re = re.compile(r'^([A-Za-z]+)\d{2}(-?)01$')  # PA??01 or ER??01
-def _bed_id_to_wildcard(bed_id: str) -> str:
-    first2 = bed_id[:2]
-    
-    if first2 in ['ER', 'PA']:
-        match = EDHmatch_re.match(bed_id)
-        if not match:
-            raise ValueError(f"Expected match for special bed prefix {bed_id} ")
-        output = match.group(1) + '??' + (match.group(2) if match.group(2) else '') + '01'
-    elif (len(bed_id) >= 4) and bed_id[0].isalpha() and bed_id[1].isdigit():
-        # include "T434" but exclude "N28"
-        match = EUHmatch_re.match(bed_id)
-        if not match:
-            raise ValueError(f"Expected match for special bed prefix {bed_id} ")
-        output = match.group(1) + '??' + (match.group(2) if match.group(2) else '')
-    elif bed_id.startswith('EMS'):
-        output = 'EMS?'
-    elif bed_id.startswith('NICU') and (bed_id[-1] in ['A', 'B']) :
-        # replace the last digit and letter.
-        output = EJCHNICUsub_re.sub('??', bed_id)
-    elif bed_id.startswith('NICU') and (bed_id[-3:] in ['-01', '-02']):
-        # replace the last 3 characters.
-        output = EJCHNICUsub2_re.sub('??', bed_id)
-    else:
-        # replace the final 2 char.
-        output = sub_re.sub('??', bed_id)
-
-    return output
-
-
 # for bed id extraction using EPIC format - 11 components.  should have 'DEPID' at the end.
 def _extract_bed_id_epic(pv1_bed) -> tuple:
     if (pv1_bed[10] != 'DEPID'):
@@ -355,7 +365,7 @@ def _extract_bed_id_str(pv1_bed) -> tuple:
             bed_unit = tokens[1]
             if bed_unit[0].isdigit() and bed_unit[1].isdigit():
                 bed_id = "-".join(tokens[1:])
-                bed_unit = _bed_wildcard_to_unit.get(_bed_id_to_wildcard(bed_id)) # replace room number with wildcard to look up unit.
+                bed_unit = _lookup_unit_from_bed(bed_id, None) # match room number against the wildcards to look up unit.
             else:
                 bed_id = _canonicalize_bed_id_euh(bed_unit, tokens[2])
         elif (tokens[2] == 'CART'):
@@ -368,11 +378,50 @@ def _extract_bed_id_str(pv1_bed) -> tuple:
 
     return (hospital, bed_unit, bed_id)
 
+# compile the wildcard to unit table for direct matching of bed ids.  '?' matches 1 digit (room numbers).
+# index is bed id length -> list of (literal prefix length, {literal prefix: [(wildcard positions, remaining literal (position, char)s, unit)]}),
+# longest prefix first, so exact entries win over wildcards, and more specific wildcards win over less specific ones:
+#   'T4??-01' -> {7: [(2, {'T4': [((2, 3), ((4, '-'), (5, '0'), (6, '1')), unit)]})]}
+def _compile_wildcard_index(wildcard_to_unit: dict) -> dict:
+    index = {}
+    for wildcard, unit in wildcard_to_unit.items():
+        qpos = wildcard.find('?')
+        prefix_len = len(wildcard) if qpos < 0 else qpos
+        wild = tuple(i for i, c in enumerate(wildcard) if c == '?')
+        rest = tuple((i, c) for i, c in enumerate(wildcard) if (i >= prefix_len) and (c != '?'))
+        buckets = index.setdefault(len(wildcard), {})
+        buckets.setdefault(prefix_len, {}).setdefault(wildcard[:prefix_len], []).append((wild, rest, unit))
+    return {length: sorted(buckets.items(), key=lambda x: -x[0]) for length, buckets in index.items()}
+
+
+def _match_wildcard_index(index: dict, bed_id: str):
+    for prefix_len, by_prefix in index.get(len(bed_id), ()):
+        candidates = by_prefix.get(bed_id[:prefix_len])
+        if candidates is None:
+            continue
+        for wild, rest, unit in candidates:
+            if all(bed_id[i].isdigit() for i in wild) and all(bed_id[i] == c for i, c in rest):
+                return unit
+    return None
+
+
 # prefix_re = re.compile(r'^([A-Za-z]+[ -]*)[0-9]$')
 def _lookup_unit_from_bed(bed_id, default : str = missing_values[str]) -> str:
+    for prefix, unit in _bed_wildcard_prefixes:
+        if bed_id.startswith(prefix):
+            return unit
+    unit = _match_wildcard_index(_bed_wildcard_index, bed_id)
+    if (unit is None) and (len(bed_id) > 1) and bed_id[-1].isdigit() and not bed_id[-2].isdigit():
+        unit = _match_wildcard_index(_bed_wildcard_index_short, bed_id)
+    if (unit is None) and bed_id.startswith('NICU') and (bed_id[-1] in ['A', 'B']) and (len(bed_id) > 1) and bed_id[-2].isdigit():
+        unit = _match_wildcard_index(_bed_wildcard_index_lettered, bed_id[:-1])
+    return default if unit is None else unit
 
-    bed_wildcard = _bed_id_to_wildcard(bed_id)
-    return _bed_wildcard_to_unit.get(bed_wildcard, default)
+
+# batch version of _lookup_unit_from_bed, for a list or array of bed ids.  each distinct bed id is matched once.
+def lookup_units_from_beds(bed_ids, default : str = missing_values[str]) -> list:
+    units = {bed_id : _lookup_unit_from_bed(bed_id, default) for bed_id in set(bed_ids)}
+    return [units[bed_id] for bed_id in bed_ids]
 
 
 def _canonicalize_location_id(orig, hospital, bed_unit, bed_id) -> tuple:
@@ -428,7 +477,7 @@ def _canonicalize_location_id(orig, hospital, bed_unit, bed_id) -> tuple:
     return(out_hospital, out_bed_unit, out_bed_id)
 
 # Compile a regular expression to parse a string of the form EUH-4TN-T434 into 3 parts separated by '-'
-def extract_bed_id(pv1_bed) -> tuple:
+def _extract_bed_id(pv1_bed) -> tuple:
     
     if pv1_bed is None or len(pv1_bed) == 0:
         raise ValueError(f"PV1 bed identifier is missing or empty: {pv1_bed}")
@@ -463,3 +512,31 @@ def extract_bed_id(pv1_bed) -> tuple:
 
     # bed_str = "|".join([hospital, bed_unit, bed_id])
     return _canonicalize_location_id(pv1_bed, hospital, bed_unit, bed_id)
+
+
+# a bed sends thousands of messages per hour with the same PV1.3, so the location resolution is cached,
+# keyed by the raw PV1.3 value (the string, or the tuple of components).  errors are not cached, and
+# the log messages from the resolution are emitted on the first (uncached) lookup only.
+BED_ID_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=BED_ID_CACHE_SIZE)
+def _extract_bed_id_cached(pv1_key) -> tuple:
+    return _extract_bed_id(list(pv1_key) if isinstance(pv1_key, tuple) else pv1_key)
+
+
+def extract_bed_id(pv1_bed) -> tuple:
+    pv1_key = tuple(pv1_bed) if isinstance(pv1_bed, list) else pv1_bed
+    try:
+        hash(pv1_key)
+    except TypeError:
+        # nested components (subcomponents) are not hashable.  not cached.
+        return _extract_bed_id(pv1_bed)
+    return _extract_bed_id_cached(pv1_key)
+
+
+# hit/miss counters of the extract_bed_id cache (functools CacheInfo: hits, misses, maxsize, currsize)
+def bed_id_cache_info():
+    return _extract_bed_id_cached.cache_info()
+
+
+reload_bed_location_mappings()
@@ -1,11 +1,20 @@
 
 
 #%%
-from hl7lite.hl7_tokenizer import get_with_default
+from hl7lite.hl7_tokenizer import field_accessor
 from hl7lite.hl7_datatypes import missing_values
 
 # extract and transform the specified obx fields.
 
+# compiled field accessors
+_get_obx_name = field_accessor('obx', 3)  # OBX.3 observation identifier
+_get_obx_sub_id = field_accessor('obx', 4)  # OBX.4 observation sub-id
+_get_obx_value = field_accessor('obx', 5)  # OBX.5 observation value
+_get_obx_uom = field_accessor('obx', 6)  # OBX.6 units of measurement
+_get_obx_source = field_accessor('obx', 21)  # OBX.21 observation source
+_get_obr_start_t = field_accessor('obr', 7, as_string=True)  # OBR.7 observation date/time
+_get_obr_source = field_accessor('obr', 21)  # OBR.21 source2
+
 # %%
 # example OBR
 # [['OBR'],
@@ -37,7 +46,7 @@ from hl7lite.hl7_datatypes import missing_values
         
 # handle OBX.3
 def extract_signal_name(obx_fields: list) -> tuple:
-    sig_name = get_with_default(obx_fields, 'obx', 3)
+    sig_name = _get_obx_name(obx_fields)
     # get date type and value
     if isinstance(sig_name, list):
         # if not 3 parts, then assume no scheme.
@@ -69,7 +78,7 @@ def extract_signal_name(obx_fields: list) -> tuple:
 
 # handle OBX.6                    
 def extract_signal_uom(obx_fields: list) -> str:
-    unit_of_meas = get_with_default(obx_fields, 'obx', 6)
+    unit_of_meas = _get_obx_uom(obx_fields)
     if isinstance(unit_of_meas, list):
         if (len(unit_of_meas) == 1):
             unit_of_meas = unit_of_meas[0]
@@ -85,9 +94,9 @@ def extract_signal_uom(obx_fields: list) -> str:
 
 # get OBX.4 and OBX.21 to form a channel id.
 def extract_signal_id(obx_fields: list) -> str:
-    obx_container = get_with_default(obx_fields, 'obx', 4)     # OBX.4 observation sub id
+    obx_container = _get_obx_sub_id(obx_fields)     # OBX.4 observation sub id
     # get channel id.  this is in case there are channels with the same name.
-    channel_id = get_with_default(obx_fields, 'obx', 21)  # OBX.21 - some crazy number, may be useful.
+    channel_id = _get_obx_source(obx_fields)  # OBX.21 - some crazy number, may be useful.
     # # if channel_id is None, and  obx_container is a.b.x.y.  extract x. and overwrite the channel_id
     # if (channel_id == None) and (obx_container.startswith("1.99.") or obx_container.startswith("1.20.")):
     #     # get the x value
@@ -177,8 +186,8 @@ def extract_pid_from_obx(obr_fields: list, obxes: list) -> list:
     # patient names can be present in PID, or in one of the OBX fields from "monitoring of patient"
     # read from patient name to bed mapping file, with timestamps
 
-    source = get_with_default(obr_fields, 'obr', 21)
-    start_t = get_with_default(obr_fields, 'obr', 7, as_string=True)
+    source = _get_obr_source(obr_fields)
+    start_t = _get_obr_start_t(obr_fields)
     first_name = missing_values[str]
     last_name = missing_values[str]
     pid = missing_values[str]
@@ -194,7 +203,7 @@ def extract_pid_from_obx(obr_fields: list, obxes: list) -> list:
     for obx_fields in obxes:  # obx field list
         (_, code) = extract_signal_name(obx_fields)  # OBX.3 observation identifier
         try:
-            data = get_with_default(obx_fields, 'obx', 5)  # OBX.5 observation value    
+            data = _get_obx_value(obx_fields)  # OBX.5 observation value    
         except TypeError as e:
             raise ValueError(f"Strange OBX.5 data for code {code}, obx fields: {obx_fields}") from e
         if code == first_name_code:
@@ -0,0 +1,150 @@
+import os
+import mmap
+import numpy as np
+from hl7lite.hl7_tokenizer import get_tokenizer, find_message_bounds
+from hl7lite.hl7_ds import MESSAGE_KINDS, classify_raw_message, _raw_first_component, _raw_segment_end
+from hl7lite.parse_time_tz import c_parse_time_array, c_parse_time, NAT
+
+import logging
+log = logging.getLogger(__name__)
+
+# offset index of the messages in an HL7 part file.
+# the file is memory mapped and scanned for the blank line message boundaries, so it is never read into memory as a whole.
+# 1 row per message:  byte offset and length, message kind (index into MESSAGE_KINDS), and MSH.7 as epoch ns (NAT if missing or invalid).
+# the index can be saved as a small sidecar next to the part file (part-xxxx.hl7.idx.npz), so re-runs and targeted
+# reprocessing can seek straight to the messages, and split_message_index gives balanced byte ranges for parallel workers.
+INDEX_DTYPE = np.dtype([('start', np.int64), ('length', np.int64), ('kind', np.uint8), ('msh_time', np.int64)])
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.idx.npz'
+
+
+# read-only memory map of the file.  empty files give b'' (mmap cannot map 0 bytes).
+def map_hl7_file(hl7_file: str):
+    with open(hl7_file, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+
+# the message at row i of the index, as bytes.  only that message is copied out of content.
+def read_message(content, index: np.ndarray, i: int) -> bytes:
+    start = int(index['start'][i])
+    return content[start:start + int(index['length'][i])]
+
+
+# MSH.7 of the message between start and end, raw (bytes), first component only.  only the MSH segment is searched.
+def _raw_msh_time(content, start: int, end: int) -> bytes:
+    tokenizer = get_tokenizer(content[start + 3:start + 8])
+    msh_end = _raw_segment_end(content, start, end, b'\r', b'\n')
+    return _raw_first_component(content, start, msh_end, 6, tokenizer.field_b, tokenizer.component_b).encode('ascii', errors = 'replace')
+
+
+# 1 parse for the column, per element only if the column has an invalid time.
+def _parse_msh_times(raw_times: list) -> np.ndarray:
+    try:
+        return c_parse_time_array(np.array(raw_times, dtype = 'S'), as_epoch_ns = True)
+    except ValueError:
+        out = np.full(len(raw_times), NAT, dtype = np.int64)
+        for i, raw in enumerate(raw_times):
+            try:
+                out[i] = c_parse_time(raw.decode('ascii'), as_epoch_ns = True) if raw.strip() else NAT
+            except ValueError:
+                pass
+        return out
+
+
+def build_message_index(content) -> np.ndarray:
+    """
+    Return the offset index (INDEX_DTYPE) of the messages in content (bytes or a memory map of an HL7 file).
+    """
+    # re scans the memory map directly.  the kind and MSH.7 are read in place from the offsets (see classify_raw_message),
+    # so the messages, with their large waveform payloads, are not copied.
+    bounds = find_message_bounds(content)
+    index = np.zeros(len(bounds), dtype = INDEX_DTYPE)
+    raw_times = []
+    for i, (start, end) in enumerate(bounds):
+        if content[start:start + 3] == b'MSH':
+            index[i] = (start, end - start, MESSAGE_KINDS.index(classify_raw_message(content, start, end)), NAT)
+            raw_times.append(_raw_msh_time(content, start, end))
+        else:
+            index[i] = (start, end - start, MESSAGE_KINDS.index('Other'), NAT)
+            raw_times.append(b'')
+    if len(bounds) > 0:
+        index['msh_time'] = _parse_msh_times(raw_times)
+    return index
+
+
+def index_sidecar_path(hl7_file: str) -> str:
+    return hl7_file + INDEX_SUFFIX
+
+
+# the sidecar records the size and mtime of the part file, so a stale index is detected and rebuilt.
+def save_message_index(hl7_file: str, index: np.ndarray):
+    stat = os.stat(hl7_file)
+    np.savez(index_sidecar_path(hl7_file), index = index, version = INDEX_VERSION,
+             file_size = stat.st_size, file_mtime_ns = stat.st_mtime_ns)
+
+
+# the saved index, or None if there is no sidecar or it does not match the part file.
+def _load_sidecar(hl7_file: str):
+    sidecar = index_sidecar_path(hl7_file)
+    if not os.path.exists(sidecar):
+        return None
+    stat = os.stat(hl7_file)
+    try:
+        with np.load(sidecar) as npz:
+            if ((int(npz['version']) != INDEX_VERSION) or (int(npz['file_size']) != stat.st_size) or
+                (int(npz['file_mtime_ns']) != stat.st_mtime_ns) or (npz['index'].dtype != INDEX_DTYPE)):
+                log.info(f"stale message index {sidecar}, rebuilding")
+                return None
+            return npz['index']
+    except (OSError, ValueError, KeyError) as e:
+        log.warning(f"could not read message index {sidecar}: {e}")
+        return None
+
+
+def load_message_index(hl7_file: str, content = None, save: bool = False) -> np.ndarray:
+    """
+    Return the message index of hl7_file, from its sidecar if present and current, otherwise built from content
+    (or a memory map of the file if content is None), and saved as the sidecar if save is set.
+    """
+    index = _load_sidecar(hl7_file)
+    if index is not None:
+        return index
+    if content is None:
+        content = map_hl7_file(hl7_file)
+        try:
+            index = build_message_index(content)
+        finally:
+            if type(content) is not bytes:
+                content.close()
+    else:
+        index = build_message_index(content)
+    if save:
+        save_message_index(hl7_file, index)
+    return index
+
+
+def split_sizes(sizes, nparts: int) -> list:
+    """
+    Split a sequence of sizes into (up to) nparts contiguous (start, end) ranges of about the same total size.
+    """
+    if nparts < 1:
+        raise ValueError(f"nparts should be at least 1, got {nparts}")
+    if len(sizes) == 0:
+        return []
+    ends = np.cumsum(sizes)
+    # cut at the item boundary nearest each 1/nparts of the total, so a large item does not pull the cuts after it.
+    targets = ends[-1] * np.arange(1, nparts) / nparts
+    containing = np.searchsorted(ends, targets, side = 'left')
+    before = np.where(containing > 0, ends[np.maximum(containing - 1, 0)], 0)
+    cuts = np.where(targets - before < ends[containing] - targets, containing, containing + 1)
+    cuts = np.unique(np.concatenate(([0], np.minimum(cuts, len(sizes)), [len(sizes)])))
+    return [(int(a), int(b)) for a, b in zip(cuts[:-1], cuts[1:])]
+
+
+def split_message_index(index: np.ndarray, nparts: int) -> list:
+    """
+    Split the index rows into (up to) nparts contiguous (row_start, row_end) ranges of about the same number of bytes.
+    """
+    return split_sizes(index['length'], nparts)
@@ -1,8 +1,13 @@
-from hl7lite.hl7_tokenizer import tokenize_hl7_message, FIELD_SEPARATOR
+from hl7lite.hl7_tokenizer import tokenize_hl7_message_lazy, find_message_bounds, iter_segment_bounds, find_raw_field, convert_obx_values_batch, get_tokenizer, \
+    LazySegment, HL7Tokenizer, DEFAULT_TOKENIZER, FIELD_SEPARATOR, HL7_ENCODING
 import os
-from hl7lite.hl7_ds import HierarchicalMessage, HL7ORUData, HL7ADTData, hl7_data_factory
+from hl7lite.hl7_ds import HierarchicalMessage, HL7ORUData, HL7ADTData, hl7_data_factory, classify_raw_message, MESSAGE_KINDS
+from hl7lite.hl7_columnar import ColumnarBatch, _as_epoch_ns
+from hl7lite.hl7_index import map_hl7_file, load_message_index, read_message
+from hl7lite.hl7_patients import PatientHistoryStore, compact_history
 from hl7lite.hl7_aecg_test import _verify_hl7_msg
 from hl7lite.hl7_datatypes import missing_values
+import numpy as np
 import pandas as pd
 import json
 
@@ -29,44 +34,68 @@ def extract_bed_channel_data(msg: HL7ORUData, dirname: str, filename: str, seg_i
 
  
 #%%
-def read_hl7_file(hl7_file: str, history_fn: str, current_fn: str, verify_message:bool = False):
+# convert_obx_values:  convert OBX.5 values to numbers, per OBX field.
+# obx_values_as_array: convert NA/NR OBX.5 values to numpy arrays (see convert_numeric_payload)
+# batch_obx_values:    convert all numeric OBX.5 values in the file in 1 vectorized pass (see convert_obx_values_batch).
+#                      NA/NR values become views into a flat int64 or float64 buffer.
+# include_types, exclude_types:  sets of message kinds ('Waveform', 'Vitals', 'Alarm', 'ADT', 'Other') to keep or skip.
+# as_batch:            return the rows as a ColumnarBatch (see hl7_columnar) instead of a list of row dicts.
+def read_hl7_file(hl7_file: str, history_fn: str, current_fn: str, verify_message:bool = False, convert_obx_values: bool = False,
+                  obx_values_as_array: bool = False, batch_obx_values: bool = False, include_types: set = None, exclude_types: set = None,
+                  as_batch: bool = False, keep_message: bool = False):
     segment_id = int(hl7_file.split('-')[-1].split('.')[0])
     data = []
     pat_infos = []
     count = 0
     
-    with open(hl7_file, 'r') as file:
+    with open(hl7_file, 'rb') as file:
                         
-        # read the whole file
+        # read the whole file as bytes.  no decoding and no newline translation.
         file_content = file.read()
             
-        # next split the file_content by double newlines
+        # next find the message boundaries, i.e. double newlines
         # the double newlines are of the format \r\n\r\n or \n\n, but never \r\r
         # we do not see double newlines within a message between segments, only \r\n, \r, or \n
         # note that some tools only accept \r as line terminator.  ours does not have this limitation.
-        # approach for split is to convert \r\n to \n, then target \n\n
-        # should be faster than using regex.
-        messages = file_content.replace('\r\n', '\n').replace('\r', '\n').split('\n\n')
-        # messages = message_separator.split(file_content)
-            
-        converted = []
-        for msg in messages:
-            if len(msg) <= 0:
-                continue
+        # messages are tokenized in place using (start, end) offsets into file_content, so the file content is not copied,
+        # and only the fields that are extracted get decoded.
+        messages = find_message_bounds(file_content)
+        
+        # skip unwanted message kinds (see classify_raw_message) before any tokenizing.
+        # note that messages that are skipped do not contribute patient info either (e.g. excluding ADT).
+        if (include_types is not None) or (exclude_types is not None):
+            kinds = [classify_raw_message(file_content, msg_start, msg_end) for (msg_start, msg_end) in messages]
+            messages = [bounds for (bounds, kind) in zip(messages, kinds) 
+                        if ((include_types is None) or (kind in include_types)) and ((exclude_types is None) or (kind not in exclude_types))]
             
-            # tokenize_hl7_message works has to split the segments anyways, so dont bother split then rejoin.
-            # segs = segment_separator.split(msg)
-            # hl7_msg = '\r'.join(segs)
+        # tokenize_hl7_message works has to split the segments anyways, so dont bother split then rejoin.
+        # segs = segment_separator.split(msg)
+        # hl7_msg = '\r'.join(segs)
+        
+        # parsed is the dict of segments.  segnames is name of hl7 segments.
+        tokenized = [tokenize_hl7_message_lazy(file_content, start = msg_start, end = msg_end, 
+                                               convert_obx_values = convert_obx_values or batch_obx_values,
+                                               obx_values_as_array = obx_values_as_array) 
+                     for (msg_start, msg_end) in messages]
+        
+        # convert all numeric OBX values in the file at once, before any message is processed.
+        if batch_obx_values:
+            convert_obx_values_batch([parsed for (parsed, _) in tokenized])
             
-            # parsed is the dict of segments.  segnames is name of hl7 segments.
-            parsed, segnames = tokenize_hl7_message(msg)
+        # converted messages are held until the patient info is updated.  unless keep_message is set, each parse tree
+        # is released once its message is extracted, so only the extracted fields stay in memory.
+        converted = []
+        for i in range(len(tokenized)):
+            (parsed, segnames) = tokenized[i]
+            if not keep_message:
+                tokenized[i] = None
             
             # first organize the parsed data
             omsg = HierarchicalMessage(parsed, segnames)
             
             # then extract the data and metadata.
             try:
-                data_msg = hl7_data_factory(omsg)
+                data_msg = hl7_data_factory(omsg, keep_message = keep_message)
             except ValueError as e:
                 log.error(f"in file {hl7_file}, message {count}: {e}")
                 continue
@@ -86,23 +115,20 @@ def read_hl7_file(hl7_file: str, history_fn: str, current_fn: str, verify_messag
             pat_infos.extend(info_dicts)
         
                 
-    # open history of past patient info
-    if os.path.exists(history_fn):
-        history_df = pd.read_parquet(history_fn, engine='fastparquet')
-    else:
-        history_df = None
-    # this represents the starting point of the current period
-    if os.path.exists(current_fn):
-        current_df = pd.read_parquet(current_fn, engine='fastparquet')
-    else:
-        current_df = None
-
-    # update the patient info
-    history_df, bed_to_pat, next_df = update_patient_info(history_df, current_df, pat_infos)
-
-    # write out
-    history_df.to_parquet(history_fn, engine='fastparquet', compression='snappy', index=False)
-    next_df.to_parquet(current_fn, engine='fastparquet', compression='snappy', index=False)
+    bed_to_pat = update_patient_files(history_fn, current_fn, pat_infos)
+    patients = build_patient_intervals(bed_to_pat) if bed_to_pat is not None else None
+
+    if as_batch:
+        batch = ColumnarBatch()
+        batch.set_file(segment_id, os.path.basename(os.path.dirname(hl7_file)), os.path.basename(hl7_file))
+        for data_msg in converted:
+            if not isinstance(data_msg, HL7ADTData):
+                data_msg.append_to_batch(batch)
+            count += 1
+        if patients is not None:
+            _fill_batch_patient_info(batch, patients)
+        log.info(f"Read {count} HL7 messages with total of {len(batch)} waveforms from {hl7_file}")
+        return batch, pat_infos
 
     # extract bed info, including using patient info.
     for data_msg in converted:    
@@ -110,46 +136,333 @@ def read_hl7_file(hl7_file: str, history_fn: str, current_fn: str, verify_messag
         # extract the channel info
         if not isinstance(data_msg, HL7ADTData):
             data_dict = extract_bed_channel_data(data_msg, dirname = os.path.basename(os.path.dirname(hl7_file)), filename = os.path.basename(hl7_file), seg_id = segment_id)
-            
-            # look up in current_df the patient id, name, visit id, etc.
-            if (bed_to_pat is not None):
-                for ddict in data_dict:
-                    # get the patient info for this bed
-                    bed_key = (ddict['hospital'], ddict['bed_unit'], ddict['bed_id'])
-                    start_t = ddict['start_t']
-                    if bed_key in bed_to_pat:
-                        for pat_info in bed_to_pat[bed_key]:
-                            pstart = pat_info['start_t']
-                            pend = pat_info['end_t']
-                            
-                            if (pstart <= start_t) and ((pend is None) or pd.isna(pend) or (pend == '') or (start_t < pend)):
-                                # this is the patient info for this bed
-                                ddict['pid'] = pat_info['pid'] if ddict['pid'] == missing_values[str] else ddict['pid']
-                                ddict['visit_id'] = pat_info['visit_id'] if ddict['visit_id'] == missing_values[str] else ddict['visit_id']
-                                ddict['pat_fn'] = pat_info['first_name'] if ddict['pat_fn'] == missing_values[str] else ddict['pat_fn']
-                                ddict['pat_ln'] = pat_info['last_name'] if ddict['pat_ln'] == missing_values[str] else ddict['pat_ln']
-                    # else no patient info, no change.
-
             data.extend(data_dict)
                         
         count += 1
+
+    # look up in current_df the patient id, name, visit id, etc., for all rows at once.
+    if (patients is not None):
+        _fill_rows_patient_info(data, patients)
     log.info(f"Read {count} HL7 messages with total of {len(data)} waveforms from {hl7_file}")
     return data, pat_infos
 
 
+# merge pat_infos into the patient history and current files, and return bed_to_pat (see update_patient_info).
+# only the current patients are read, and only the new history rows are appended (see PatientHistoryStore).
+def update_patient_files(history_fn: str, current_fn: str, pat_infos: list) -> dict:
+    store = PatientHistoryStore(history_fn, current_fn)
+    if (len(pat_infos) == 0) and (store.current is None):
+        return None   # no patients yet, e.g. a file of only unclassified messages.
+    history_rows, bed_to_pat, next_df = update_patient_info(None, store.current, pat_infos)
+    store.append(history_rows, next_df)
+    return bed_to_pat
+
+
+_OPEN_END = np.iinfo(np.int64).max
+
+# interval index of bed_to_pat (see update_patient_info), for attributing rows to patients by bed and start time.
+# bed_key -> (starts, ends, pat_infos), with starts and ends as epoch ns int64 arrays, sorted by start.
+# update_patient_info ends each patient of a bed at the next one's start_t, so the patient at time t is the last one
+# starting at or before t, if t is before its end.  open ends (None, '' from update_patient_info, NaN, NaT) are int64 max.
+def build_patient_intervals(bed_to_pat: dict) -> dict:
+    patients = {}
+    for bed_key, pat_infos in bed_to_pat.items():
+        starts = np.array([_as_epoch_ns(p['start_t']) for p in pat_infos], dtype = np.int64)
+        ends = np.array([_OPEN_END if (p['end_t'] is None) or (type(p['end_t']) is str) else _as_epoch_ns(p['end_t'])
+                         for p in pat_infos], dtype = np.int64)
+        ends[ends == missing_values[int]] = _OPEN_END
+        order = np.argsort(starts, kind = 'stable')
+        patients[bed_key] = (starts[order], ends[order], [pat_infos[i] for i in order])
+    return patients
+
+
+# the patient info for each (bed_key, time), or None.  times is an epoch ns int64 array.
+# the items are grouped by bed, and each bed's times are looked up in 1 searchsorted, so the cost is log(patients) per item.
+def _lookup_patient_info(bed_keys: list, times: np.ndarray, patients: dict) -> list:
+    out = [None] * len(bed_keys)
+    groups = {}
+    for i, bed_key in enumerate(bed_keys):
+        if bed_key in patients:
+            groups.setdefault(bed_key, []).append(i)
+    for bed_key, items in groups.items():
+        starts, ends, pat_infos = patients[bed_key]
+        items = np.array(items, dtype = np.int64)
+        t = times[items]
+        idx = np.searchsorted(starts, t, side = 'right') - 1
+        found = idx >= 0
+        found[found] = t[found] < ends[idx[found]]
+        for i, j in zip(items[found].tolist(), idx[found].tolist()):
+            out[i] = pat_infos[j]
+    return out
+
+
+# fill in the missing patient info of the row dicts, by bed and signal start time (see build_patient_intervals).
+def _fill_rows_patient_info(data_dict: list, patients: dict):
+    bed_keys = [(ddict['hospital'], ddict['bed_unit'], ddict['bed_id']) for ddict in data_dict]
+    times = np.array([_as_epoch_ns(ddict['start_t']) for ddict in data_dict], dtype = np.int64)
+    for ddict, pat_info in zip(data_dict, _lookup_patient_info(bed_keys, times, patients)):
+        if pat_info is None:
+            continue   # no patient info, no change.
+        for col in ('pid', 'visit_id', 'first_name', 'last_name'):
+            if ddict[col] == missing_values[str]:
+                ddict[col] = pat_info[col]
+
+
+# fill in the missing patient info of the signals in the batch, by bed and signal start time (see build_patient_intervals).
+def _fill_batch_patient_info(batch: ColumnarBatch, patients: dict):
+    bed_keys, times = batch.signal_beds()
+    for sig_idx, pat_info in enumerate(_lookup_patient_info(bed_keys, times, patients)):
+        if pat_info is not None:
+            batch.fill_patient_info(sig_idx, pat_info['pid'], pat_info['visit_id'], pat_info['first_name'], pat_info['last_name'])
+
+
 #%%
+# the message index of the file (see hl7_index), filtered by kind.
+def _filtered_message_index(hl7_file: str, file_content, include_types: set = None, exclude_types: set = None, save_index: bool = False):
+    index = load_message_index(hl7_file, content = file_content, save = save_index)
+    if (include_types is not None) or (exclude_types is not None):
+        kinds = [MESSAGE_KINDS[k] for k in index['kind']]
+        keep = [((include_types is None) or (kind in include_types)) and ((exclude_types is None) or (kind not in exclude_types)) for kind in kinds]
+        index = index[np.array(keep, dtype = bool)]
+    return index
+
+
+# the patient info of the indexed messages.  update_patient_info only uses the earliest entry of each patient per bed,
+# so only those are kept.  the messages are extracted by hl7_data_factory, as in pass 2 and read_hl7_file, so a message
+# that pass 2 drops does not contribute patient info either.  pass 2 logs the errors, so they are not logged here.
+def _first_patient_infos(file_content, index: np.ndarray) -> list:
+    first_pat_infos = {}
+    for i in range(len(index)):
+        omsg = HierarchicalMessage(*tokenize_hl7_message_lazy(read_message(file_content, index, i)))
+        try:
+            infos = hl7_data_factory(omsg, keep_message = False).get_pid_loc_mapping()
+        except ValueError:
+            continue
+        for info in infos:
+            key = (info['hospital'], info['bed_unit'], info['bed_id'], info['pid'])
+            first = first_pat_infos.get(key, None)
+            if (first is None) or (info['start_t'] < first['start_t']):
+                first_pat_infos[key] = info
+    return list(first_pat_infos.values())
+
+
+# pass 1 of iter_hl7_file only:  the message index of the file, filtered by kind, and the patient info of its messages
+# (the earliest entry of each patient per bed).  the patient files are not read or written, so the files of a directory
+# can be scanned in parallel, and their patient info merged into the patient files in file order afterwards (see update_patient_files).
+def scan_hl7_file(hl7_file: str, include_types: set = None, exclude_types: set = None, save_index: bool = False) -> tuple:
+    file_content = map_hl7_file(hl7_file)
+    try:
+        index = _filtered_message_index(hl7_file, file_content, include_types, exclude_types, save_index)
+        return index, _first_patient_infos(file_content, index)
+    finally:
+        if type(file_content) is not bytes:
+            file_content.close()
+
+
+#%%
+# streaming version of read_hl7_file:  yields the rows in chunks of (up to) chunk_size messages, as lists of row dicts,
+# or as ColumnarBatch if as_batch, instead of holding every extracted message until the end of the file.
+# the patient info has to be merged before any row can be backfilled, so the file is read in 2 passes:
+#   1. patient info only.  the messages are extracted by hl7_data_factory as in pass 2, so both passes keep the same
+#      messages, but only the patient info is kept, with the bounds of each message in a compact index.
+#      update_patient_info only uses the earliest entry of each patient per bed, so only those are kept.
+#   2. per chunk, the messages are tokenized and extracted, the rows built and backfilled (see build_patient_intervals), and the parse trees dropped.
+# the patient files are updated after pass 1, so they are written even if the generator is not run to the end.
+# the file is memory mapped, and the messages are located with the message index (see hl7_index), from the sidecar if
+# present.  save_index writes the sidecar for later runs.  each message is copied out of the map only while it is processed.
+# other options as in read_hl7_file.  batch_obx_values converts per chunk.
+def iter_hl7_file(hl7_file: str, history_fn: str, current_fn: str, chunk_size: int = 1000, as_batch: bool = False,
+                  verify_message: bool = False, convert_obx_values: bool = False, obx_values_as_array: bool = False,
+                  batch_obx_values: bool = False, include_types: set = None, exclude_types: set = None, save_index: bool = False):
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size should be at least 1, got {chunk_size}")
+    
+    file_content = map_hl7_file(hl7_file)
+    try:
+        # pass 1:  the message index, filtered by kind, and the patient info.
+        index = _filtered_message_index(hl7_file, file_content, include_types, exclude_types, save_index)
+        bed_to_pat = update_patient_files(history_fn, current_fn, _first_patient_infos(file_content, index))
+        patients = build_patient_intervals(bed_to_pat) if bed_to_pat is not None else None
+        del bed_to_pat
+
+        # pass 2:  rows, chunk by chunk.
+        yield from _iter_indexed_rows(hl7_file, file_content, index, patients, chunk_size, as_batch, verify_message,
+                                      convert_obx_values, obx_values_as_array, batch_obx_values)
+    finally:
+        if type(file_content) is not bytes:
+            file_content.close()
+
+
+# pass 2 of iter_hl7_file only:  the rows of the messages in index (see scan_hl7_file), with the missing patient info
+# backfilled from patients (see build_patient_intervals, or None to leave it missing).  options as in iter_hl7_file.
+def iter_hl7_file_rows(hl7_file: str, index: np.ndarray, patients: dict, chunk_size: int = 1000, as_batch: bool = False,
+                       verify_message: bool = False, convert_obx_values: bool = False, obx_values_as_array: bool = False,
+                       batch_obx_values: bool = False):
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size should be at least 1, got {chunk_size}")
+    
+    file_content = map_hl7_file(hl7_file)
+    try:
+        yield from _iter_indexed_rows(hl7_file, file_content, index, patients, chunk_size, as_batch, verify_message,
+                                      convert_obx_values, obx_values_as_array, batch_obx_values)
+    finally:
+        if type(file_content) is not bytes:
+            file_content.close()
+
+
+# pass 2 of iter_hl7_file and iter_hl7_file_rows, over the mapped file_content.
+def _iter_indexed_rows(hl7_file: str, file_content, index: np.ndarray, patients: dict, chunk_size: int, as_batch: bool,
+                       verify_message: bool, convert_obx_values: bool, obx_values_as_array: bool, batch_obx_values: bool):
+    segment_id = int(hl7_file.split('-')[-1].split('.')[0])
+    dirname = os.path.basename(os.path.dirname(hl7_file))
+    filename = os.path.basename(hl7_file)
+
+    count = 0
+    nrows = 0
+    for chunk_start in range(0, len(index), chunk_size):
+        tokenized = [tokenize_hl7_message_lazy(read_message(file_content, index, i), 
+                                               convert_obx_values = convert_obx_values or batch_obx_values,
+                                               obx_values_as_array = obx_values_as_array) 
+                     for i in range(chunk_start, min(chunk_start + chunk_size, len(index)))]
+        if batch_obx_values:
+            convert_obx_values_batch([parsed for (parsed, _) in tokenized])
+
+        if as_batch:
+            chunk = ColumnarBatch()
+            chunk.set_file(segment_id, dirname, filename)
+        else:
+            chunk = []
+        for i in range(len(tokenized)):
+            (parsed, segnames) = tokenized[i]
+            tokenized[i] = None
+            try:
+                data_msg = hl7_data_factory(HierarchicalMessage(parsed, segnames), keep_message = False)
+            except ValueError as e:
+                log.error(f"in file {hl7_file}, message {chunk_start + i}: {e}")
+                continue
+        
+            if verify_message and (not isinstance(data_msg, HL7ADTData)):
+                verify_result = _verify_hl7_msg(data_msg)
+                if len(verify_result['errs']) > 0:
+                    log.error(f"Types: {verify_result['wavetypes']}:  {verify_result['errs']}")
+                if len(verify_result['warns']) > 0:
+                    log.warning(f"Types: {verify_result['wavetypes']}:  {verify_result['warns']}")
+
+            if not isinstance(data_msg, HL7ADTData):
+                if as_batch:
+                    data_msg.append_to_batch(chunk)
+                else:
+                    data_dict = extract_bed_channel_data(data_msg, dirname = dirname, filename = filename, seg_id = segment_id)
+                    chunk.extend(data_dict)
+            count += 1
+    
+        if as_batch and (patients is not None):
+            _fill_batch_patient_info(chunk, patients)
+        elif patients is not None:
+            _fill_rows_patient_info(chunk, patients)
+        if len(chunk) > 0:
+            nrows += len(chunk)
+            yield chunk
+    log.info(f"Read {count} HL7 messages with total of {nrows} waveforms from {hl7_file}")
+
+
+#%%
+# projection reader for read_hl7_file_for_segment.
+# only the segments named in the requested fields are recorded, as offsets into the file content (_SegmentRef),
+# and only the requested fields of those segments are located and decoded, by _extract_field.
+# a _ProjectedMessage has the same msh/pid/pv1/obrs/all layout as HierarchicalMessage, so the output code is shared.
+class _SegmentRef:
+    __slots__ = ('src', 'start', 'end', 'tokenizer')
+
+    def __init__(self, src, start: int, end: int, tokenizer: HL7Tokenizer):
+        self.src = src
+        self.start = start
+        self.end = end
+        self.tokenizer = tokenizer
+
+    def raw(self, index: int):
+        # the untokenized field at index, or None if the segment is shorter.  stops at the requested field.
+        return find_raw_field(self.src, self.start, self.end, index, self.tokenizer.field_b if type(self.src) is bytes else self.tokenizer.field)
+    
+    def raw_fields(self) -> list:
+        sep = self.tokenizer.field_b if type(self.src) is bytes else self.tokenizer.field
+        return self.src[self.start:self.end].split(sep)
+
+
+class _ProjectedMessage:
+    __slots__ = ('msh', 'pid', 'pv1', 'obrs', 'all')
+
+    def __init__(self, hl7_str, start: int, end: int, target_segments: set):
+        # MSH, PID, PV1 are required, same as HierarchicalMessage
+        keywords = set(['MSH', 'PID', 'PV1'])
+        tokenizer = get_tokenizer(hl7_str[start + 3:start + 8])
+        sep = tokenizer.field_b if type(hl7_str) is bytes else tokenizer.field
+        # OBX are grouped by the preceding OBR.
+        track_obr = ('OBR' in target_segments) or ('OBX' in target_segments)
+        
+        self.msh = self.pid = self.pv1 = None
+        self.obrs = []
+        self.all = {}
+        seg_names = set()
+        for (seg_start, seg_end) in iter_segment_bounds(hl7_str, start, end):
+            label_end = hl7_str.find(sep, seg_start, seg_end)
+            label = hl7_str[seg_start:(seg_end if label_end < 0 else label_end)]
+            if type(label) is bytes:
+                label = label.decode(HL7_ENCODING, errors = 'replace')
+            seg_names.add(label.upper())
+            if (label not in target_segments) and (label not in keywords) and not (track_obr and (label == 'OBR')):
+                continue
+            
+            ref = _SegmentRef(hl7_str, seg_start, seg_end, tokenizer)
+            if label in target_segments:
+                if label not in self.all:
+                    self.all[label] = []
+                self.all[label].append(ref)
+            if label == 'MSH':
+                self.msh = ref
+            elif label == 'PID':
+                self.pid = ref
+            elif label == 'PV1':
+                self.pv1 = ref
+            elif label == 'OBR':
+                self.obrs.append({'obr': ref, 'obx': []})
+            elif (label == 'OBX') and (len(self.obrs) > 0):
+                self.obrs[-1]['obx'].append(ref)
+                
+        if len(keywords - seg_names) > 0:
+            raise ValueError(f"ERROR: missing some keywords {keywords - seg_names}")
+
+
+# same result as tokenizing the field and joining any list with the component separator
+def _field_text(raw, tokenizer: HL7Tokenizer):
+    text = raw.decode(HL7_ENCODING, errors = 'replace') if type(raw) is bytes else raw
+    if (tokenizer.repetition in text) or (tokenizer.subcomponent in text):
+        tokens = tokenizer.field_to_tokens(text)
+        return tokenizer.component.join(tokens) if type(tokens) is list else tokens
+    return text
+
+
+# fields are rejoined with the separators of the message they came from.
 def _extract_field(target_segment: list, target_field: int):
+    if isinstance(target_segment, _SegmentRef):
+        tokenizer = target_segment.tokenizer
+        if target_field is not None:
+            raw = target_segment.raw(target_field)
+            return '' if raw is None else _field_text(raw, tokenizer)
+        return tokenizer.field.join([_field_text(raw, tokenizer) for raw in target_segment.raw_fields()])
+    
+    tokenizer = target_segment.tokenizer if isinstance(target_segment, LazySegment) else DEFAULT_TOKENIZER
     # filter for the target fields
     if target_field is not None:
         # log.debug(f"extracting fields {fields} from segment {segment} in {hl7_file}")
         output = target_segment[target_field] if (len(target_segment) > target_field) else ''
-        output = "^".join(output) if type(output) is list else output
+        output = tokenizer.component.join(output) if type(output) is list else output
     else:
         # log.debug(f"extracting all fields from segment {segment} in {hl7_file}")
         output = []
         for segf in target_segment:
-            output.append("^".join(segf) if type(segf) is list else segf)
-        output = '|'.join(output)
+            output.append(tokenizer.component.join(segf) if type(segf) is list else segf)
+        output = tokenizer.field.join(output)
     return output
 
 #%%
@@ -173,38 +486,39 @@ def read_hl7_file_for_segment(hl7_file: str, fields: list = None, verify_message
         target_fields[segment].append(f)
         
 
+    # segment names to look for in the raw message text, to skip messages without any requested segment before tokenizing.
+    # MSH is in every message, so no message is skipped if any MSH field is requested.
+    target_names = [name.encode(HL7_ENCODING) for name in target_fields.keys()]
+    target_segments = set(target_fields.keys())
+
     data = []
     count = 0
-    with open(hl7_file, 'r') as file:
+    with open(hl7_file, 'rb') as file:
             
-        # read the whole file
+        # read the whole file as bytes.  no decoding and no newline translation.
         file_content = file.read()
             
-        # next split the file_content by double newlines
+        # next find the message boundaries, i.e. double newlines
         # the double newlines are of the format \r\n\r\n or \n\n, but never \r\r
         # we do not see double newlines within a message between segments, only \r\n, \r, or \n
         # note that some tools only accept \r as line terminator.  ours does not have this limitation.
-        # approach for split is to convert \r\n to \n, then target \n\n
-        # should be faster than using regex.
-        messages = file_content.replace('\r\n', '\n').replace('\r', '\n').split('\n\n')
-        # messages = message_separator.split(file_content)
-            
-        for msg in messages:
-            if len(msg) <= 0:
-                continue
+        # messages are tokenized in place using (start, end) offsets into file_content, so the file content is not copied,
+        # and only the fields that are extracted get decoded.
+        messages = find_message_bounds(file_content)
             
+        for (msg_start, msg_end) in messages:
             # tokenize_hl7_message works has to split the segments anyways, so dont bother split then rejoin.
             # segs = segment_separator.split(msg)
             # hl7_msg = '\r'.join(segs)
             
-            # parsed is the dict of segments.  segnames is name of hl7 segments.
-            parsed, segnames = tokenize_hl7_message(msg)
-            
-            # first organize the parsed data
-            omsg = HierarchicalMessage(parsed, segnames)
-            
-            # then extract the data and metadata and check
+            # then extract the data and metadata and check.  this needs the fully parsed message.
             if verify_message:
+                # parsed is the dict of segments.  segnames is name of hl7 segments.
+                parsed, segnames = tokenize_hl7_message_lazy(file_content, start = msg_start, end = msg_end)
+                
+                # first organize the parsed data
+                omsg = HierarchicalMessage(parsed, segnames)
+                
                 try:
                     data_msg = hl7_data_factory(omsg)
                 except ValueError as e:
@@ -217,7 +531,12 @@ def read_hl7_file_for_segment(hl7_file: str, fields: list = None, verify_message
                         log.error(f"Types: {verify_result['wavetypes']}:  {verify_result['errs']}")
                     if len(verify_result['warns']) > 0:
                         log.warning(f"Types: {verify_result['wavetypes']}:  {verify_result['warns']}")
-
+            else:
+                # skip messages that do not contain any of the requested segments.
+                if not any(file_content.find(name, msg_start, msg_end) >= 0 for name in target_names):
+                    continue
+                # only the requested segments are recorded, and fields are split only when extracted.
+                omsg = _ProjectedMessage(file_content, msg_start, msg_end, target_segments)
 
 
             output = []
@@ -270,7 +589,7 @@ def read_hl7_file_for_segment(hl7_file: str, fields: list = None, verify_message
                         if target_field is None:
                             field_str = _extract_field(omsg.msh, None)
                         elif target_field == 1:
-                            field_str = FIELD_SEPARATOR
+                            field_str = omsg.msh.tokenizer.field if isinstance(omsg.msh, (LazySegment, _SegmentRef)) else FIELD_SEPARATOR
                         else:
                             field_str = _extract_field(omsg.msh, target_field - 1) # MSH_1 is the field separator so the actual list indices are shifted by -1
                         msg_out[f'{name}.{target_field}'] = field_str
@@ -313,6 +632,8 @@ def read_hl7_file_for_segment(hl7_file: str, fields: list = None, verify_message
     return data
 
 
+_BED_COLUMNS = ['hospital', 'bed_unit', 'bed_id']
+
 # update patient info in a database.
 def update_patient_info(history: pd.DataFrame, current: pd.DataFrame, patient_ids: list):
     # database has columns: ['hospital', 'bed_unit', 'bed_id', 'pid', 'visit_id', 'first_name', 'last_name', 'middle_initial', 'start_t', 'end_t']
@@ -326,36 +647,44 @@ def update_patient_info(history: pd.DataFrame, current: pd.DataFrame, patient_id
     else:
         merged = pid_df
 
-    # group by hospital, bed_unit, bed_id, sort by time.
-    grouped = merged.groupby(['hospital', 'bed_unit', 'bed_id'])
-
-    filtered_rows = []
-    for _, group in grouped:
-        
-        # sort by time
-        group = group.sort_values('start_t')
-        
-        # check the number of unique patients.
-        n_pids = group['pid'].nunique()
-        # if there is only 1 patient, we are already keeping the oldest one, so are done.
-        if n_pids == 1:
-            # always keep the oldest one and the newest one.
-            filtered_rows.append(group.iloc[[0]].copy())
-            
-        elif n_pids > 1:
-            # now we need to scan and find the last entry for each patient, and first entry for each patient.
-            pgroups = group.groupby('pid')
-            first_entries = pgroups.nth(0).copy()
-            # Shift start_t back by 1 row for each patient group
-            
-            first_entries['end_t'] = first_entries['start_t'].shift(-1, fill_value=missing_values[str]).values
-            filtered_rows.append(first_entries)
-
-
-    current = pd.concat(filtered_rows, ignore_index=True).sort_values('start_t')
+    # 1 sort for all beds, by bed and then time, instead of a sort per bed.  rows with a missing bed are dropped, as groupby does.
+    # the sort is stable, so rows with the same time stay in the order they came in.
+    merged = merged.dropna(subset=_BED_COLUMNS).sort_values(_BED_COLUMNS + ['start_t'], kind='stable', ignore_index=True)
+    nrows = len(merged)
+
+    # bed runs:  a new bed starts where any of the bed columns changes from the previous row (compared as factorized codes).
+    new_bed = np.zeros(nrows, dtype=bool)
+    new_bed[:1] = True
+    for col in _BED_COLUMNS:
+        codes, _ = pd.factorize(merged[col])
+        new_bed[1:] |= codes[1:] != codes[:-1]
+    bed_run = np.cumsum(new_bed) - 1
+
+    # the first row of each patient of a bed (missing pids are not patients, as in nunique), and the number of patients per bed.
+    pid_codes, _ = pd.factorize(merged['pid'])
+    first_of_pid = ~pd.DataFrame({'bed': bed_run, 'pid': pid_codes}).duplicated().to_numpy() & (pid_codes >= 0)
+    n_pids = np.bincount(bed_run[first_of_pid], minlength=(bed_run[-1] + 1) if nrows > 0 else 0)[bed_run]
+
+    # if there is only 1 patient, keep the oldest row of the bed.
+    # if there are more, keep the first entry of each patient, ending at the start of the next patient of the bed.
+    single = new_bed & (n_pids == 1)
+    multi = first_of_pid & (n_pids > 1)
+    keep = np.flatnonzero(single | multi)
+    current = merged.iloc[keep].reset_index(drop=True)
+    multi_rows = np.flatnonzero(multi[keep])
+    if len(multi_rows) > 0:
+        starts = current['start_t'].to_numpy()[multi_rows]
+        beds = bed_run[keep][multi_rows]
+        ends = np.full(len(multi_rows), missing_values[str], dtype=object)
+        next_same_bed = beds[1:] == beds[:-1]
+        ends[:-1][next_same_bed] = starts[1:][next_same_bed]
+        end_t = current['end_t'].to_numpy(dtype=object, copy=True)
+        end_t[multi_rows] = ends
+        current['end_t'] = end_t
+
+    current = current.sort_values('start_t', kind='stable')
     next = current.drop_duplicates(subset=['hospital', 'bed_unit', 'bed_id'], keep='last').reset_index(drop=True)
-    history = pd.concat([history, current], ignore_index=True).sort_values('start_t')
-    history = history.drop_duplicates(subset=['hospital', 'bed_unit', 'bed_id', 'pid', 'visit_id', 'start_t'], keep='last').reset_index(drop=True)
+    history = compact_history(pd.concat([history, current], ignore_index=True))
 
     current_dict = {}
     for row in current.itertuples():
@@ -382,7 +711,7 @@ def convert_msg_to_json(msg: str) -> str:
     # hl7_msg = '\r'.join(segs)
 
     # parsed is the dict of segments.  segnames is name of hl7 segments.
-    parsed, segnames = tokenize_hl7_message(msg)
+    parsed, segnames = tokenize_hl7_message_lazy(msg)
 
     # first organize the parsed data
     omsg = HierarchicalMessage(parsed, segnames)
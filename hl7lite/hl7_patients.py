@@ -0,0 +1,96 @@
+import os
+import numpy as np
+import pandas as pd
+from fastparquet import ParquetFile
+from hl7lite.hl7_datatypes import missing_values
+
+import logging
+log = logging.getLogger(__name__)
+
+# append-only store for the patient location history (history_fn) and the latest patients per bed (current_fn).
+# the history used to be read, merged, sorted, deduplicated and rewritten in full for every HL7 file, so the per-file cost
+# grew over the day.  instead, each update appends only its new rows (the current rows from update_patient_info) as a
+# row group, so history_fn holds repeated rows until it is compacted.  read_history returns the compacted view, which is
+# the same as the fully rewritten history (see compact_history).  compact rewrites the file, on demand, or automatically
+# once the file has more than max_row_groups row groups, which also bounds the footer that each append re-reads.
+# current_fn has 1 row per bed (the state that update_patient_info needs), so it is small, and is kept in memory
+# and rewritten on each update.
+
+# a history row is identified by these columns.  the last row appended for a key is the one that is kept.
+HISTORY_KEY = ['hospital', 'bed_unit', 'bed_id', 'pid', 'visit_id', 'start_t']
+
+
+# sort by start_t and keep the last row per HISTORY_KEY.  the sort is stable, so for the same key the later row wins.
+def compact_history(history: pd.DataFrame) -> pd.DataFrame:
+    history = history.sort_values('start_t', kind='stable')
+    return history.drop_duplicates(subset=HISTORY_KEY, keep='last').reset_index(drop=True)
+
+
+# end_t is '' for the open last patient of a bed with more than 1 patient, and epoch ns otherwise (see update_patient_info),
+# which parquet cannot store in 1 column, so it is stored as int64 with open ends as missing_values[int].
+def _patient_end_times(end_t: pd.Series) -> np.ndarray:
+    return np.array([missing_values[int] if (t is None) or (type(t) is str) or pd.isna(t) else int(t) for t in end_t], dtype = np.int64)
+
+
+class PatientHistoryStore:
+    def __init__(self, history_fn: str, current_fn: str, max_row_groups: int = 64):
+        self.history_fn = history_fn
+        self.current_fn = current_fn
+        self.max_row_groups = max_row_groups
+        self.current = pd.read_parquet(current_fn, engine='fastparquet') if os.path.exists(current_fn) else None
+
+    def append(self, history_rows: pd.DataFrame, current: pd.DataFrame):
+        """
+        Append history_rows to the history, and replace the current patients with current.
+        """
+        current = current.assign(end_t = _patient_end_times(current['end_t']))
+        if (history_rows is not None) and (len(history_rows) > 0):
+            self._append_history(history_rows.assign(end_t = _patient_end_times(history_rows['end_t'])))
+        current.to_parquet(self.current_fn, engine='fastparquet', compression='snappy', index=False)
+        self.current = current
+        if self.num_row_groups() > self.max_row_groups:
+            self.compact()
+
+    def _append_history(self, rows: pd.DataFrame):
+        if not os.path.exists(self.history_fn):
+            rows.to_parquet(self.history_fn, engine='fastparquet', compression='snappy', index=False)
+            return
+        # fastparquet converts appended rows to the file's types while writing, so a type mismatch would leave a partial
+        # row group.  check the columns and types first.  e.g. a history written by an older version:  merge and rewrite it.
+        dtypes = ParquetFile(self.history_fn).dtypes
+        if (list(dtypes.keys()) != list(rows.columns)) or any(dtypes[col] != rows[col].dtype for col in rows.columns):
+            log.warning(f"patient history {self.history_fn} has different columns or types, rewriting it")
+            history = pd.concat([self._read_raw(), rows], ignore_index=True)
+            self._write_history(compact_history(history.assign(end_t = _patient_end_times(history['end_t']))))
+            return
+        rows.to_parquet(self.history_fn, engine='fastparquet', compression='snappy', index=False, append=True)
+
+    def _read_raw(self) -> pd.DataFrame:
+        return pd.read_parquet(self.history_fn, engine='fastparquet')
+
+    # write to a temporary file and rename, so readers never see a partial history.
+    def _write_history(self, history: pd.DataFrame):
+        tmp_fn = self.history_fn + '.tmp'
+        history.to_parquet(tmp_fn, engine='fastparquet', compression='snappy', index=False)
+        os.replace(tmp_fn, self.history_fn)
+
+    def num_row_groups(self) -> int:
+        if not os.path.exists(self.history_fn):
+            return 0
+        return len(ParquetFile(self.history_fn).row_groups)
+
+    def read_history(self) -> pd.DataFrame:
+        """
+        Return the compacted history, or None if there is no history yet.
+        """
+        if not os.path.exists(self.history_fn):
+            return None
+        return compact_history(self._read_raw())
+
+    def compact(self):
+        """
+        Rewrite the history file as its compacted view, in 1 row group.
+        """
+        history = self.read_history()
+        if history is not None:
+            self._write_history(history)
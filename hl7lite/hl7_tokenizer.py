@@ -1,5 +1,8 @@
 import re
-from hl7lite.hl7_datatypes import convert_field, hl7_type_to_pandas_type, hl7_field_to_pandas_type, missing_values, DataType
+import functools
+import warnings
+import numpy as np
+from hl7lite.hl7_datatypes import convert_field, compile_field_converter, convert_numeric_payload, hl7_type_to_pandas_type, hl7_field_to_pandas_type, missing_values, DataType, _int64_saturated, narrow_int_dtype
 
 import logging
 log = logging.getLogger(__name__)
@@ -15,21 +18,28 @@ ESCAPE_SEPARATOR: str = '\\'
 SUBCOMPONENT_SEPARATOR: str = '&'
 MSH_2: str = '^~\\&'
 
+# encoding of the raw file content.  fields are decoded only when read.
+HL7_ENCODING: str = 'utf-8'
+
 #%%
 
 # check to see if we have a decimal point and at least 1 digit after it is not 0.
 # int(str) cannot handle *.0 integers.
 
+# OBX.2 value type -> compiled converter.  unknown types are strings.
+_obx_value_converters = {hl7_type: compile_field_converter(output_type, as_string = False) for hl7_type, output_type in hl7_type_to_pandas_type.items()}
+_obx_str_converter = compile_field_converter(DataType.STR, as_string = False)
+
 def _convert_obx_value_type(data, datatype:str):
     if datatype is None or len(datatype) == 0:  # empty or missing datatype string, return as string.
         datatype = 'ST' # string type
         
-    output_type = hl7_type_to_pandas_type.get(datatype, DataType.STR)
+    convert = _obx_value_converters.get(datatype, _obx_str_converter)
     
     try:
-        return convert_field(data, output_type, as_string = False)
+        return convert(data)
     except Exception as e:
-        raise ValueError(f"[ERROR] converting {data} to datatype {datatype} ({output_type}): {e}")
+        raise ValueError(f"[ERROR] converting {data} to datatype {datatype} ({hl7_type_to_pandas_type.get(datatype, DataType.STR)}): {e}")
 
 
 # this is a simple parser for HL7 messages.
@@ -123,43 +133,495 @@ def tokenize_hl7_message(hl7_str: str, level : int = 1000, convert_obx_values: b
     if not hl7_str.startswith("MSH"):
         raise ValueError("ERROR: first segment is not MSH")
     
-    FIELD_SEPARATOR = hl7_str[3]     # |
-    COMPONENT_SEPARATOR = hl7_str[4]  # ^
-    REPETITION_SEPARATOR = hl7_str[5]  # ~   no known usage
-    ESCAPE_SEPARATOR = hl7_str[6]   # \   no known usage.
-    SUBCOMPONENT_SEPARATOR = hl7_str[7]  # &  no known usage
-    MSH_2 = hl7_str[4:8]  # MSH_2 are the component separators, which is the first 4 characters after MSH|.
+    # MSH.1 is the field separator, MSH.2 are the component, repetition, escape, and subcomponent separators.
+    # get the tokenizer specialized for these separators.
+    tokenizer = get_tokenizer(hl7_str[3:8])
 
     # is it faster to use regex to split (2-3s per 5 files), or to replace \n with \r then split by \r?
     segments = hl7_str.replace('\n', '\r').split('\r')
     
     # batch parse segments version
-    parsed = [_segment_to_fields(segment, level = level, convert_obx_values = convert_obx_values) for segment in segments if segment.strip() != '']
+    segment_to_fields = tokenizer.segment_to_fields
+    parsed = [segment_to_fields(segment, level = level, convert_obx_values = convert_obx_values) for segment in segments if segment.strip() != '']
     # parse a list of segment strings, return a list of lists, each list is 1 segment's fields
     seg_names = set([seg_fields[0].upper() for seg_fields in parsed])
 
     # parsed = _convert_value(parsed)     # convert parsed OBX5 based on OBX2 datatype.
+
+    return parsed, seg_names
+
+
+# parse 1 field the same way _segment_to_fields does, but for a single field.
+def _field_to_tokens(field: str, level: int = 1000):
+    if (level <= 2) or (field == MSH_2):
+        return field
+    if (REPETITION_SEPARATOR in field) or (SUBCOMPONENT_SEPARATOR in field):
+        return _field_to_repetitions(field, level = level)
+    if (level >= 4) and (COMPONENT_SEPARATOR in field):
+        return field.split(COMPONENT_SEPARATOR)
+    return field
+
+
+
+# tokenizer specialized for 1 set of separators (MSH.1 and MSH.2).
+# the helper functions above use the module level default separators.  passing the separators through every call
+# would slow the hot path down, so for non-default separators, the same helpers are generated as closures
+# over the separators instead (see _make_tokenizer).  tokenizers are cached by their separators (see get_tokenizer).
+# the default separators use the module level helpers as is.
+class HL7Tokenizer:
+    __slots__ = ('field', 'component', 'repetition', 'escape', 'subcomponent', 'msh_2',
+                 'field_b', 'component_b', 'repetition_b', 'subcomponent_b',
+                 'segment_to_fields', 'field_to_tokens')
+
+    def __init__(self, field: str, component: str, repetition: str, escape: str, subcomponent: str, msh_2: str,
+                 segment_to_fields, field_to_tokens):
+        self.field = field
+        self.component = component
+        self.repetition = repetition
+        self.escape = escape
+        self.subcomponent = subcomponent
+        self.msh_2 = msh_2
+        # bytes versions, for tokenizing raw file content.
+        self.field_b = field.encode(HL7_ENCODING)
+        self.component_b = component.encode(HL7_ENCODING)
+        self.repetition_b = repetition.encode(HL7_ENCODING)
+        self.subcomponent_b = subcomponent.encode(HL7_ENCODING)
+        self.segment_to_fields = segment_to_fields
+        self.field_to_tokens = field_to_tokens
+
+    def __repr__(self):
+        return f"HL7Tokenizer({self.field}{self.msh_2})"
+
+
+# separator for an encoding character that the sender did not declare in MSH.2.  never present in HL7 text, so never splits.
+_ABSENT_SEPARATOR = '\x00'
+
+# generate the tokenizer helper functions with the separators bound as closure variables.
+# same logic as _component_to_subcomponents, _repetition_to_components, _field_to_repetitions, _field_to_tokens and _segment_to_fields.
+def _make_tokenizer(field_sep: str, component_sep: str, repetition_sep: str, escape_sep: str, subcomponent_sep: str, msh_2: str) -> HL7Tokenizer:
+
+    def component_to_subcomponents(component: str, level : int = 1000):
+        if (level < 5) or (subcomponent_sep not in component):
+            return component
+        return component.split(subcomponent_sep)
+
+    def repetition_to_components(field: str, level : int = 1000):
+        if level < 4:
+            return field
+        if component_sep not in field:
+            return component_to_subcomponents(field, level = level)
+        return [component_to_subcomponents(c, level = level) for c in field.split(component_sep)]
+
+    def field_to_repetitions(field: str, level : int = 1000):
+        if level < 3:
+            return field
+        if repetition_sep not in field:
+            return repetition_to_components(field, level = level)
+        return [repetition_to_components(f, level = level) for f in field.split(repetition_sep)]
+
+    def field_to_tokens(field: str, level: int = 1000):
+        if (level <= 2) or (field == msh_2):
+            return field
+        if (repetition_sep in field) or (subcomponent_sep in field):
+            return field_to_repetitions(field, level = level)
+        if (level >= 4) and (component_sep in field):
+            return field.split(component_sep)
+        return field
+
+    def segment_to_fields(segment: str, level : int = 1000, convert_obx_values: bool = False):
+        fields = segment.split(field_sep)
+        if level <= 2:
+            parsed_fields = fields
+        else:
+            parsed_fields = [ field if field == msh_2 else \
+                    field_to_repetitions(field, level = level) if (level >= 3) and ((repetition_sep in field) or (subcomponent_sep in field)) else \
+                    field.split(component_sep) if (level >= 4) and (component_sep in field) else field \
+                    for field in fields ]
+        if convert_obx_values and (parsed_fields[0].upper() == 'OBX'):
+            parsed_fields[5] = _convert_obx_value_type(data = parsed_fields[5], datatype = parsed_fields[2])
+        return parsed_fields
+
+    return HL7Tokenizer(field_sep, component_sep, repetition_sep, escape_sep, subcomponent_sep, msh_2,
+                        segment_to_fields = segment_to_fields, field_to_tokens = field_to_tokens)
+
+
+DEFAULT_TOKENIZER = HL7Tokenizer(FIELD_SEPARATOR, COMPONENT_SEPARATOR, REPETITION_SEPARATOR, ESCAPE_SEPARATOR, SUBCOMPONENT_SEPARATOR, MSH_2,
+                                 segment_to_fields = _segment_to_fields, field_to_tokens = _field_to_tokens)
+# raw MSH prefixes of the default separators, for the common case without parsing the prefix.
+_DEFAULT_PREFIXES = frozenset([FIELD_SEPARATOR + MSH_2, (FIELD_SEPARATOR + MSH_2).encode(HL7_ENCODING)])
+_DEFAULT_SEPARATORS = (FIELD_SEPARATOR, COMPONENT_SEPARATOR, REPETITION_SEPARATOR, ESCAPE_SEPARATOR, SUBCOMPONENT_SEPARATOR)
+
+# specialized tokenizers are cached by the separator tuple, not by the raw prefix:  when MSH.2 declares fewer than 4
+# characters, the 5 characters after "MSH" include the start of MSH.3 (the sending application), which differs per sender.
+TOKENIZER_CACHE_SIZE = 64
+
+@functools.lru_cache(maxsize=TOKENIZER_CACHE_SIZE)
+def _cached_tokenizer(separators: tuple) -> HL7Tokenizer:
+    if separators == _DEFAULT_SEPARATORS:
+        return DEFAULT_TOKENIZER
+    field_sep, *encoding_chars = separators
+    msh_2 = ''.join(encoding_chars).split(_ABSENT_SEPARATOR, 1)[0]
+    return _make_tokenizer(field_sep, *encoding_chars, msh_2 = msh_2)
+
+
+def get_tokenizer(msh_prefix):
+    """
+    Return the tokenizer for the separators declared in a message, given the 5 characters after "MSH" (str or bytes),
+    i.e. MSH.1 and MSH.2.  Tokenizers are cached by their separators (field, component, repetition, escape, subcomponent).
+    """
+    if msh_prefix in _DEFAULT_PREFIXES:
+        return DEFAULT_TOKENIZER
     
+    prefix = msh_prefix.decode(HL7_ENCODING, errors = 'replace') if type(msh_prefix) is bytes else msh_prefix
+    if len(prefix) == 0:
+        raise ValueError("ERROR: MSH segment does not declare a field separator")
+    field_sep = prefix[0]
+    # MSH.2 may declare fewer than 4 encoding characters, in which case the field separator follows.
+    msh_2 = prefix[1:].split(field_sep, 1)[0]
+    encoding_chars = (msh_2 + _ABSENT_SEPARATOR * 4)[:4]
+    return _cached_tokenizer((field_sep, *encoding_chars))
+
+
+# lazy version of the tokenized segment.
+# HL7Data and Signal only read about 25 field positions (see hl7_field_to_pandas_type), so splitting every field
+# of every segment into nested lists is mostly wasted allocation, especially for the large OBX.5 waveform payloads.
+# a LazySegment keeps the offsets of the segment in the original message string.  field boundaries are located
+# on first access, and each field is tokenized into repetitions/components/subcomponents only when it is read.
+# it behaves like the list returned by _segment_to_fields for indexing, len() and iteration,
+# so it can be used in HierarchicalMessage and get_with_default as is.
+# the source can be str or bytes.  with bytes (e.g. the content of a whole file), only the fields that are read get decoded.
+class LazySegment:
+    __slots__ = ('name', '_src', '_start', '_end', '_bounds', '_fields', '_level', '_convert_obx_values', '_obx_values_as_array', '_tok')
+
+    def __init__(self, src, start: int, end: int, level: int = 1000, convert_obx_values: bool = False, obx_values_as_array: bool = False,
+                 tokenizer: HL7Tokenizer = DEFAULT_TOKENIZER):
+        self._src = src
+        self._tok = tokenizer
+        self._start = start
+        self._end = end
+        self._level = level
+        self._convert_obx_values = convert_obx_values or obx_values_as_array
+        self._obx_values_as_array = obx_values_as_array
+        self._bounds = None   # start offset of each field, plus (end + 1) as sentinel.  populated on first access
+        self._fields = None   # tokenized fields, populated on access
+        label_end = src.find(tokenizer.field_b if type(src) is bytes else tokenizer.field, start, end)
+        name = src[start:(end if label_end < 0 else label_end)]
+        self.name = name.decode(HL7_ENCODING, errors = 'replace') if type(name) is bytes else name
+
+    def _locate_fields(self):
+        src = self._src
+        end = self._end
+        sep = self._tok.field_b if type(src) is bytes else self._tok.field
+        bounds = [self._start]
+        pos = src.find(sep, self._start, end)
+        while pos >= 0:
+            bounds.append(pos + 1)
+            pos = src.find(sep, pos + 1, end)
+        bounds.append(end + 1)
+        self._bounds = bounds
+        self._fields = [None] * (len(bounds) - 1)
+        return bounds
+
+    @property
+    def tokenizer(self) -> HL7Tokenizer:
+        # separators of the message this segment belongs to.
+        return self._tok
+
+    def raw(self, index: int):
+        """
+        Return the untokenized field at the given index, as the same type as the source (str or bytes).
+        """
+        bounds = self._bounds if self._bounds is not None else self._locate_fields()
+        if index < 0:
+            index += len(bounds) - 1
+        return self._src[bounds[index]:(bounds[index + 1] - 1)]
+
+    def _tokenize_field(self, index: int):
+        if index == 0:
+            return self.name
+        field = self.raw(index)
+        if self._convert_obx_values and (index == 5) and (self.name.upper() == 'OBX'):
+            return _convert_obx_raw_value(field, datatype = self[2], level = self._level, as_array = self._obx_values_as_array,
+                                          tokenizer = self._tok)
+        if type(field) is bytes:
+            field = field.decode(HL7_ENCODING, errors = 'replace')
+        return self._tok.field_to_tokens(field, level = self._level)
+
+    def __getitem__(self, index):
+        if self._bounds is None:
+            self._locate_fields()
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._fields)))]
+        if index < 0:
+            index += len(self._fields)
+            if index < 0:
+                raise IndexError("segment index out of range")
+        out = self._fields[index]  # raises IndexError same as a list would.
+        if out is None:
+            out = self._tokenize_field(index)
+            self._fields[index] = out
+        return out
+
+    def __len__(self):
+        if self._bounds is None:
+            self._locate_fields()
+        return len(self._fields)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        if isinstance(other, (LazySegment, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+# convert OBX.5 directly from the raw field.
+# int() and float() accept bytes, so numeric payloads from a bytes source are converted without being decoded.
+# with as_array, NA/NR payloads are parsed straight into a numpy array (see convert_numeric_payload).
+# anything else (or anything with repetition/subcomponent separators) goes through the regular str path.
+def _convert_obx_raw_value(raw, datatype: str, level: int = 1000, as_array: bool = False, tokenizer: HL7Tokenizer = DEFAULT_TOKENIZER):
+    if as_array and (len(raw) > 0) and (level >= 4) and (hl7_type_to_pandas_type.get(datatype, None) == DataType.LIST_OF_NUMERIC):
+        try:
+            return convert_numeric_payload(raw, sep = tokenizer.component)
+        except ValueError:
+            pass  # let the list path report the error.
+    if type(raw) is bytes:
+        output_type = hl7_type_to_pandas_type.get(datatype, DataType.STR) if datatype else DataType.STR
+        if (len(raw) > 0) and (level >= 4) and (tokenizer.repetition_b not in raw) and (tokenizer.subcomponent_b not in raw):
+            try:
+                if output_type == DataType.LIST_OF_NUMERIC:
+                    values = raw.split(tokenizer.component_b)
+                    return list(map(float, values)) if (b'.' in raw) else list(map(int, values))
+                elif (output_type == DataType.NUMERIC) and (tokenizer.component_b not in raw):
+                    return float(raw) if (b'.' in raw) else int(raw)
+            except ValueError:
+                pass  # let the str path report the error.
+        raw = raw.decode(HL7_ENCODING, errors = 'replace')
+    return _convert_obx_value_type(data = tokenizer.field_to_tokens(raw, level = level), datatype = datatype)
+
+
+# segments are separated by \r, \n, or \r\n.  consecutive terminators produce empty segments, which are skipped.
+_segment_terminators = re.compile(r'[\r\n]+')
+_segment_terminators_b = re.compile(rb'[\r\n]+')
+# messages are separated by 2 or more line terminators (\r\n counts as 1).  same as replacing \r\n and \r by \n, then splitting on \n\n
+# (the lookahead keeps a single \r\n from matching as \r followed by \n)
+_message_terminators = re.compile(r'(?:\r\n|\n|\r(?!\n)){2,}')
+_message_terminators_b = re.compile(rb'(?:\r\n|\n|\r(?!\n)){2,}')
+
+def find_message_bounds(content) -> list:
+    """
+    Return the (start, end) offsets of each message in content (str, bytes, or a bytes-like memory map).
+    Messages are separated by blank lines.  Content is not copied.
+    """
+    terminators = _message_terminators if type(content) is str else _message_terminators_b
+    bounds = []
+    start = 0
+    for m in terminators.finditer(content):
+        if m.start() > start:
+            bounds.append((start, m.start()))
+        start = m.end()
+    if len(content) > start:
+        bounds.append((start, len(content)))
+    return bounds
+
+
+# (start, end) offsets of the non-blank segments of 1 message in hl7_str (str or bytes), between start and end.
+def iter_segment_bounds(hl7_str, start: int = 0, end: int = None):
+    end = len(hl7_str) if end is None else end
+    empty = hl7_str[0:0]
+    for m in (_segment_terminators_b if type(hl7_str) is bytes else _segment_terminators).finditer(hl7_str, start, end):
+        seg_end = m.start()
+        if (seg_end > start) and ((not hl7_str[start:start + 1].isspace()) or (hl7_str[start:seg_end].strip() != empty)):
+            yield (start, seg_end)
+        start = m.end()
+    if (end > start) and ((not hl7_str[start:start + 1].isspace()) or (hl7_str[start:end].strip() != empty)):
+        yield (start, end)
+
+
+# the untokenized field at index of the segment between seg_start and seg_end, or None if the segment is shorter.
+# only scans up to the requested field.
+def find_raw_field(hl7_str, seg_start: int, seg_end: int, index: int, sep):
+    pos = seg_start
+    for _ in range(index):
+        pos = hl7_str.find(sep, pos, seg_end)
+        if pos < 0:
+            return None
+        pos += 1
+    next_pos = hl7_str.find(sep, pos, seg_end)
+    return hl7_str[pos:(seg_end if next_pos < 0 else next_pos)]
+
+
+# lazy version of tokenize_hl7_message.  same return values and same parsing rules,
+# but the segments are LazySegments that only record offsets into hl7_str until a field is read.
+# hl7_str can be str or bytes.  start and end select 1 message out of a larger buffer (e.g. a whole file), without copying.
+# obx_values_as_array converts NA/NR OBX.5 values to numpy arrays instead of lists (implies convert_obx_values).
+def tokenize_hl7_message_lazy(hl7_str, level : int = 1000, convert_obx_values: bool = False, start: int = 0, end: int = None,
+                              obx_values_as_array: bool = False):
+    level = max(level, 2)
+    is_bytes = type(hl7_str) is bytes
+    end = len(hl7_str) if end is None else end
+
+    # first segment should be MSH
+    if not hl7_str.startswith(b"MSH" if is_bytes else "MSH", start, end):
+        raise ValueError("ERROR: first segment is not MSH")
+
+    # MSH.1 and MSH.2 declare the separators for this message.
+    tokenizer = get_tokenizer(hl7_str[start + 3:start + 8])
+
+    parsed = [LazySegment(hl7_str, seg_start, seg_end, level = level, convert_obx_values = convert_obx_values,
+                          obx_values_as_array = obx_values_as_array, tokenizer = tokenizer)
+              for (seg_start, seg_end) in iter_segment_bounds(hl7_str, start, end)]
+
+    seg_names = set([seg.name.upper() for seg in parsed])
     return parsed, seg_names
 
-def get_with_default(elements: list, seg_name: str, index: int, as_string: bool = True):
+# file level batched conversion of numeric OBX.5 values (NM, NA, NR).
+# converting each OBX.5 on its own costs a few python calls per OBX, which adds up over tens of thousands of OBX per file.
+# instead, collect the raw payloads of all numeric OBX in all messages, join them, and parse them with 1 np.fromstring call
+# per dtype (integer payloads into an int64 buffer, decimal payloads into a float64 buffer).
+# each NA/NR OBX.5 then becomes a view into the flat buffer (offsets from the per-payload token counts), with integer
+# payloads narrowed as by convert_numeric_payload (see _narrowed_buffers), so the dtypes are the same as with obx_values_as_array,
+# and each NM OBX.5 becomes a python int or float, same as convert_obx_values.
+# the converted values are placed in the LazySegment field cache, so hl7_data_factory sees them as already converted.
+# payloads that cannot be batched (empty, repetitions/subcomponents, NM with components) are left for the per-field path.
+# if a batch fails to parse, each payload in it is converted individually, and the bad ones are left for the per-field path
+# to report.  segments should come from tokenize_hl7_message_lazy with convert_obx_values=True, and level >= 4.
+_NUMERIC_OBX_TYPES = {k for k, v in hl7_type_to_pandas_type.items() if v in (DataType.NUMERIC, DataType.LIST_OF_NUMERIC)}
+
+def convert_obx_values_batch(messages: list) -> int:
     """
-    Get the value from the segment at the given index.
-    If the index is out of range, return None.
+    Convert the numeric OBX.5 values of all messages (lists of LazySegments) in 1 vectorized pass.
+    Returns the number of OBX.5 values converted.
     """
-    out_type = hl7_field_to_pandas_type.get((seg_name, index), None)
-    if out_type is None:
+    # (segments, raw payloads), per (dtype, component separator).  messages from different senders may use different separators.
+    batches = {}
+    for segments in messages:
+        for seg in segments:
+            if (type(seg) is not LazySegment) or (seg.name.upper() != 'OBX') or (seg._level < 4) or (len(seg) <= 5) or \
+                (seg._fields[5] is not None):
+                continue
+            datatype = seg[2]
+            if datatype not in _NUMERIC_OBX_TYPES:
+                continue
+            raw = seg.raw(5)
+            tok = seg._tok
+            if type(raw) is bytes:
+                component, repetition, subcomponent, dot = tok.component_b, tok.repetition_b, tok.subcomponent_b, b'.'
+            else:
+                component, repetition, subcomponent, dot = tok.component, tok.repetition, tok.subcomponent, '.'
+            is_list = hl7_type_to_pandas_type[datatype] == DataType.LIST_OF_NUMERIC
+            if (len(raw) == 0) or (repetition in raw) or (subcomponent in raw) or ((not is_list) and (component in raw)):
+                continue
+            key = (np.float64 if dot in raw else np.int64, component)
+            if key not in batches:
+                batches[key] = ([], [])
+            batches[key][0].append((seg, is_list))
+            batches[key][1].append(raw)
+
+    count = 0
+    for (dtype, sep), (targets, payloads) in batches.items():
+        values = _parse_joined_payloads(payloads, dtype, sep)
+        if values is None:
+            # fall back to converting each payload, so 1 bad payload does not fail the batch
+            log.error(f"batched OBX value conversion failed for {len(payloads)} {dtype.__name__} payloads, converting individually")
+            for (seg, is_list), raw in zip(targets, payloads):
+                try:
+                    seg._fields[5] = _convert_obx_raw_value(raw, datatype = seg[2], level = seg._level, as_array = is_list, tokenizer = seg._tok)
+                    count += 1
+                except ValueError:
+                    pass  # reported when the field is accessed.
+            continue
+        
+        # split the flat buffer by the number of tokens in each payload.
+        ends = np.cumsum([raw.count(sep) + 1 for raw in payloads])
+        starts = np.concatenate(([0], ends[:-1]))
+        buffers = _narrowed_buffers(values, starts) if dtype is np.int64 else None
+        for k, (seg, is_list) in enumerate(targets):
+            start, end = int(starts[k]), int(ends[k])
+            if not is_list:
+                seg._fields[5] = values[start].item()
+            elif buffers is None:
+                seg._fields[5] = values[start:end]
+            else:
+                seg._fields[5] = buffers[k][start:end]
+        count += len(payloads)
+    return count
+
+# integer list payloads are narrowed to the smallest of int16/int32/int64 that holds each payload's range, as
+# convert_numeric_payload does.  the flat buffer is converted once per dtype needed, and each payload gets the buffer
+# of its dtype, so the values stay views.  the payload ranges come from 1 reduceat over the buffer.
+def _narrowed_buffers(values: np.ndarray, starts: np.ndarray) -> list:
+    mins = np.minimum.reduceat(values, starts)
+    maxs = np.maximum.reduceat(values, starts)
+    converted = {}
+    buffers = []
+    for mn, mx in zip(mins, maxs):
+        dtype = narrow_int_dtype(mn, mx)
+        if dtype not in converted:
+            converted[dtype] = values.astype(dtype, copy = False) if dtype is not np.int64 else values
+        buffers.append(converted[dtype])
+    return buffers
+
+
+# parse a list of payloads in 1 np.fromstring call.  returns None if any payload fails to parse, or if an integer is
+# outside the int64 range (saturated by np.fromstring, see _int64_saturated).
+def _parse_joined_payloads(payloads: list, dtype, sep):
+    joined = sep.join(payloads)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(joined, dtype = dtype, sep = sep.decode(HL7_ENCODING) if type(sep) is bytes else sep)
+        except (DeprecationWarning, ValueError):
+            return None
+    if len(values) != joined.count(sep) + 1:
+        return None
+    if (values.dtype.kind == 'i') and (len(values) > 0) and _int64_saturated(values.min(), values.max()):
+        return None
+    return values
+
+
+# field accessors, compiled at import from hl7_field_to_pandas_type:  elements -> converted value (or the missing value).
+# extraction calls these directly, about 20 times per OBX, instead of looking up the type and dispatching on it per call.
+def _compile_field_accessor(seg_name: str, index: int, out_type: DataType, as_string: bool):
+    convert = compile_field_converter(out_type, as_string = as_string)
+    container_type = out_type[0][1]
+
+    def accessor(elements):
+        if (elements is None) or (len(elements) <= index):
+            return missing_values[container_type]
+        out_data = elements[index]
+        if out_data is None:
+            raise ValueError(f"ERROR: out_data is None for segment {elements}, index {index}. should be at least an empty string or [].")
+        # have to convert - in case we are dealing with nested lists.
+        return convert(out_data)
+    return accessor
+
+_field_accessors = {(seg_name, index, as_string): _compile_field_accessor(seg_name, index, out_type, as_string)
+                    for (seg_name, index), out_type in hl7_field_to_pandas_type.items()
+                    for as_string in (True, False)}
+
+
+def field_accessor(seg_name: str, index: int, as_string: bool = True):
+    """
+    Return the compiled accessor for the field at index of the segment:  accessor(elements) is get_with_default(elements, seg_name, index, as_string).
+    """
+    accessor = _field_accessors.get((seg_name, index, as_string), None)
+    if accessor is None:
         raise ValueError(f"ERROR: no type mapping for segment {seg_name} at index {index}.")
-    
-    if (elements is None) or (len(elements) <= index):
-        return missing_values[out_type[0][1]]
-    
-    out_data = elements[index]
-    if out_data is None:
-        raise ValueError(f"ERROR: out_data is None for segment {elements}, index {index}. should be at least an empty string or [].")
+    return accessor
 
-    # have to call this - in case we are dealing with nested lists and also to fix datetime strings.
-    return convert_field(out_data, out_type, as_string = as_string)
+
+def get_with_default(elements: list, seg_name: str, index: int, as_string: bool = True):
+    """
+    Get the value from the segment at the given index.
+    If the index is out of range, return the missing value of the field type.
+    """
+    return field_accessor(seg_name, index, as_string)(elements)
 
 
 #%%
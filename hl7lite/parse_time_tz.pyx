@@ -1,103 +1,472 @@
-# cython: language_level=3
-# from libc.time cimport tm, strptime, mktime, time_t
-from libc.time cimport tm, strptime, tzset, mktime, time_t
-from cpython.unicode cimport PyUnicode_AsUTF8String
-from cpython.bytes cimport PyBytes_AsString
-from cpython cimport PyObject
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+# HL7 DTM parser:  YYYYMMDDHHMMSS[.ffff][+/-ZZZZ] to epoch nanoseconds.
+# timestamps without a timezone offset are local time in the parser's timezone (America/New_York by default),
+# converted to UTC with a transition table computed from zoneinfo.  there is no libc timezone state (setenv/tzset/mktime),
+# so parsers for different timezones can be used in the same process, and from multiple threads.
+from libc.stdint cimport int64_t, uint32_t
+from libc.string cimport memcpy, memcmp, memset
+from cpython.unicode cimport PyUnicode_AsUTF8AndSize
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
+from collections import namedtuple
+import threading
 import numpy as np
 cimport numpy as np
-
-cdef extern from "time.h":
-    time_t timegm(tm* timeptr)
-cdef extern from "stdlib.h":
-    int setenv(const char* name, const char* value, int overwrite)
+from datetime import datetime, timezone as dt_timezone
+from zoneinfo import ZoneInfo
 
 
 default_tz = "America/New_York"
 
-def set_timezone(str timezone):
-    setenv(b"TZ", timezone.encode('utf-8'), 1)
-    tzset()
+# transition table range.  outside of it the first/last offset is used.
+TRANSITION_START_YEAR = 1900
+TRANSITION_END_YEAR = 2100
 
-set_timezone(default_tz)
 
-cdef char* fmt_basic = b"%Y%m%d%H%M%S"
-# cdef char* fmt_frac = b"%Y%m%d%H%M%S.%f"
-# cdef char* fmt_basic_tz = b"%Y%m%d%H%M%S%z"
-# cdef char* fmt_frac_tz = b"%Y%m%d%H%M%S.%f%z"
+# ---------- transition table ----------
 
-# ✅ Single timestamp parser
-def _c_parse_time_as_epoch_ns(str ts, str timezone = default_tz):
-    cdef tm tt
-    cdef time_t epoch
-    cdef char* fmt
+# returns (keys, offsets, initial_offset), all int64 seconds:
+#   keys[i]:     local time (as epoch seconds) from which offsets[i] applies.
+#   offsets[i]:  UTC offset after transition i.
+#   initial_offset:  offset before the first transition.
+# key is the later of the 2 local times of the transition, so local times in the gap (spring forward) or
+# in the overlap (fall back) get the offset from before the transition.  this is the same as mktime with tm_isdst=-1:
+#   2024-03-10 02:30 (does not exist) -> 07:30 UTC,  2024-11-03 01:30 (ambiguous) -> 05:30 UTC (first occurrence)
+def build_transition_table(str timezone, int start_year = TRANSITION_START_YEAR, int end_year = TRANSITION_END_YEAR):
+    tz = ZoneInfo(timezone)
+    start = int(datetime(start_year, 1, 1, tzinfo=dt_timezone.utc).timestamp())
+    end = int(datetime(end_year + 1, 1, 1, tzinfo=dt_timezone.utc).timestamp())
 
-    if len(ts) < 14:
-        raise ValueError(f"Invalid timestamp format: {ts}")
+    def _offset(t):
+        return int(datetime.fromtimestamp(t, tz).utcoffset().total_seconds())
 
-    # parse the actual timestamp part.
-    cdef bytes dt_bytes = PyUnicode_AsUTF8String(ts[0:14])
-    cdef char* c_dt = PyBytes_AsString(dt_bytes)
+    keys = []
+    offsets = []
+    initial = _offset(start)
+    prev_t = start
+    prev = initial
+    # sample daily, then bisect to the second where the offset changes.
+    for t in range(start + 86400, end, 86400):
+        cur = _offset(t)
+        if cur == prev:
+            prev_t = t
+            continue
+        lo, hi = prev_t, t
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if _offset(mid) == prev:
+                lo = mid
+            else:
+                hi = mid
+        keys.append(hi + max(prev, cur))
+        offsets.append(cur)
+        prev_t = t
+        prev = cur
+    return np.array(keys, dtype=np.int64), np.array(offsets, dtype=np.int64), initial
 
-    if strptime(c_dt, fmt_basic, &tt) == NULL:
-        raise ValueError(f"Invalid timestamp format: {ts}")
 
+# ---------- core parser ----------
 
-    # check to see if we have a fraction and/or timezone.
-    cdef int has_frac = len(ts) >= 15 and ts[14] == '.'
-    cdef int has_tz = len(ts) >= 19 and ts[-5] in ('+', '-')
+cdef inline int64_t _days_from_civil(int64_t y, int64_t m, int64_t d) nogil:
+    # days since 1970-01-01, proleptic gregorian.  day overflow rolls into the next month (as timegm).
+    cdef int64_t era, yoe, doy, doe
+    y -= (m <= 2)
+    era = (y if y >= 0 else y - 399) / 400
+    yoe = y - era * 400
+    doy = (153 * (m + (-3 if m > 2 else 9)) + 2) / 5 + d - 1
+    doe = yoe * 365 + yoe / 4 - yoe / 100 + doy
+    return era * 146097 + doe - 719468
 
 
-    cdef time_t frac = 0
-    if has_frac:
-        frac_str = "000000000"
-        src_frac_str = ts[15:-5] if has_tz else ts[15:]
-        src_frac_str2 = src_frac_str[:min(9, len(src_frac_str))]  # take up to 9 digits
-        frac_str = src_frac_str + frac_str[0:(9-len(src_frac_str))] # pad right with zeros to 9 digits
-        frac = int(frac_str)
-    
-    # if we have timezone, parse it.
+cdef inline int _digits(const char* s, Py_ssize_t start, Py_ssize_t count, int64_t* out) nogil:
+    cdef int64_t v = 0
+    cdef Py_ssize_t i
+    cdef char c
+    for i in range(start, start + count):
+        c = s[i]
+        if (c < 48) or (c > 57):
+            return -1
+        v = v * 10 + (c - 48)
+    out[0] = v
+    return 0
 
-    cdef int sign, tz_hour, tz_min, tz_offset
-    if has_tz:
-        # parse timezone info if present
-        # HL7 timezone format is ±HHMM at the end
-        sign = 1 if ts[-5] == '+' else -1
-        tz_hour = int(ts[-4:-2])
-        tz_min = int(ts[-2:])
-        tz_offset = sign * (tz_hour * 3600 + tz_min * 60)
 
-        epoch = (timegm(&tt) - tz_offset) * 1000000000 + frac
+# local (or UTC) wall clock seconds, fraction in ns, and the explicit offset in seconds if present.
+# fix_offset:  the US Eastern offsets 1 minute off the hour are rounded to the hour:  -0359 and -0401 to -0400, -0459 and -0501 to -0500 (see fix_time).
+# returns 0 on success, -1 on invalid format.
+cdef int _parse_fields(const char* s, Py_ssize_t n, bint fix_offset, int64_t* wall, int64_t* frac, int64_t* tz_offset, bint* has_tz) nogil:
+    cdef int64_t year, month, day, hour, minute, second, tz_hour, tz_min
+    if n < 14:
+        return -1
+    if (_digits(s, 0, 4, &year) < 0 or _digits(s, 4, 2, &month) < 0 or _digits(s, 6, 2, &day) < 0 or
+        _digits(s, 8, 2, &hour) < 0 or _digits(s, 10, 2, &minute) < 0 or _digits(s, 12, 2, &second) < 0):
+        return -1
+    if (month < 1 or month > 12 or day < 1 or day > 31 or hour > 23 or minute > 59 or second > 61):
+        return -1
+    wall[0] = ((_days_from_civil(year, month, day) * 24 + hour) * 60 + minute) * 60 + second
 
-    else:
+    # HL7 timezone format is +/-HHMM at the end
+    has_tz[0] = (n >= 19) and ((s[n - 5] == 43) or (s[n - 5] == 45))   # '+' or '-'
+    tz_offset[0] = 0
+    if has_tz[0]:
+        if (_digits(s, n - 4, 2, &tz_hour) < 0) or (_digits(s, n - 2, 2, &tz_min) < 0):
+            return -1
+        # only the device offsets that fix_time corrects.  other offsets (e.g. +0545) are valid as is.
+        if fix_offset and (s[n - 5] == 45):
+            if (tz_min == 59) and ((tz_hour == 3) or (tz_hour == 4)):
+                tz_hour += 1
+                tz_min = 0
+            elif (tz_min == 1) and ((tz_hour == 4) or (tz_hour == 5)):
+                tz_min = 0
+        tz_offset[0] = (tz_hour * 3600 + tz_min * 60) * (1 if s[n - 5] == 43 else -1)
 
+    return _parse_frac(s, n, has_tz[0], frac)
 
-        tt.tm_isdst = -1  # Let mktime determine if DST is in effect
 
-        # default timezone is local system timezone.
-        # set before running.
-        epoch = mktime(&tt) * 1000000000 + frac
+# fraction, up to 9 digits (nanoseconds), right padded with zeros
+cdef inline int _parse_frac(const char* s, Py_ssize_t n, bint has_tz, int64_t* frac) nogil:
+    cdef Py_ssize_t frac_end, i, nfrac
+    cdef int64_t v = 0
+    frac[0] = 0
+    if (n >= 15) and (s[14] == 46):   # '.'
+        frac_end = (n - 5) if has_tz else n
+        nfrac = frac_end - 15
+        if nfrac > 9:
+            nfrac = 9
+        if (nfrac > 0) and (_digits(s, 15, nfrac, &v) < 0):
+            return -1
+        for i in range(nfrac if nfrac > 0 else 0, 9):
+            v = v * 10
+        frac[0] = v
+    return 0
 
-    return epoch
 
+cdef struct TzTable:
+    const int64_t* keys
+    const int64_t* offsets
+    Py_ssize_t ntrans
+    int64_t initial
 
-def c_parse_time(str time_str, bint as_epoch_ns=False):
-    cdef time_t epoch = _c_parse_time_as_epoch_ns(time_str)
-    return epoch if as_epoch_ns else np.datetime64(epoch, 'ns' )
 
-# ✅ Batch parser
-def c_parse_time_batch(list time_strs, bint as_epoch_ns=False):
-    cdef time_t epoch
-    cdef int i
-    cdef int n = len(time_strs)
+cdef inline int64_t _local_offset(int64_t wall, const TzTable* table) nogil:
+    # offset of the last transition with keys[i] <= wall
+    cdef Py_ssize_t lo = 0, hi = table.ntrans, mid
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if table.keys[mid] <= wall:
+            lo = mid + 1
+        else:
+            hi = mid
+    return table.initial if lo == 0 else table.offsets[lo - 1]
 
-    cdef np.ndarray[np.int64_t, ndim=1] result = np.empty(n, dtype=np.int64)
 
+cdef inline bint _is_blank(const char* s, Py_ssize_t n) nogil:
+    cdef Py_ssize_t i
     for i in range(n):
-        ts = time_strs[i]
+        if s[i] != 32:
+            return False
+    return True
+
+
+# ---------- per second memo ----------
+# MSH.7, OBR.7, OBR.8 and the OBX.14s of a message usually fall in the same second.  the UTC epoch seconds are
+# memoized by the YYYYMMDDHHMMSS[+/-ZZZZ] part of the timestamp, the fraction is parsed separately.
+# direct mapped (a colliding second replaces the slot), so the size is bounded.
+DEF _MEMO_SLOTS = 256
+DEF _MEMO_KEY = 20   # 14 digits, 5 offset chars, fix_offset flag
+
+cdef struct MemoSlot:
+    char key[_MEMO_KEY]
+    int keylen
+    int64_t epoch_s
+
+cdef struct Memo:
+    MemoSlot slots[_MEMO_SLOTS]
+    int64_t hits
+    int64_t misses
+    Py_ssize_t used
+
+
+# epoch ns of 1 timestamp, through the memo.  returns 0 on success, 1 for an empty (or all spaces) timestamp, -1 on invalid format.
+cdef int _parse_memo(const char* s, Py_ssize_t n, bint fix_offset, const TzTable* table, Memo* memo, int64_t* out) nogil:
+    cdef char key[_MEMO_KEY]
+    cdef int keylen = 14
+    cdef uint32_t h = 2166136261
+    cdef int i
+    cdef bint has_tz
+    cdef MemoSlot* slot
+    cdef int64_t wall, frac, tz_offset
+
+    if n < 14:
+        return 1 if _is_blank(s, n) else -1
+    memcpy(key, s, 14)
+    has_tz = (n >= 19) and ((s[n - 5] == 43) or (s[n - 5] == 45))
+    if has_tz:
+        memcpy(key + 14, s + n - 5, 5)
+        keylen = 19
+    key[keylen] = 1 if fix_offset else 0
+    keylen += 1
+    for i in range(keylen):   # FNV-1a
+        h = (h ^ <unsigned char> key[i]) * 16777619
+    slot = &memo.slots[h & (_MEMO_SLOTS - 1)]
+
+    if (slot.keylen == keylen) and (memcmp(slot.key, key, keylen) == 0):
+        if _parse_frac(s, n, has_tz, &frac) < 0:
+            return -1
+        memo.hits += 1
+        out[0] = slot.epoch_s * 1000000000 + frac
+        return 0
+
+    if _is_blank(s, n):
+        return 1
+    if _parse_fields(s, n, fix_offset, &wall, &frac, &tz_offset, &has_tz) < 0:
+        return -1
+    if not has_tz:
+        tz_offset = _local_offset(wall, table)
+    memo.misses += 1
+    if slot.keylen == 0:
+        memo.used += 1
+    memcpy(slot.key, key, keylen)
+    slot.keylen = keylen
+    slot.epoch_s = wall - tz_offset
+    out[0] = slot.epoch_s * 1000000000 + frac
+    return 0
+
+
+MemoInfo = namedtuple('MemoInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+NAT = np.iinfo(np.int64).min   # NaT as int64, same as missing_values[int]
+cdef int64_t _NAT = NAT
+
+# longest timestamp accepted from a numpy unicode array:  YYYYMMDDHHMMSS.fffffffff+ZZZZ is 29 characters
+DEF _MAX_TS_LEN = 64
+
+
+cdef class TimeParser:
+    cdef readonly str timezone
+    cdef object _keys_arr
+    cdef object _offsets_arr
+    cdef TzTable _table
+    cdef bint _ready
+    cdef Memo _memo
+
+    def __init__(self, str timezone = default_tz):
+        self.timezone = timezone
+        ZoneInfo(timezone)   # validate now.  the table itself is built on first use.
+        self._ready = False
+        memset(&self._memo, 0, sizeof(Memo))
+
+    def __repr__(self):
+        return f"TimeParser({self.timezone})"
+
+    # memo counters, in the style of functools.lru_cache.  parse_array counts its (per call) memo lookups here as well.
+    def cache_info(self):
+        return MemoInfo(self._memo.hits, self._memo.misses, _MEMO_SLOTS, self._memo.used)
 
-        epoch = _c_parse_time_as_epoch_ns(ts)
+    def cache_clear(self):
+        memset(&self._memo, 0, sizeof(Memo))
+
+    # builds the table once.  building calls into zoneinfo and can release the GIL, so without the lock 2 threads could
+    # both build it, and the second would replace the arrays (freeing the first ones) while the first thread is already
+    # reading them in a nogil loop.  _ready is set last, so a parser that is ready is never changed again.
+    cdef _ensure_table(self):
+        cdef int64_t[::1] keys, offsets
+        if self._ready:
+            return
+        with _table_lock:
+            if self._ready:
+                return
+            keys_arr, offsets_arr, initial = _transition_table(self.timezone)
+            keys = keys_arr
+            offsets = offsets_arr
+            self._keys_arr = keys_arr
+            self._offsets_arr = offsets_arr
+            self._table.keys = &keys[0] if keys.shape[0] > 0 else NULL
+            self._table.offsets = &offsets[0] if offsets.shape[0] > 0 else NULL
+            self._table.ntrans = keys.shape[0]
+            self._table.initial = initial
+            self._ready = True
+
+    cdef int64_t _epoch_ns(self, str ts, bint fix_offset) except? -1:
+        cdef Py_ssize_t n
+        cdef const char* s = PyUnicode_AsUTF8AndSize(ts, &n)
+        cdef int64_t out
+        self._ensure_table()
+        # the GIL is held here, so the shared memo is safe.
+        if _parse_memo(s, n, fix_offset, &self._table, &self._memo, &out) != 0:
+            raise ValueError(f"Invalid timestamp format: {ts}")
+        return out
+
+    # fix_offset (on by default) applies the fix_time corrections to the explicit offset, without the string copy.
+    def epoch_ns(self, str ts, bint fix_offset=True):
+        return self._epoch_ns(ts, fix_offset)
+
+    def parse(self, str time_str, bint as_epoch_ns=False, bint fix_offset=True):
+        cdef int64_t epoch = self._epoch_ns(time_str, fix_offset)
+        return epoch if as_epoch_ns else np.datetime64(epoch, 'ns')
+
+    def parse_batch(self, list time_strs, bint as_epoch_ns=False, bint fix_offset=True):
+        cdef Py_ssize_t i, n = len(time_strs)
+        cdef np.ndarray[np.int64_t, ndim=1] result = np.empty(n, dtype=np.int64)
+        for i in range(n):
+            result[i] = self._epoch_ns(time_strs[i], fix_offset)
+        return result if as_epoch_ns else result.astype("datetime64[ns]")
+
+    # vectorized parser for a column of timestamps:  numpy S (bytes) or U (unicode) arrays are parsed from the raw buffer,
+    # anything else (object arrays, lists, pandas Series) per element.  empty strings, None and nan give NaT.
+    # returns int64 epoch ns (NaT is NAT), or datetime64[ns].
+    def parse_array(self, time_strs, bint as_epoch_ns=False, bint fix_offset=True):
+        cdef np.ndarray arr
+        cdef np.ndarray[np.int64_t, ndim=1] result
+        cdef int64_t[::1] out
+        cdef Py_ssize_t i, j, n, width, length
+        cdef const char* buf
+        cdef const uint32_t* ubuf
+        cdef char local[_MAX_TS_LEN]
+        cdef int status = 0
+        cdef Py_ssize_t bad = -1
+        cdef const char* s
+        cdef uint32_t c
+        cdef Memo* memo
+
+        if isinstance(time_strs, np.ndarray):
+            arr = time_strs
+        elif hasattr(time_strs, 'to_numpy'):
+            # pandas Series/Index/ExtensionArray.  missing (nan, NA, None) become None.
+            arr = time_strs.to_numpy(dtype=object, na_value=None)
+        else:
+            arr = np.asarray(time_strs, dtype=object)
+        if arr.ndim != 1:
+            arr = arr.ravel()
+
+        self._ensure_table()
+        n = arr.shape[0]
+        result = np.empty(n, dtype=np.int64)
+        out = result
+
+        # per call memo:  the loops run without the GIL, so the parser's memo is not shared with them.
+        memo = <Memo*> PyMem_Malloc(sizeof(Memo))
+        if memo == NULL:
+            raise MemoryError()
+        memset(memo, 0, sizeof(Memo))
+        try:
+            if arr.dtype.kind == 'S':
+                arr = np.ascontiguousarray(arr)
+                width = arr.dtype.itemsize
+                buf = <const char*> np.PyArray_DATA(arr)
+                with nogil:
+                    for i in range(n):
+                        s = buf + i * width
+                        length = width
+                        while (length > 0) and (s[length - 1] == 0):
+                            length -= 1
+                        status = _parse_memo(s, length, fix_offset, &self._table, memo, &out[i])
+                        if status == 1:
+                            out[i] = _NAT
+                        elif status < 0:
+                            bad = i
+                            break
+            elif arr.dtype.kind == 'U':
+                arr = np.ascontiguousarray(arr)
+                width = arr.dtype.itemsize // 4
+                ubuf = <const uint32_t*> np.PyArray_DATA(arr)
+                with nogil:
+                    for i in range(n):
+                        length = width
+                        while (length > 0) and (ubuf[i * width + length - 1] == 0):
+                            length -= 1
+                        if length >= _MAX_TS_LEN:
+                            bad = i
+                            break
+                        for j in range(length):
+                            c = ubuf[i * width + j]
+                            # non-ascii characters are invalid anyways
+                            local[j] = <char> c if c < 128 else 0
+                        status = _parse_memo(local, length, fix_offset, &self._table, memo, &out[i])
+                        if status == 1:
+                            out[i] = _NAT
+                        elif status < 0:
+                            bad = i
+                            break
+            else:
+                for i in range(n):
+                    x = arr[i]
+                    if isinstance(x, str):
+                        s = PyUnicode_AsUTF8AndSize(x, &length)
+                    elif isinstance(x, bytes):
+                        s = <bytes> x
+                        length = len(<bytes> x)
+                    elif (x is None) or ((isinstance(x, float)) and (x != x)):
+                        out[i] = _NAT
+                        continue
+                    else:
+                        raise TypeError(f"Unsupported timestamp type {type(x)}: {x}")
+                    status = _parse_memo(s, length, fix_offset, &self._table, memo, &out[i])
+                    if status == 1:
+                        out[i] = _NAT
+                    elif status < 0:
+                        bad = i
+                        break
+        finally:
+            self._memo.hits += memo.hits
+            self._memo.misses += memo.misses
+            PyMem_Free(memo)
+
+        if bad >= 0:
+            raise ValueError(f"Invalid timestamp format: {arr[bad]}")
+        return result if as_epoch_ns else result.view("datetime64[ns]")
+
+
+# tables and parsers are cached per timezone.  entries are only ever added, so concurrent use is safe.
+# tables are built under _table_lock (see TimeParser._ensure_table), so there is one table per timezone.
+_tables = {}
+_parsers = {}
+_table_lock = threading.Lock()
+
+def _transition_table(str timezone):
+    table = _tables.get(timezone)
+    if table is None:
+        table = build_transition_table(timezone)
+        _tables[timezone] = table
+    return table
+
+
+def get_time_parser(str timezone = None):
+    if timezone is None:
+        return _default_parser
+    parser = _parsers.get(timezone)
+    if parser is None:
+        parser = TimeParser(timezone)
+        _parsers[timezone] = parser
+    return parser
+
+
+# changes the default timezone for timestamps without an offset.  affects only this module, not the process TZ.
+def set_timezone(str timezone):
+    global default_tz, _default_parser
+    _default_parser = get_time_parser(timezone)
+    default_tz = timezone
+
+_default_parser = None
+set_timezone(default_tz)
+
+
+# ✅ Single timestamp parser
+def _c_parse_time_as_epoch_ns(str ts, str timezone = None, bint fix_offset = True):
+    return get_time_parser(timezone).epoch_ns(ts, fix_offset)
+
+
+def c_parse_time(str time_str, bint as_epoch_ns=False, str timezone = None, bint fix_offset = True):
+    return get_time_parser(timezone).parse(time_str, as_epoch_ns, fix_offset)
+
+# ✅ Batch parser
+def c_parse_time_batch(list time_strs, bint as_epoch_ns=False, str timezone = None, bint fix_offset = True):
+    return get_time_parser(timezone).parse_batch(time_strs, as_epoch_ns, fix_offset)
 
-        result[i] = epoch
+# ✅ Column parser (numpy S/U arrays, pandas Series)
+def c_parse_time_array(time_strs, bint as_epoch_ns=False, str timezone = None, bint fix_offset = True):
+    return get_time_parser(timezone).parse_array(time_strs, as_epoch_ns, fix_offset)
 
-    return result if as_epoch_ns else result.astype("datetime64[ns]")
+# memo counters of the parser for timezone (default parser if None)
+def time_cache_info(str timezone = None):
+    return get_time_parser(timezone).cache_info()
@@ -1,11 +1,19 @@
 import pandas as pd
 import os
 from fastparquet import ParquetFile, write
+from fastparquet.writer import make_metadata, make_row_group, write_thrift, MARKER
+import struct
+import re
+import json
 import shutil
 from datetime import datetime
 from hl7lite.hl7_datatypes import missing_values
 import numpy as np
 from emory.fs_utils import get_file_list
+from hl7lite.hl7_io import scan_hl7_file, iter_hl7_file_rows, update_patient_files, build_patient_intervals
+from hl7lite.hl7_columnar import ColumnarBatch, TIME_COLUMNS
+from hl7lite.hl7_index import split_sizes
+from concurrent.futures import ProcessPoolExecutor
 
 import logging
 log = logging.getLogger(__name__)
@@ -45,6 +53,90 @@ object_encoding = {
     'file': (str, 'string'),
 }
 
+# values layouts.  'list':  the values column, with each row's samples as a list (json encoded by fastparquet), which is
+# decoded back into boxed python numbers.  'blob':  the samples of each row as 1 binary blob of a native numeric array
+# (values_blob), and its numpy dtype string (values_dtype, e.g. '<i2'), so a row is read back with np.frombuffer,
+# without a python object per sample.  integer samples are stored in the smallest of int16/int32/int64 that holds them,
+# floats in their own dtype (float64, or float32 if parsed that way), so the samples are unchanged.
+# rows that are not numeric (e.g. ST values, or all values if the OBX values are not converted, see convert_obx_values)
+# are stored as json, with values_dtype 'json'.
+VALUES_LAYOUTS = ('list', 'blob')
+BLOB_COLUMNS = {'values_blob': (bytes, 'object'), 'values_dtype': (str, 'string')}
+_JSON_DTYPE = 'json'
+
+
+def pack_values(values) -> tuple:
+    """
+    Pack the samples of 1 row (list or numpy array) into (blob, dtype string).  See VALUES_LAYOUTS.
+    """
+    if not isinstance(values, (list, np.ndarray)):
+        values = [values,]
+    try:
+        arr = np.asarray(values)
+    except ValueError:
+        arr = None
+    if (arr is None) or (arr.ndim != 1) or (arr.dtype.kind not in 'iuf'):
+        return json.dumps(values.tolist() if isinstance(values, np.ndarray) else values).encode(), _JSON_DTYPE
+    if (arr.dtype.kind in 'iu') and (len(arr) > 0):
+        mn, mx = arr.min(), arr.max()
+        for dtype in (np.int16, np.int32, np.int64):
+            info = np.iinfo(dtype)
+            if (mn >= info.min) and (mx <= info.max):
+                arr = arr.astype(dtype, copy = False)
+                break
+    # little endian, so the files are the same on any platform.
+    dtype = arr.dtype.newbyteorder('<')
+    return arr.astype(dtype, copy = False).tobytes(), dtype.str
+
+
+def unpack_values(blob: bytes, dtype: str):
+    """
+    The samples of 1 row from its (blob, dtype string), as a read-only numpy array over the blob (no copy),
+    or the list of values for json rows.
+    """
+    if dtype == _JSON_DTYPE:
+        return json.loads(blob)
+    return np.frombuffer(blob, dtype = dtype)
+
+
+# values_blob and values_dtype columns (object array of bytes, and dtype strings) of the values of the rows.
+def _pack_values_column(values) -> tuple:
+    blobs = np.empty(len(values), dtype=object)
+    dtypes = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        blobs[i], dtypes[i] = pack_values(v)
+    return blobs, dtypes
+
+
+def read_row_values(df: pd.DataFrame) -> list:
+    """
+    The samples of each row of a stitched DataFrame, in either values layout:  numpy arrays over the values_blob bytes
+    (no copy), or the values lists as numpy arrays.
+    """
+    if 'values_blob' in df.columns:
+        return [unpack_values(blob, dtype) for blob, dtype in zip(df['values_blob'], df['values_dtype'])]
+    return [np.asarray(v) for v in df['values']]
+
+
+def read_flat_values(df: pd.DataFrame) -> tuple:
+    """
+    The samples of all rows of a stitched DataFrame as 1 flat numpy array and row offsets, i.e. the samples of row i are
+    flat[offsets[i]:offsets[i+1]] (as ColumnarBatch.ragged_values).  Numeric rows of different dtypes are promoted to
+    a common dtype, and an object array is returned if any row is not numeric.
+    """
+    rows = read_row_values(df)
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in rows], out=offsets[1:])
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.float64), offsets
+    if all(isinstance(v, np.ndarray) and (v.dtype.kind in 'iuf') for v in rows):
+        return np.concatenate(rows), offsets
+    flat = np.empty(offsets[-1], dtype=object)
+    for i, v in enumerate(rows):
+        flat[offsets[i]:offsets[i+1]] = list(v)
+    return flat, offsets
+
+
 # no significant space savings vs string (possibly because of fastparquet engine).  use string for simplicity.
 # # Convert column types based on object_encoding mapping
 # object_encoding = {
@@ -103,6 +195,9 @@ def write_hl7data_parquet(output_dir, file_name, df: pd.DataFrame):
     # the datetime should have timezone info, though.
     dtypes = {col: dtype[1] for col, dtype in object_encoding.items() if col in df.columns}
     df = df.astype(dtypes, copy=True, errors='raise')
+    # waveform values may be numpy arrays (obx_values_as_array).  fastparquet encodes the object column as lists.
+    if ('values' in df.columns) and any(isinstance(v, np.ndarray) for v in df['values']):
+        df['values'] = [v.tolist() if isinstance(v, np.ndarray) else v for v in df['values']]
     # df['start_t'] = df['start_t'].dt.tz_convert('UTC')
     # df['end_t'] = df['end_t'].dt.tz_convert('UTC')
     # try:
@@ -155,8 +250,16 @@ def write_hl7data_parquet(output_dir, file_name, df: pd.DataFrame):
         raise(e)
 
 
+# file name of the parquet file of a bed.  part > 0 is for writers that cover only a run of the files of a bed.
+def bed_parquet_name(hosp: str, unit: str, bed: str, part: int = 0) -> str:
+    unit2 = unit.replace(" ", "_").replace("-", "_")
+    bed2 = bed.replace(" ", "_").replace("-", "_")
+    return f"BED_{hosp}-{unit2}-{bed2}.parquet" if part == 0 else f"BED_{hosp}-{unit2}-{bed2}-{part}.parquet"
+
+
 # Note : VERY SLOW, 20X slower - have to open multiple files.  if i is left as 0, accumulates into _0.parquet
-def hl7_to_parquet_bed(hl7_dir: str,  df: pd.DataFrame, i: int = 0):
+# part > 0 writes to BED_...-{part}.parquet instead (see bed_parquet_name).  for many batches, use BedParquetWriter.
+def hl7_to_parquet_bed(hl7_dir: str,  df: pd.DataFrame, i: int = 0, part: int = 0):
     if df is None or df.empty:
         return
 
@@ -166,9 +269,7 @@ def hl7_to_parquet_bed(hl7_dir: str,  df: pd.DataFrame, i: int = 0):
     # testfn = os.path.join(hl7_dir, 'stitched', 'test.parquet')
     # testfn2 = os.path.join(hl7_dir, 'stitched', 'test2.parquet')
     for (hosp, unit, bed), group_df in groups:
-        unit2 = unit.replace(" ", "_").replace("-", "_")
-        bed2 = bed.replace(" ", "_").replace("-", "_")
-        fname = f"BED_{hosp}-{unit2}-{bed2}.parquet"
+        fname = bed_parquet_name(hosp, unit, bed, part)
         # log.info(f"Writing group {len(group_df)} rows for [{bed}] and [{pid}] to {fname} in {hl7_dir}/stitched")
         fn = os.path.join(hl7_dir, 'stitched', fname)
         # DEBUGGING ONLY
@@ -211,17 +312,386 @@ def hl7_to_parquet_direct(hl7_dir: str, df: pd.DataFrame, i: int = 0):
     #                      os.path.splitext(os.path.basename(hl7_file))[0] + ".parquet",
     #                      df)
 
-def finalize_parquet(hl7_dir: str):
-    # parquet_files = get_file_list(hl7_dir, extension='.parquet')
-    # if not parquet_files:
-    #     return None
-    # for f in parquet_files:
-    #     pf = ParquetFile(f)
-    #     if pf.count == 0:
-    #         log.warning(f"Parquet file {f} is empty, removing it.")
-    #         os.remove(f)
-    #     pf.merge(f)  # can't find merge function.
-    ...
+# the waveform values columns of a stitched row.  rows that are the same in all the other columns are the same data
+# written more than once, e.g. by re-running a conversion, and are dropped by the loaders and by compaction.
+PARQUET_VALUE_COLUMNS = ['values', 'values_blob', 'index']
+
+
+# the columns of df that identify a stitched row (see PARQUET_VALUE_COLUMNS).
+def parquet_row_key(df: pd.DataFrame) -> list:
+    return [col for col in df.columns if col not in PARQUET_VALUE_COLUMNS]
+
+
+# BED_{hosp}-{unit}-{bed}.parquet and its parts, BED_{hosp}-{unit}-{bed}-{part}.parquet (see bed_parquet_name).
+_BED_PARQUET_RE = re.compile(r'^(BED_[^-]*-[^-]*-[^-]*)(?:-(\d+))?\.parquet$')
+
+
+# rewrite the stitched file of a bed, with its part files (see bed_parquet_name) appended in the given order, as 1 file
+# sorted by start_t, without duplicate rows, in row groups of row_group_size rows, and remove the parts.
+# appends leave 1 row group per write, which every later read pays for.  the sort is stable, so rows with the same start_t
+# stay in file and part order, and the first of the duplicates is kept.  the file is written to a temporary file and
+# renamed, so readers never see a partial file.  a bed without rows has its files removed.
+def compact_bed_parquet(filename: str, part_files: list = (), row_group_size: int = 1_000_000) -> int:
+    in_files = ([filename] if os.path.exists(filename) else []) + list(part_files)
+    dfs = [pd.read_parquet(fn, engine='fastparquet') for fn in in_files]
+    df = pd.concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0]
+    del dfs
+    if len(df) == 0:
+        log.warning(f"Parquet file {filename} is empty, removing it.")
+        for fn in in_files:
+            os.remove(fn)
+        return 0
+    if 'start_t' in df.columns:
+        df = df.sort_values('start_t', kind='stable')
+    df = df.drop_duplicates(subset=parquet_row_key(df), keep='first')
+    df = df.reset_index(drop=True)
+
+    tmp_fn = filename + '.tmp'
+    try:
+        df.to_parquet(tmp_fn, engine='fastparquet', compression='snappy', row_group_offsets=row_group_size)
+        os.replace(tmp_fn, filename)
+    finally:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+    for fn in part_files:
+        os.remove(fn)
+    return len(df)
+
+
+def finalize_parquet(hl7_dir: str, workers: int = None, row_group_size: int = 1_000_000) -> dict:
+    """
+    Compact the per-bed parquet files in {hl7_dir}/stitched (see compact_bed_parquet) into 1 file per bed:  the
+    BED_*-{part}.parquet files of a bed are merged into its BED_*.parquet file, in part order.  Other parquet files are
+    compacted on their own.  Runs with a pool of workers processes (default: 1 per cpu), 1 bed per task.
+    Returns the number of rows per file name.
+    """
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    if workers < 1:
+        raise ValueError(f"workers should be at least 1, got {workers}")
+    stitched = os.path.join(hl7_dir, 'stitched')
+    if not os.path.isdir(stitched):
+        return {}
+
+    # file name -> parts by part number.
+    beds = {}
+    for fname in sorted(f for f in os.listdir(stitched) if f.endswith('.parquet')):
+        match = _BED_PARQUET_RE.match(fname)
+        if match is None:
+            beds.setdefault(fname, {})
+        else:
+            parts = beds.setdefault(match.group(1) + '.parquet', {})
+            if match.group(2) is not None:
+                parts[int(match.group(2))] = os.path.join(stitched, fname)
+    tasks = [(os.path.join(stitched, fname), [parts[part] for part in sorted(parts)]) for fname, parts in beds.items()]
+
+    # largest beds first, so a large bed does not start last.
+    def _size(task):
+        return sum(os.path.getsize(fn) for fn in [task[0]] + task[1] if os.path.exists(fn))
+    tasks.sort(key = _size, reverse = True)
+    counts = _run_tasks(compact_bed_parquet, [(fn, part_files, row_group_size) for (fn, part_files) in tasks], workers)
+    results = {os.path.basename(fn): nrows for (fn, _), nrows in zip(tasks, counts)}
+    log.info(f"compacted {len(results)} parquet files in {stitched}, {sum(results.values())} rows")
+    return dict(sorted(results.items()))
+
+
+# ColumnarBatch rows as a DataFrame for write_hl7data_parquet.  batch times are naive UTC datetime64, so localize them.
+def batch_to_parquet_df(batch: ColumnarBatch) -> pd.DataFrame:
+    df = batch.to_dataframe()
+    for col in TIME_COLUMNS:
+        df[col] = df[col].dt.tz_localize('UTC')
+    return df
+
+
+#%%
+# object array of the per-row values (lists or arrays), without numpy turning same-length lists into a 2d array.
+def _object_array(vals) -> np.ndarray:
+    arr = np.empty(len(vals), dtype=object)
+    arr[:] = list(vals)
+    return arr
+
+
+# the parquet frame of a set of columns, with the object_encoding types (the same frame as write_hl7data_parquet writes).
+# each column is constructed in its final type, instead of converting a copy of the whole frame with astype.
+# with values_layout 'blob', the values column is replaced by the values_blob and values_dtype columns (see pack_values).
+def _parquet_frame(cols: dict, values_layout: str = 'list') -> pd.DataFrame:
+    out = {}
+    for col, arr in cols.items():
+        dtype = object_encoding[col][1] if col in object_encoding else None
+        if (col == 'values') and (values_layout == 'blob'):
+            blobs, dtypes = _pack_values_column(arr)
+            out['values_blob'] = blobs
+            out['values_dtype'] = pd.array(dtypes, dtype=BLOB_COLUMNS['values_dtype'][1])
+        elif col == 'values':
+            # numpy arrays (obx_values_as_array) are written as lists, as fastparquet encodes the object column as json.
+            out[col] = _object_array([v.tolist() if isinstance(v, np.ndarray) else v for v in arr])
+        elif dtype == 'datetime64[ns, UTC]':
+            out[col] = pd.to_datetime(arr, utc=True)
+        elif dtype is not None:
+            out[col] = pd.array(arr, dtype=dtype)
+        else:
+            out[col] = arr
+    return pd.DataFrame(out)
+
+
+# rough in-memory size of a set of columns, for the flush threshold:  the samples plus a fixed cost per row.
+def _approx_nbytes(cols: dict) -> int:
+    nrows = len(next(iter(cols.values())))
+    nsamples = sum(len(v) if isinstance(v, (list, np.ndarray)) else 1 for v in cols['values']) if 'values' in cols else 0
+    return nsamples * 8 + nrows * 256
+
+
+# the file metadata of an existing parquet file, and the end of its row group data, where the footer starts.
+def _parquet_data_end(fn: str) -> tuple:
+    fmd = ParquetFile(fn).fmd
+    with open(fn, 'rb') as f:
+        f.seek(-8, 2)
+        foot_size = struct.unpack('<I', f.read(4))[0]
+        data_end = f.seek(0, 2) - foot_size - 8
+    return fmd, data_end
+
+
+# write df as 1 row group at data_end of the parquet file fn, then rewrite the footer from fmd, which gets the row group.
+# returns the new end of the row group data.
+def _append_row_group(fn: str, fmd, data_end: int, df: pd.DataFrame) -> int:
+    with open(fn, 'rb+') as f:
+        f.seek(data_end)
+        rg = make_row_group(f, df, fmd.schema, compression='snappy')
+        data_end = f.tell()
+        # the thrift object returns a copy of its list, so set it back (as fastparquet.writer.write_simple does).
+        fmd.row_groups = fmd.row_groups + [rg]
+        fmd.num_rows = sum(r.num_rows for r in fmd.row_groups)
+        foot_size = write_thrift(f, fmd)
+        f.write(struct.pack(b"<I", foot_size))
+        f.write(MARKER)
+        f.truncate()
+    return data_end
+
+
+# long-lived per-bed parquet writer.  rows are buffered per (hospital, bed_unit, bed_id), and written as 1 row group
+# once a bed has max_rows rows or about max_bytes bytes buffered, and on flush/close.
+# hl7_to_parquet_bed appends each batch with to_parquet(append=True), which re-reads the footer, converts a copy of the
+# rows with astype, and makes a row group per batch per bed.  here the file metadata is built once per file, from its
+# first row group, and kept:  each flush writes the row group at the end of the data, then rewrites the footer, so the
+# file is complete after every flush, and no file stays open between flushes.
+# an existing file is appended to, if its schema is the same.  files are named as by hl7_to_parquet_bed.
+# values_layout is 'list' or 'blob' (see VALUES_LAYOUTS).
+class BedParquetWriter:
+    def __init__(self, hl7_dir: str, part: int = 0, max_rows: int = 100_000, max_bytes: int = 64 * 1024 * 1024,
+                 values_layout: str = 'list'):
+        if values_layout not in VALUES_LAYOUTS:
+            raise ValueError(f"values_layout should be one of {VALUES_LAYOUTS}, got {values_layout}")
+        self.out_dir = os.path.join(hl7_dir, 'stitched')
+        self.part = part
+        self.values_layout = values_layout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self._buffers = {}    # bed key -> list of column dicts
+        self._nrows = {}
+        self._nbytes = {}
+        self._files = {}      # bed key -> (file name, file metadata, end of the row group data)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_batch(self, batch: ColumnarBatch):
+        if len(batch) > 0:
+            self._add_rows(batch.to_columns())
+
+    def write_dataframe(self, df: pd.DataFrame):
+        if (df is not None) and (not df.empty):
+            self._add_rows({col: df[col].to_numpy() for col in df.columns})
+
+    # split the rows by bed and buffer them.
+    def _add_rows(self, cols: dict):
+        if self.closed:
+            raise ValueError("BedParquetWriter is closed")
+        beds = pd.DataFrame({'hospital': cols['hospital'], 'bed_unit': cols['bed_unit'], 'bed_id': cols['bed_id']})
+        for bed_key, rows in beds.groupby(['hospital', 'bed_unit', 'bed_id'], sort=False, dropna=False).indices.items():
+            bed_cols = {col: arr[rows] for col, arr in cols.items()}
+            self._buffers.setdefault(bed_key, []).append(bed_cols)
+            self._nrows[bed_key] = self._nrows.get(bed_key, 0) + len(rows)
+            self._nbytes[bed_key] = self._nbytes.get(bed_key, 0) + _approx_nbytes(bed_cols)
+            if (self._nrows[bed_key] >= self.max_rows) or (self._nbytes[bed_key] >= self.max_bytes):
+                self._flush_bed(bed_key)
+
+    def flush(self):
+        for bed_key in list(self._buffers.keys()):
+            self._flush_bed(bed_key)
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+    def _flush_bed(self, bed_key):
+        chunks = self._buffers.pop(bed_key, None)
+        self._nrows.pop(bed_key, None)
+        self._nbytes.pop(bed_key, None)
+        if not chunks:
+            return
+        cols = {col: np.concatenate([c[col] for c in chunks]) if len(chunks) > 1 else chunks[0][col] for col in chunks[0]}
+        df = _parquet_frame(cols, self.values_layout)
+        if bed_key not in self._files:
+            self._files[bed_key] = self._open_file(bed_key, df)
+        fn, fmd, data_end = self._files[bed_key]
+        self._files[bed_key] = (fn, fmd, _append_row_group(fn, fmd, data_end, df))
+
+    # the file of each bed written so far, (hospital, bed_unit, bed_id) -> file name.
+    def bed_files(self) -> dict:
+        return {bed_key: fn for bed_key, (fn, _, _) in self._files.items()}
+
+    # file metadata as fastparquet.write makes it for df (see write_hl7data_parquet), or that of the existing file.
+    def _open_file(self, bed_key, df: pd.DataFrame):
+        hosp, unit, bed = bed_key
+        fn = os.path.join(self.out_dir, bed_parquet_name(hosp, unit, bed, self.part))
+        fmd = make_metadata(df, has_nulls=True, object_encoding='infer', times='int64', index_cols=df.index)
+        if os.path.exists(fn):
+            existing, data_end = _parquet_data_end(fn)
+            if existing.schema != fmd.schema:
+                raise ValueError(f"parquet file {fn} has a different schema, cannot append bed {bed_key}")
+            return fn, existing, data_end
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(fn, 'wb') as f:
+            f.write(MARKER)
+        return fn, fmd, len(MARKER)
+
+
+#%%
+# parallel conversion of a directory of HL7 files to per-bed parquet files.
+# tasks are bed-affine:  all files of a bed (a get_file_list key) go to 1 task and are read in order, so the rows of a
+# task are in file order.  files directly under hl7_dir ("all_beds") have all beds mixed, so they are split into (up to)
+# workers contiguous runs of about the same number of bytes.  a 1 hour folder is all_beds, so this is what spreads it over the cores.
+# the output file of a row is named by the bed in the message (see bed_parquet_name), not by the get_file_list key, so
+# different keys (or all_beds runs) can write the same bed.  so with more than 1 task, each task writes its own
+# BED_*-{part}.parquet files, with part 1, 2, ... in key order, and the all_beds runs in file order, and convert_directory
+# merges the parts of a bed into its BED_*.parquet file in part order once all tasks are done.  a single task writes BED_*.parquet.
+# tasks are returned largest first, so a long bed is not started last.
+def _plan_directory_tasks(hl7_files: dict, workers: int) -> list:
+    tasks = []
+    for bed_id in sorted(hl7_files.keys()):
+        files = hl7_files[bed_id]
+        sizes = [os.path.getsize(f) for f in files]
+        if bed_id == "all_beds":
+            for (start, end) in split_sizes(sizes, workers):
+                tasks.append((sum(sizes[start:end]), bed_id, files[start:end]))
+        else:
+            tasks.append((sum(sizes), bed_id, files))
+    parts = range(1, len(tasks) + 1) if len(tasks) > 1 else [0]
+    tasks = [(size, bed_id, part, files) for part, (size, bed_id, files) in zip(parts, tasks)]
+    tasks.sort(key = lambda t: t[0], reverse = True)
+    return [(bed_id, part, files) for (_, bed_id, part, files) in tasks]
+
+
+# concatenate the part files of a bed (see _plan_directory_tasks) onto filename, in the given order, and remove them.
+# the rows are copied 1 row group at a time (see _append_row_group), so a bed is never fully in memory.
+# filename is appended to if it exists, else the first part becomes it.  returns the number of rows in filename.
+def merge_bed_parts(filename: str, part_files: list) -> int:
+    part_files = list(part_files)
+    if (not os.path.exists(filename)) and (len(part_files) > 0):
+        os.replace(part_files.pop(0), filename)
+    fmd, data_end = _parquet_data_end(filename)
+    for part_fn in part_files:
+        part = ParquetFile(part_fn)
+        if part.fmd.schema != fmd.schema:
+            raise ValueError(f"parquet file {part_fn} has a different schema than {filename}, cannot merge")
+        for df in part.iter_row_groups():
+            data_end = _append_row_group(filename, fmd, data_end, df)
+        os.remove(part_fn)
+    return fmd.num_rows
+
+
+# the read_options of convert_directory for scan_hl7_file.  the rest are for iter_hl7_file_rows.
+_SCAN_OPTIONS = ('include_types', 'exclude_types', 'save_index')
+
+
+# run fn(*args) for each args of tasks, in a pool of workers processes, or in this process with 1 worker.
+# returns the results in task order.
+def _run_tasks(fn, tasks: list, workers: int) -> list:
+    if (workers == 1) or (len(tasks) <= 1):
+        return [fn(*args) for args in tasks]
+    with ProcessPoolExecutor(max_workers = min(workers, len(tasks))) as pool:
+        futures = [pool.submit(fn, *args) for args in tasks]
+        return [future.result() for future in futures]
+
+
+# phase 1 of a convert_directory task, run in a worker process:  the message index and patient info of each file
+# (see scan_hl7_file).  the patient files are not touched, so the tasks do not depend on each other.
+def _scan_file_run(files: list, scan_options: dict) -> list:
+    return [scan_hl7_file(hl7_file, **scan_options) for hl7_file in files]
+
+
+# phase 2 of a convert_directory task, run in a worker process.  the files are streamed (iter_hl7_file_rows) chunk by chunk
+# into the bed parquet files, with the patients of each file from the patient files as merged in phase 1.
+# returns the number of rows written, and the file of each bed (see BedParquetWriter.bed_files).
+def _convert_file_run(files: list, indices: list, bed_to_pats: list, out_dir: str, part: int, chunk_size: int,
+                      values_layout: str, row_options: dict) -> tuple:
+    nrows = 0
+    with BedParquetWriter(out_dir, part = part, values_layout = values_layout) as writer:
+        for hl7_file, index, bed_to_pat in zip(files, indices, bed_to_pats):
+            patients = build_patient_intervals(bed_to_pat) if bed_to_pat is not None else None
+            for batch in iter_hl7_file_rows(hl7_file, index, patients, chunk_size = chunk_size, as_batch = True, **row_options):
+                writer.write_batch(batch)
+                nrows += len(batch)
+    return nrows, writer.bed_files()
+
+
+def convert_directory(hl7_dir: str, history_fn: str, current_fn: str, out_dir: str = None, workers: int = None,
+                      chunk_size: int = 1000, values_layout: str = 'list', **read_options) -> dict:
+    """
+    Convert the HL7 files under hl7_dir (see get_file_list) to per-bed parquet files in {out_dir}/stitched, with a pool of
+    workers processes (default: 1 per cpu).  chunk_size is the number of messages per parquet write, and read_options are
+    passed to iter_hl7_file (e.g. include_types, batch_obx_values).  history_fn and current_fn are the patient files, as in
+    read_hl7_file.  values_layout is the waveform values storage, 'list' or 'blob' (see VALUES_LAYOUTS).
+    The tasks (see _plan_directory_tasks) first scan their files for patient info in parallel.  The patient info is then
+    merged into the patient files file by file in run order, as a serial conversion does, and the tasks write the rows,
+    with the patients of each file, in parallel.
+    With more than 1 task, each task writes its own BED_*-{part}.parquet files (see _plan_directory_tasks), which are
+    merged into 1 BED_*.parquet file per bed at the end (see merge_bed_parts).
+    Returns the number of rows written per (bed_id, part).
+    """
+    out_dir = hl7_dir if out_dir is None else out_dir
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    if workers < 1:
+        raise ValueError(f"workers should be at least 1, got {workers}")
+    if values_layout not in VALUES_LAYOUTS:
+        raise ValueError(f"values_layout should be one of {VALUES_LAYOUTS}, got {values_layout}")
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size should be at least 1, got {chunk_size}")
+    hl7_files = get_file_list(hl7_dir)
+    tasks = _plan_directory_tasks(hl7_files, workers)
+    if len(tasks) == 0:
+        return {}
+    scan_options = {key: val for key, val in read_options.items() if key in _SCAN_OPTIONS}
+    row_options = {key: val for key, val in read_options.items() if key not in _SCAN_OPTIONS}
+
+    log.info(f"converting {sum(len(files) for (_, _, files) in tasks)} files in {len(tasks)} tasks with {workers} workers")
+    scans = _run_tasks(_scan_file_run, [(files, scan_options) for (_, _, files) in tasks], workers)
+
+    # the runs follow each other in part order, so run k starts with the patients at the end of run k-1.
+    bed_to_pats = [None] * len(tasks)
+    for k in sorted(range(len(tasks)), key = lambda k: tasks[k][1]):
+        bed_to_pats[k] = [update_patient_files(history_fn, current_fn, pat_infos) for (_, pat_infos) in scans[k]]
+
+    counts = _run_tasks(_convert_file_run,
+                        [(files, [index for (index, _) in scan], task_bed_to_pats, out_dir, part, chunk_size, values_layout, row_options)
+                         for (_, part, files), scan, task_bed_to_pats in zip(tasks, scans, bed_to_pats)], workers)
+    results = {(bed_id, part): nrows for (bed_id, part, _), (nrows, _) in zip(tasks, counts)}
+
+    # once all the tasks are done, the parts of each bed are merged in part order into its BED_*.parquet file.
+    bed_parts = {}
+    for (_, part, _), (_, bed_files) in sorted(zip(tasks, counts), key = lambda t: t[0][1]):
+        for bed_key, fn in bed_files.items():
+            if part > 0:
+                bed_parts.setdefault(bed_key, []).append(fn)
+    stitched = os.path.join(out_dir, 'stitched')
+    _run_tasks(merge_bed_parts, [(os.path.join(stitched, bed_parquet_name(*bed_key)), part_files)
+                                 for bed_key, part_files in bed_parts.items()], workers)
+    log.info(f"wrote {sum(results.values())} rows from {hl7_dir} to {os.path.join(out_dir, 'stitched')}")
+    return results
 
 
 def load_direct_parquets(hl7_dir: str, file_start:int, num_files: int):
@@ -243,9 +713,7 @@ def load_direct_parquets(hl7_dir: str, file_start:int, num_files: int):
     parquet_files = parquet_files[file_start:file_end]
     log.info(f"Loading {len(parquet_files)} parquet files from {hl7_dir}/stitched, starting at index {file_start}")
     df = pd.concat([pd.read_parquet(f, engine='fastparquet') for f in parquet_files], ignore_index=True)
-    value_cols = ['values', 'index']  #['values', 'values_num', 'values_str', 'index']  # adjust as needed
-    cols_to_check = [col for col in df.columns if col not in value_cols]
-    return df.drop_duplicates(subset=cols_to_check)
+    return df.drop_duplicates(subset=parquet_row_key(df))
 
 def load_bed_parquets(hl7_dir: str, file_start:int = 0, num_files: int = -1, batch_size: int = 0):
     parquet_files = get_file_list(hl7_dir, extension='.parquet')
@@ -301,8 +769,6 @@ def load_bed_parquet(filename: str):
 
 def load_bed_parquets2(filenames: list[str]):
     dfs = {}
-    # index is actually not there.
-    value_cols = ['values', 'index']  #['values', 'values_num', 'values_str', 'index']  # adjust as needed
     # load all the files.
     for f in filenames:
         key, df = load_bed_parquet(f)
@@ -317,8 +783,7 @@ def load_bed_parquets2(filenames: list[str]):
     # concatenate and drop duplicates for each bed.
     for key in dfs.keys():
         dfs[key] = pd.concat(dfs[key], ignore_index=True)
-        # drop duplicates based on all columns except value_cols
-        cols_to_check = [col for col in dfs[key].columns if col not in value_cols]
-        dfs[key] = dfs[key].drop_duplicates(subset=cols_to_check)
+        # drop duplicates based on all columns except the values (see PARQUET_VALUE_COLUMNS)
+        dfs[key] = dfs[key].drop_duplicates(subset=parquet_row_key(dfs[key]))
 
     return dfs
\ No newline at end of file
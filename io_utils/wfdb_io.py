@@ -217,7 +217,9 @@ def write_wfdb_segment(output_dir, dir_name, file_prefix,
     if (samples_per_frame is None):
         # all have same length, only allows ndarray or 1D list
         if isinstance(values, np.ndarray):
-            values_array = values
+            values_array = values.reshape(-1, 1) if values.ndim == 1 else values  # 1D array is a single signal
+            if not np.issubdtype(values_array.dtype, np.floating):
+                values_array = values_array.astype(np.float64)  # p_signal is physical, so has to be float (obx_values_as_array gives int16/int32 arrays)
             row_min = np.nanmin(values_array, axis=0)
             row_max = np.nanmax(values_array, axis=0)
         elif isinstance(values, list) and all(isinstance(v, (int, float)) for v in values):
@@ -229,7 +231,12 @@ def write_wfdb_segment(output_dir, dir_name, file_prefix,
 
     else:
         # samples_per_frame specified, allow list of 1D arrays or a 2D array
-        if isinstance(values, np.ndarray):
+        if isinstance(values, np.ndarray) and (values.ndim == 1):
+            # single signal as a 1D array (e.g. waveform values parsed with obx_values_as_array)
+            values_array = [values.astype(np.float64, copy=False)]
+            row_min = [np.nanmin(values)]
+            row_max = [np.nanmax(values)]
+        elif isinstance(values, np.ndarray):
             values_array = values
             row_min = list(np.nanmin(values_array, axis=0))
             row_max = list(np.nanmax(values_array, axis=0))
@@ -1,13 +1,16 @@
 """Integration tests: tokenize → HierarchicalMessage → hl7_data_factory pipeline."""
 import json
 import pytest
-from hl7lite.hl7_tokenizer import tokenize_hl7_message
+import numpy as np
+import pandas as pd
+from hl7lite.hl7_tokenizer import tokenize_hl7_message, tokenize_hl7_message_lazy
 from hl7lite.hl7_ds import (
     HierarchicalMessage,
     hl7_data_factory,
     HL7ORUData,
     HL7ADTData,
     HL7WaveformData,
+    ObxAttribute,
 )
 from hl7lite.hl7_io import convert_msg_to_json
 
@@ -191,6 +194,79 @@ class TestHL7DataFactory:
         assert len(rows) > 0
 
 
+# ---------------------------------------------------------------------------
+# DTM offset corrections (fix_time) in the string fields and the message checks
+# ---------------------------------------------------------------------------
+
+_VITALS_MSG = "\n".join([
+    "MSH|^~\\&|CAPSULE|EUHM|RECEIVER|HOSPITAL|20230615120200-0400||ORU^R01|CTRL001|P|2.3|||NE|NE",
+    "PID|1|PAT001|PAT001||DOE^JOHN||19800101|M",
+    "PV1|1|I|EUH-4TN-T434",
+    "OBR|1||OBS001|182777000^monitoring of patient^SCT|||20230615120000-0359||||EUH-4TN-T434||||||||||||EUHM",
+    "OBX|1|NM|150456^MDC_PULS_OXIM_SAT_O2^MDC||98|%||N|||F|||20230615120000-0401",
+    "OBR|2||OBS001|182777000^monitoring of patient^SCT|||20230615120000-0400||||EUH-4TN-T434||||||||||||EUHM",
+    "OBX|1|NM|150456^MDC_PULS_OXIM_SAT_O2^MDC||98|%||N|||F|||20230615120000-0400",
+]) + "\n"
+
+
+class TestTimeOffsets:
+    def _data(self):
+        parsed, seg_names = tokenize_hl7_message(_VITALS_MSG)
+        return hl7_data_factory(HierarchicalMessage(parsed, seg_names))
+
+    def test_string_fields_corrected(self):
+        data = self._data()
+        assert [s.start_t for s in data.signals] == ["20230615120000-0400"] * 2
+        assert [o.obx_time for s in data.signals for o in s.attributes.values()] == ["20230615120000-0400"] * 2
+
+    def test_verify_compares_instants(self):
+        from hl7lite.hl7_aecg_test import _verify_hl7_msg, VerifyResultType
+        data = self._data()
+        # the same instant with the uncorrected offsets, as a caller could set them.
+        data.signals[0].start_t = "20230615120000-0359"
+        for signal, obx_time in zip(data.signals, ["20230615120000-0401", "20230615120000-0400"]):
+            signal.end_t = None
+            for obx in signal.attributes.values():
+                obx.obx_time = obx_time
+        result = _verify_hl7_msg(data, check_start_times=True, verbose=False)
+        assert VerifyResultType.WARN_OBR_OBX_START_MISMATCH not in result["warns"]
+        assert VerifyResultType.WARN_OBR_MULTIPLE_EVENT_TIMES not in result["warns"]
+        data.signals[1].start_t = "20230615120001-0400"
+        result = _verify_hl7_msg(data, check_start_times=True, verbose=False)
+        assert VerifyResultType.WARN_OBR_OBX_START_MISMATCH in result["warns"]
+        assert VerifyResultType.WARN_OBR_MULTIPLE_EVENT_TIMES in result["warns"]
+
+
+# ---------------------------------------------------------------------------
+# slotted data model and keep_message
+# ---------------------------------------------------------------------------
+
+class TestCompactDataModel:
+    def _data(self, msg, **kwargs):
+        return hl7_data_factory(HierarchicalMessage(*tokenize_hl7_message(msg)), **kwargs)
+
+    def test_no_instance_dicts(self, oru_waveform_msg, adt_msg):
+        oru = self._data(oru_waveform_msg)
+        for obj in (oru, oru.signals[0], next(iter(oru.signals[0].attributes.values())), self._data(adt_msg)):
+            assert not hasattr(obj, "__dict__")
+
+    def test_obx_attribute_access(self, oru_waveform_msg):
+        obx = next(iter(self._data(oru_waveform_msg).signals[0].attributes.values()))
+        assert isinstance(obx, ObxAttribute)
+        assert obx["valtype"] == obx.valtype and obx["channel_id"] == obx.channel_id
+        assert set(obx.to_dict()) == {"valtype", "type", "code", "channel_id", "obx_time", "UoM", "value", "ref_range"}
+        with pytest.raises(KeyError):
+            obx["control_id"]
+
+    def test_drop_message(self, oru_waveform_msg, adt_msg):
+        for msg in (oru_waveform_msg, adt_msg):
+            kept = self._data(msg)
+            dropped = self._data(msg, keep_message=False)
+            assert isinstance(kept.orig_message, HierarchicalMessage)
+            assert dropped.orig_message is None
+            assert repr(dropped.to_row_dicts(time_as_epoch=True)) == repr(kept.to_row_dicts(time_as_epoch=True))
+
+
 # ---------------------------------------------------------------------------
 # convert_msg_to_json
 # ---------------------------------------------------------------------------
@@ -209,3 +285,367 @@ class TestConvertMsgToJson:
         result = convert_msg_to_json(adt_msg)
         parsed = json.loads(result)
         assert isinstance(parsed, (dict, list))
+
+
+# ---------------------------------------------------------------------------
+# Lazy tokenization through the full pipeline
+# ---------------------------------------------------------------------------
+
+class TestLazyPipeline:
+    def test_row_dicts_match_eager(self, oru_waveform_msg):
+        eager = hl7_data_factory(HierarchicalMessage(*tokenize_hl7_message(oru_waveform_msg)))
+        lazy = hl7_data_factory(HierarchicalMessage(*tokenize_hl7_message_lazy(oru_waveform_msg)))
+        assert lazy.to_row_dicts(time_as_epoch=True) == eager.to_row_dicts(time_as_epoch=True)
+
+    def test_waveform_values_as_array(self, oru_waveform_msg):
+        msg = oru_waveform_msg.replace("OBX|1|NM|", "OBX|1|NA|").replace("||100|", "||100^101^-3|")
+        eager = hl7_data_factory(HierarchicalMessage(*tokenize_hl7_message(msg, convert_obx_values=True)))
+        arrays = hl7_data_factory(HierarchicalMessage(*tokenize_hl7_message_lazy(msg, obx_values_as_array=True)))
+        for erow, arow in zip(eager.to_row_dicts(time_as_epoch=True), arrays.to_row_dicts(time_as_epoch=True)):
+            assert isinstance(arow["values"], np.ndarray)
+            assert arow["values"].tolist() == erow["values"] == [100, 101, -3]
+            assert arow["nsamp"] == erow["nsamp"] == 3
+
+
+# ---------------------------------------------------------------------------
+# classify_raw_message — message kind from raw text, before tokenizing
+# ---------------------------------------------------------------------------
+
+class TestClassifyRawMessage:
+    @pytest.mark.parametrize("code,kind", [
+        ("69121^MDC_OBS_WAVE_CTS^MDC", "Waveform"),
+        ("182777000^monitoring of patient^SCT", "Vitals"),
+        ("196616^MDC_EVT_ALARM^MDC", "Alarm"),
+        ("12345^UNKNOWN^MDC", "Other"),
+    ])
+    def test_oru_kinds(self, oru_waveform_msg, code, kind):
+        from hl7lite.hl7_ds import classify_raw_message
+        msg = oru_waveform_msg.replace("69121^MDC_OBS_WAVE_CTS^MDC", code)
+        assert classify_raw_message(msg) == kind
+        assert classify_raw_message(msg.encode()) == kind
+
+    def test_adt(self, adt_msg):
+        from hl7lite.hl7_ds import classify_raw_message
+        assert classify_raw_message(adt_msg.encode()) == "ADT"
+        assert classify_raw_message(adt_msg.replace("ADT^A01", "QRY^A19")) == "Other"
+
+    def test_matches_factory(self, oru_waveform_msg, adt_msg):
+        from hl7lite.hl7_ds import classify_raw_message
+        for msg in (oru_waveform_msg, adt_msg):
+            data = hl7_data_factory(HierarchicalMessage(*tokenize_hl7_message(msg)))
+            assert classify_raw_message(msg) == data.message_type
+
+    def test_offsets_and_custom_separators(self, oru_waveform_msg, adt_msg):
+        from hl7lite.hl7_ds import classify_raw_message
+        content = (adt_msg + "\n" + oru_waveform_msg.replace("|", "#").replace("^", "*")).encode()
+        start = content.index(b"MSH#")
+        assert classify_raw_message(content, 0, start) == "ADT"
+        assert classify_raw_message(content, start, len(content)) == "Waveform"
+
+
+# ---------------------------------------------------------------------------
+# read_hl7_file_for_segment — projection reader
+# ---------------------------------------------------------------------------
+
+class TestReadForSegmentProjection:
+    @pytest.mark.parametrize("field", [None, 0, 1, 2, 3, 4, 5, 9, 99])
+    def test_fields_match_full_parse(self, oru_waveform_msg, adt_msg, field):
+        from hl7lite.hl7_io import _ProjectedMessage, _extract_field
+        for msg in (oru_waveform_msg, adt_msg.replace("PAT001|", "PAT001~ALT|", 1).replace("T434", "T434&X")):
+            raw = msg.encode()
+            full = HierarchicalMessage(*tokenize_hl7_message_lazy(raw))
+            projected = _ProjectedMessage(raw, 0, len(raw), {"MSH", "PID", "PV1", "OBR", "OBX", "EVN"})
+            pairs = [(projected.msh, full.msh), (projected.pid, full.pid), (projected.pv1, full.pv1)]
+            for pobr, fobr in zip(projected.obrs, full.obrs):
+                pairs.append((pobr["obr"], fobr["obr"]))
+                pairs.extend(zip(pobr["obx"], fobr["obx"]))
+            pairs.extend(zip(projected.all.get("EVN", []), full.all.get("EVN", [])))
+            for pseg, fseg in pairs:
+                assert _extract_field(pseg, field) == _extract_field(fseg, field)
+
+    def test_messages_without_requested_segment_are_skipped(self, oru_waveform_msg, adt_msg, tmp_path):
+        from hl7lite.hl7_io import read_hl7_file_for_segment
+        f = tmp_path / "sample.hl7"
+        f.write_text(oru_waveform_msg + "\n" + adt_msg)
+        assert read_hl7_file_for_segment(str(f), ["EVN.1"]) == ["EVN.1:A01"]
+        assert read_hl7_file_for_segment(str(f), ["OBR.4"]) == ["_OBR.4:69121^MDC_OBS_WAVE_CTS^MDC"]
+
+
+
+class TestReadForSegmentSeparators:
+    def test_msh1_and_components_use_message_separators(self, oru_waveform_msg, tmp_path):
+        from hl7lite.hl7_io import read_hl7_file_for_segment
+        custom = oru_waveform_msg.replace("|", "#").replace("^", "*")
+        f = tmp_path / "sample.hl7"
+        f.write_text(custom)
+        out = read_hl7_file_for_segment(str(f), ["MSH.1", "MSH.9", "OBR.4"])
+        assert "MSH.1:#\tMSH.9:ORU*R01" in out
+        assert "_OBR.4:69121*MDC_OBS_WAVE_CTS*MDC" in out
+
+
+
+# ---------------------------------------------------------------------------
+# ColumnarBatch — columnar alternative to to_row_dicts
+# ---------------------------------------------------------------------------
+
+class TestColumnarBatch:
+    def _batch(self, *msgs):
+        from hl7lite.hl7_columnar import ColumnarBatch
+        batch = ColumnarBatch()
+        rows = []
+        for msg in msgs:
+            data = hl7_data_factory(HierarchicalMessage(*tokenize_hl7_message_lazy(msg, convert_obx_values=True)))
+            data.append_to_batch(batch)
+            rows.extend(data.to_row_dicts())
+        return batch, rows
+
+    def test_dataframe_matches_row_dicts(self, oru_waveform_msg):
+        import pandas as pd
+        vitals = oru_waveform_msg.replace("69121^MDC_OBS_WAVE_CTS^MDC", "182777000^monitoring of patient^SCT")
+        batch, rows = self._batch(oru_waveform_msg, vitals)
+        df = batch.to_dataframe()
+        expected = pd.DataFrame(rows)
+        assert len(batch) == len(df) == len(expected) == 3
+        assert list(df.columns[:len(expected.columns)]) == list(expected.columns)
+        for col in expected.columns:
+            if col == "pd_samp_ms":
+                assert df[col].isna().tolist() == expected[col].isna().tolist()
+            else:
+                assert df[col].tolist() == expected[col].tolist(), col
+        assert df["start_t"].dtype == expected["start_t"].dtype
+
+    def test_message_and_signal_columns_are_shared(self, oru_waveform_msg):
+        batch, _ = self._batch(oru_waveform_msg, oru_waveform_msg)
+        assert (batch.num_messages, batch.num_signals, len(batch)) == (2, 2, 2)
+        cols = batch.to_columns()
+        assert cols["bed_id"][0] is cols["bed_id"][1]
+        assert cols["channel"][0] is cols["channel"][1]
+
+    def test_ragged_values(self, oru_waveform_msg):
+        msg = oru_waveform_msg.replace("OBX|1|NM|", "OBX|1|NA|")
+        batch, _ = self._batch(msg.replace("||100|", "||100^101^-3|"), msg.replace("||100|", "||7^8|"))
+        flat, offsets = batch.ragged_values()
+        assert offsets.tolist() == [0, 3, 5]
+        assert flat.tolist() == [100, 101, -3, 7, 8]
+        assert flat.dtype.kind == "i"
+
+    def test_extend_rebases_indices(self, oru_waveform_msg, adt_msg):
+        first, _ = self._batch(oru_waveform_msg)
+        second, _ = self._batch(oru_waveform_msg.replace("T434", "T435"))
+        first.extend(second)
+        assert first.to_dataframe()["bed_id"].tolist() == ["T434-01", "T435-01"]
+
+    def test_read_hl7_file_as_batch(self, oru_waveform_msg, adt_msg, tmp_path):
+        from hl7lite.hl7_io import read_hl7_file
+        f = tmp_path / "sample-0007.hl7"
+        f.write_text(adt_msg + "\n" + oru_waveform_msg)
+        batch, pat_infos = read_hl7_file(str(f), str(tmp_path / "hist.parquet"), str(tmp_path / "cur.parquet"), as_batch=True)
+        df = batch.to_dataframe()
+        assert len(df) == 1 and len(pat_infos) == 2
+        assert (df["seg_id"][0], df["file"][0], df["pid"][0]) == (7, "sample-0007.hl7", "PAT001")
+
+    def test_patient_info_backfill(self, oru_waveform_msg):
+        from hl7lite.hl7_io import _fill_batch_patient_info, build_patient_intervals
+        from hl7lite.hl7_datatypes import missing_values
+        batch, _ = self._batch(oru_waveform_msg.replace("PID|1|PAT001|PAT001||DOE^JOHN", "PID|1||||"))
+        _, bed_key, start_t = next(batch.iter_signal_beds())
+        pat = {"pid": "PAT002", "visit_id": "V2", "first_name": "JANE", "last_name": "DOE"}
+        bed_to_pat = {bed_key: [
+            dict(pat, pid="EARLIER", start_t=start_t - 10, end_t=start_t - 5),
+            dict(pat, start_t=start_t - 5, end_t=missing_values[int]),
+        ]}
+        _fill_batch_patient_info(batch, build_patient_intervals(bed_to_pat))
+        df = batch.to_dataframe()
+        assert df[["pid", "visit_id", "first_name", "last_name"]].values.tolist() == [["PAT002", "V2", "JANE", "DOE"]]
+
+
+# ---------------------------------------------------------------------------
+# iter_hl7_file — streaming reader
+# ---------------------------------------------------------------------------
+
+class TestIterHl7File:
+    def _file(self, tmp_path, oru_waveform_msg, adt_msg):
+        f = tmp_path / "sample-0003.hl7"
+        # the T434 waveform has no PID, so it is backfilled from the ADT.  its signal starts before its MSH time.
+        msgs = [adt_msg, _no_pid(oru_waveform_msg)] + [oru_waveform_msg.replace("T434", f"T43{i}") for i in range(5, 9)]
+        f.write_text("\n".join(msgs))
+        return str(f)
+
+    def _read(self, tmp_path, fn, **kwargs):
+        from hl7lite.hl7_io import read_hl7_file
+        out = read_hl7_file(fn, str(tmp_path / "h1.parquet"), str(tmp_path / "c1.parquet"), **kwargs)
+        return out, pd.read_parquet(tmp_path / "h1.parquet")
+
+    def _iter(self, tmp_path, fn, **kwargs):
+        from hl7lite.hl7_io import iter_hl7_file
+        chunks = list(iter_hl7_file(fn, str(tmp_path / "h2.parquet"), str(tmp_path / "c2.parquet"), **kwargs))
+        return chunks, pd.read_parquet(tmp_path / "h2.parquet")
+
+    def test_rows_same_as_read_hl7_file(self, oru_waveform_msg, adt_msg, tmp_path):
+        fn = self._file(tmp_path, oru_waveform_msg, adt_msg)
+        (rows, _), hist = self._read(tmp_path, fn)
+        chunks, hist2 = self._iter(tmp_path, fn, chunk_size=2)
+        # adt + 1 waveform in the first chunk, 2 waveforms in the others.
+        assert [len(c) for c in chunks] == [1, 2, 2]
+        assert repr([r for c in chunks for r in c]) == repr(rows)
+        assert hist2.equals(hist)
+
+    def test_batches_same_as_read_hl7_file(self, oru_waveform_msg, adt_msg, tmp_path):
+        fn = self._file(tmp_path, oru_waveform_msg, adt_msg)
+        (batch, _), _ = self._read(tmp_path, fn, as_batch=True)
+        chunks, _ = self._iter(tmp_path, fn, chunk_size=4, as_batch=True)
+        assert [len(c) for c in chunks] == [3, 2]
+        chunks[0].extend(chunks[1])
+        assert chunks[0].to_dataframe().equals(batch.to_dataframe())
+
+    def test_include_types(self, oru_waveform_msg, adt_msg, tmp_path):
+        fn = self._file(tmp_path, oru_waveform_msg, adt_msg)
+        chunks, hist = self._iter(tmp_path, fn, include_types={"ADT"})
+        assert chunks == []
+        assert hist["bed_id"].tolist() == ["T434-01"]
+
+    def test_save_index(self, oru_waveform_msg, adt_msg, tmp_path):
+        from hl7lite.hl7_index import index_sidecar_path, load_message_index
+        fn = self._file(tmp_path, oru_waveform_msg, adt_msg)
+        chunks, _ = self._iter(tmp_path, fn, save_index=True, as_batch=True)
+        assert len(load_message_index(fn)) == 6 and sum(len(c) for c in chunks) == 5
+        assert (tmp_path / "sample-0003.hl7.idx.npz").exists() and index_sidecar_path(fn).endswith(".idx.npz")
+
+    def test_scan_then_rows_same_as_iter(self, oru_waveform_msg, adt_msg, tmp_path):
+        from hl7lite.hl7_io import scan_hl7_file, iter_hl7_file_rows, update_patient_files, build_patient_intervals
+        fn = self._file(tmp_path, oru_waveform_msg, adt_msg)
+        chunks, hist = self._iter(tmp_path, fn, chunk_size=2, as_batch=True)
+        index, pat_infos = scan_hl7_file(fn)
+        assert not (tmp_path / "h3.parquet").exists()
+        bed_to_pat = update_patient_files(str(tmp_path / "h3.parquet"), str(tmp_path / "c3.parquet"), pat_infos)
+        chunks2 = list(iter_hl7_file_rows(fn, index, build_patient_intervals(bed_to_pat), chunk_size=2, as_batch=True))
+        assert len(chunks2) == len(chunks)
+        assert all(c2.to_dataframe().equals(c.to_dataframe()) for c, c2 in zip(chunks, chunks2))
+        assert pd.read_parquet(tmp_path / "h3.parquet").equals(hist)
+
+    def test_rejected_messages_have_no_patients(self, oru_waveform_msg, adt_msg, tmp_path):
+        # a plain OBX.3 is rejected when the signals are extracted, after the message level fields are read.
+        rejected = oru_waveform_msg.replace("T434", "T439").replace("PAT001|PAT001", "PAT009|PAT009") \
+            .replace("MDC_ECG_LEAD_I^MDC_ECG_LEAD_I^Local", "LEAD_I")
+        f = tmp_path / "sample-0004.hl7"
+        f.write_text("\n".join([adt_msg, rejected, oru_waveform_msg.replace("T434", "T435")]))
+        (rows, pat_infos), hist = self._read(tmp_path, str(f))
+        chunks, hist2 = self._iter(tmp_path, str(f))
+        assert "PAT009" not in [p["pid"] for p in pat_infos]
+        assert repr([r for c in chunks for r in c]) == repr(rows)
+        assert hist2.equals(hist)
+        assert "T439-01" not in hist2["bed_id"].tolist()
+
+    def test_invalid_chunk_size(self, oru_waveform_msg, adt_msg, tmp_path):
+        fn = self._file(tmp_path, oru_waveform_msg, adt_msg)
+        with pytest.raises(ValueError):
+            self._iter(tmp_path, fn, chunk_size=0)
+
+
+# ---------------------------------------------------------------------------
+# patient attribution — interval index over bed_to_pat
+# ---------------------------------------------------------------------------
+
+# waveform without patient info, sent 5 minutes after its signal starts.  it records an unnamed patient at the MSH time,
+# so the signal start is still in the interval of the previous patient of the bed.
+def _no_pid(oru_waveform_msg):
+    return oru_waveform_msg.replace("PID|1|PAT001|PAT001||DOE^JOHN", "PID|1||||").replace("HOSPITAL|20230615120000", "HOSPITAL|20230615120500")
+
+
+class TestPatientIntervals:
+    BED = ("EUH", "4TN", "T434-01")
+
+    def _pat(self, pid, start_t, end_t):
+        return {"pid": pid, "visit_id": "V" + pid, "first_name": "F" + pid, "last_name": "L" + pid,
+                "middle_initial": "", "start_t": start_t, "end_t": end_t}
+
+    def _lookup(self, bed_to_pat, times, bed=BED):
+        from hl7lite.hl7_io import build_patient_intervals, _lookup_patient_info
+        found = _lookup_patient_info([bed] * len(times), np.array(times, dtype=np.int64), build_patient_intervals(bed_to_pat))
+        return [None if p is None else p["pid"] for p in found]
+
+    def test_consecutive_patients(self):
+        from hl7lite.hl7_datatypes import missing_values
+        # as from update_patient_info:  each patient ends at the next one's start, the last one is open ('').
+        bed_to_pat = {self.BED: [self._pat("A", 10, 20), self._pat("B", 20, 30), self._pat("C", 30, missing_values[str])]}
+        assert self._lookup(bed_to_pat, [5, 10, 19, 20, 30, 10**18]) == [None, "A", "A", "B", "C", "C"]
+
+    def test_closed_and_missing_ends(self):
+        from hl7lite.hl7_datatypes import missing_values
+        bed_to_pat = {self.BED: [self._pat("B", 40, missing_values[int]), self._pat("A", 10, 20)]}
+        assert self._lookup(bed_to_pat, [15, 25, 45]) == ["A", None, "B"]
+        assert self._lookup(bed_to_pat, [15], bed=("EUH", "4TN", "OTHER")) == [None]
+
+    def test_same_as_linear_scan(self):
+        rng = np.random.default_rng(0)
+        starts = np.sort(rng.choice(1000, size=20, replace=False))
+        pats = [self._pat(str(i), int(s), int(e)) for i, (s, e) in enumerate(zip(starts[:-1], starts[1:]))]
+        times = rng.integers(-10, 1100, size=200)
+        expected = [next((p["pid"] for p in pats if p["start_t"] <= t < p["end_t"]), None) for t in times]
+        assert self._lookup({self.BED: pats}, times) == expected
+
+    def test_rows_backfilled_by_read_hl7_file(self, oru_waveform_msg, adt_msg, tmp_path):
+        from hl7lite.hl7_io import read_hl7_file
+        f = tmp_path / "sample-0004.hl7"
+        f.write_text(adt_msg + "\n" + _no_pid(oru_waveform_msg))
+        rows, _ = read_hl7_file(str(f), str(tmp_path / "hist.parquet"), str(tmp_path / "cur.parquet"))
+        assert [(r["pid"], r["first_name"], r["last_name"]) for r in rows] == [("PAT001", "JOHN", "DOE")]
+        batch, _ = read_hl7_file(str(f), str(tmp_path / "hist2.parquet"), str(tmp_path / "cur2.parquet"), as_batch=True)
+        assert batch.to_dataframe()[["pid", "first_name", "last_name"]].values.tolist() == [["PAT001", "JOHN", "DOE"]]
+
+
+# ---------------------------------------------------------------------------
+# update_patient_info — patient intervals per bed
+# ---------------------------------------------------------------------------
+
+class TestUpdatePatientInfo:
+    def _info(self, bed, pid, start_t):
+        from hl7lite.hl7_datatypes import missing_values
+        return {"hospital": "EUH", "bed_unit": "4TN", "bed_id": bed, "pid": pid, "visit_id": "V" + pid, "first_name": "F",
+                "last_name": "L", "middle_initial": "", "start_t": start_t, "end_t": missing_values[int]}
+
+    # per bed loop, as update_patient_info was before it was vectorized (with stable sorts).
+    def _reference(self, history, current, infos):
+        pid_df = pd.DataFrame(infos)
+        merged = pd.concat([current, pid_df], ignore_index=True) if current is not None else pid_df
+        rows = []
+        for _, group in merged.groupby(["hospital", "bed_unit", "bed_id"]):
+            group = group.sort_values("start_t", kind="stable")
+            if group["pid"].nunique() == 1:
+                rows.append(group.iloc[[0]].copy())
+            elif group["pid"].nunique() > 1:
+                first = group.groupby("pid").nth(0).copy()
+                first["end_t"] = first["start_t"].shift(-1, fill_value="").values
+                rows.append(first)
+        cur = pd.concat(rows, ignore_index=True).sort_values("start_t", kind="stable")
+        nxt = cur.drop_duplicates(subset=["hospital", "bed_unit", "bed_id"], keep="last").reset_index(drop=True)
+        hist = pd.concat([history, cur], ignore_index=True).sort_values("start_t", kind="stable")
+        hist = hist.drop_duplicates(subset=["hospital", "bed_unit", "bed_id", "pid", "visit_id", "start_t"], keep="last").reset_index(drop=True)
+        return hist, nxt
+
+    def test_single_patient_keeps_oldest(self):
+        from hl7lite.hl7_io import update_patient_info
+        history, bed_to_pat, nxt = update_patient_info(None, None, [self._info("B1", "A", 30), self._info("B1", "A", 10)])
+        assert [(p["pid"], p["start_t"]) for p in bed_to_pat[("EUH", "4TN", "B1")]] == [("A", 10)]
+        assert nxt["start_t"].tolist() == [10] and len(history) == 1
+
+    def test_patients_chained_per_bed(self):
+        from hl7lite.hl7_io import update_patient_info
+        infos = [self._info("B1", "A", 10), self._info("B2", "C", 15), self._info("B1", "B", 20),
+                 self._info("B1", "A", 30), self._info("B1", "C", 40)]
+        _, bed_to_pat, nxt = update_patient_info(None, None, infos)
+        assert [(p["pid"], p["start_t"], p["end_t"]) for p in bed_to_pat[("EUH", "4TN", "B1")]] == [("A", 10, 20), ("B", 20, 40), ("C", 40, "")]
+        assert [p["pid"] for p in bed_to_pat[("EUH", "4TN", "B2")]] == ["C"]
+        assert nxt[["bed_id", "pid"]].values.tolist() == [["B2", "C"], ["B1", "C"]]
+
+    def test_same_as_per_bed_loop(self):
+        from hl7lite.hl7_io import update_patient_info
+        rng = np.random.default_rng(0)
+        history = current = ref_history = ref_current = None
+        for f in range(4):
+            times = rng.permutation(np.arange(f * 1000, f * 1000 + 600, 3))[:150]
+            infos = [self._info(f"B{rng.integers(12)}", ["", "P1", "P2", "P3"][rng.integers(4)], int(t)) for t in times]
+            history, _, current = update_patient_info(history, current, infos)
+            ref_history, ref_current = self._reference(ref_history, ref_current, infos)
+            assert history.equals(ref_history)
+            assert current.equals(ref_current)
@@ -7,7 +7,19 @@ from io_utils.parquet_io import (
     write_hl7data_parquet,
     load_bed_parquet,
     load_bed_parquets2,
+    convert_directory,
+    _plan_directory_tasks,
+    BedParquetWriter,
+    bed_parquet_name,
+    merge_bed_parts,
+    finalize_parquet,
+    pack_values,
+    unpack_values,
+    read_row_values,
+    read_flat_values,
 )
+from fastparquet import ParquetFile
+from hl7lite.hl7_patients import PatientHistoryStore
 
 
 # ---------------------------------------------------------------------------
@@ -66,6 +78,14 @@ class TestWriteParquet:
         loaded = pd.read_parquet(pf_path, engine="fastparquet")
         assert len(loaded) >= 2
 
+    def test_ndarray_values_written_as_lists(self, tmp_path):
+        df = _make_df(2)
+        df["values"] = [np.array([100, 101, 102], dtype=np.int16), np.array([1.5, 2.5])]
+        write_hl7data_parquet(str(tmp_path), "test.parquet", df)
+        loaded = pd.read_parquet(str(tmp_path / "test.parquet"), engine="fastparquet")
+        assert list(loaded["values"].iloc[0]) == [100, 101, 102]
+        assert list(loaded["values"].iloc[1]) == [1.5, 2.5]
+
 
 # ---------------------------------------------------------------------------
 # load_bed_parquet
@@ -139,3 +159,362 @@ class TestLoadBedParquets2:
 
         result = load_bed_parquets2([str(tmp_path / fname)])
         assert ("EUHM", "MICU", "BED01") in result
+
+
+# ---------------------------------------------------------------------------
+# BedParquetWriter
+# ---------------------------------------------------------------------------
+
+class TestBedParquetWriter:
+    def _beds_df(self, n, beds):
+        df = pd.concat([_make_df(n).assign(bed_id=bed) for bed in beds], ignore_index=True)
+        df["values"] = [np.arange(k + 1, dtype=np.float64) for k in range(len(df))]
+        return df
+
+    def _stitched(self, tmp_path, bed="BED01", part=0):
+        return tmp_path / "stitched" / bed_parquet_name("EUHM", "MICU", bed, part)
+
+    def test_same_as_write_hl7data_parquet(self, tmp_path):
+        df = self._beds_df(3, ["BED01", "BED02"])
+        with BedParquetWriter(str(tmp_path)) as writer:
+            writer.write_dataframe(df)
+            writer.write_dataframe(df)
+        for bed in ["BED01", "BED02"]:
+            bed_df = df[df["bed_id"] == bed]
+            write_hl7data_parquet(str(tmp_path / "ref"), "ref.parquet", bed_df)
+            write_hl7data_parquet(str(tmp_path / "ref"), "ref.parquet", bed_df)
+            ref = pd.read_parquet(tmp_path / "ref" / "ref.parquet")
+            out = pd.read_parquet(self._stitched(tmp_path, bed))
+            assert (out.dtypes == ref.dtypes).all()
+            assert out.drop(columns="values").equals(ref.drop(columns="values"))
+            assert [list(v) for v in out["values"]] == [list(v) for v in ref["values"]]
+            assert ParquetFile(str(self._stitched(tmp_path, bed))).schema == ParquetFile(str(tmp_path / "ref" / "ref.parquet")).schema
+            os.remove(tmp_path / "ref" / "ref.parquet")
+
+    def test_row_groups_per_threshold(self, tmp_path):
+        with BedParquetWriter(str(tmp_path), max_rows=4) as writer:
+            for _ in range(5):
+                writer.write_dataframe(self._beds_df(2, ["BED01"]))
+            # 2 full row groups are on disk, and the file is complete between flushes.
+            assert len(pd.read_parquet(self._stitched(tmp_path))) == 8
+        pf = ParquetFile(str(self._stitched(tmp_path)))
+        assert [rg.num_rows for rg in pf.row_groups] == [4, 4, 2]
+
+    def test_byte_threshold(self, tmp_path):
+        with BedParquetWriter(str(tmp_path), max_bytes=1) as writer:
+            for _ in range(3):
+                writer.write_dataframe(self._beds_df(1, ["BED01"]))
+        assert len(ParquetFile(str(self._stitched(tmp_path))).row_groups) == 3
+
+    def test_appends_to_existing_file(self, tmp_path):
+        for _ in range(2):
+            with BedParquetWriter(str(tmp_path), part=2) as writer:
+                writer.write_dataframe(self._beds_df(2, ["BED01"]))
+        assert self._stitched(tmp_path, part=2).name == "BED_EUHM-MICU-BED01-2.parquet"
+        assert len(pd.read_parquet(self._stitched(tmp_path, part=2))) == 4
+
+    def test_different_schema_rejected(self, tmp_path):
+        with BedParquetWriter(str(tmp_path)) as writer:
+            writer.write_dataframe(self._beds_df(1, ["BED01"]))
+        writer = BedParquetWriter(str(tmp_path))
+        writer.write_dataframe(self._beds_df(1, ["BED01"]).drop(columns="UoM"))
+        with pytest.raises(ValueError):
+            writer.close()
+
+    def test_closed_writer(self, tmp_path):
+        writer = BedParquetWriter(str(tmp_path))
+        writer.close()
+        with pytest.raises(ValueError):
+            writer.write_dataframe(self._beds_df(1, ["BED01"]))
+
+    def test_merge_bed_parts(self, tmp_path):
+        dfs = [self._beds_df(n, ["BED01"]).assign(control_id=f"C{n}") for n in (1, 2, 3)]
+        for part, df in enumerate(dfs[1:], start=1):
+            with BedParquetWriter(str(tmp_path), part=part) as writer:
+                writer.write_dataframe(df)
+            assert writer.bed_files() == {("EUHM", "MICU", "BED01"): str(self._stitched(tmp_path, part=part))}
+        parts = [str(self._stitched(tmp_path, part=part)) for part in (1, 2)]
+        with BedParquetWriter(str(tmp_path)) as writer:
+            writer.write_dataframe(dfs[0])
+        ref = pd.concat([pd.read_parquet(fn) for fn in [str(self._stitched(tmp_path))] + parts], ignore_index=True)
+
+        # appended to the existing file, in the given order, row group by row group.
+        assert merge_bed_parts(str(self._stitched(tmp_path)), parts) == 6
+        out = pd.read_parquet(self._stitched(tmp_path))
+        assert out["control_id"].tolist() == ["C1"] + ["C2"] * 2 + ["C3"] * 3
+        assert [rg.num_rows for rg in ParquetFile(str(self._stitched(tmp_path))).row_groups] == [1, 2, 3]
+        assert out.drop(columns="values").equals(ref.drop(columns="values"))
+        assert [list(v) for v in out["values"]] == [list(v) for v in ref["values"]]
+        assert sorted(os.listdir(tmp_path / "stitched")) == [self._stitched(tmp_path).name]
+
+    def test_merge_bed_parts_first_part_renamed(self, tmp_path):
+        with BedParquetWriter(str(tmp_path), part=1) as writer:
+            writer.write_dataframe(self._beds_df(2, ["BED01"]))
+        assert merge_bed_parts(str(self._stitched(tmp_path)), [str(self._stitched(tmp_path, part=1))]) == 2
+        assert sorted(os.listdir(tmp_path / "stitched")) == [self._stitched(tmp_path).name]
+
+    def test_merge_bed_parts_different_schema(self, tmp_path):
+        with BedParquetWriter(str(tmp_path)) as writer:
+            writer.write_dataframe(self._beds_df(1, ["BED01"]))
+        with BedParquetWriter(str(tmp_path), part=1) as writer:
+            writer.write_dataframe(self._beds_df(1, ["BED01"]).drop(columns="UoM"))
+        with pytest.raises(ValueError):
+            merge_bed_parts(str(self._stitched(tmp_path)), [str(self._stitched(tmp_path, part=1))])
+        assert len(pd.read_parquet(self._stitched(tmp_path))) == 1
+
+
+# ---------------------------------------------------------------------------
+# values layouts — list vs blob
+# ---------------------------------------------------------------------------
+
+class TestValuesBlob:
+    def test_pack_dtypes(self):
+        assert pack_values([1, -2, 3])[1] == "<i2"
+        assert pack_values([1, 70000])[1] == "<i4"
+        assert pack_values(np.array([1.5, 2.5], dtype=np.float32))[1] == "<f4"
+        assert pack_values([1.25, 2.0])[1] == "<f8"
+        assert pack_values(["a", "b"])[1] == "json"
+        assert pack_values(7)[1] == "<i2"
+
+    def test_unpack_is_view_of_blob(self):
+        blob, dtype = pack_values([100, -200, 300])
+        arr = unpack_values(blob, dtype)
+        assert arr.tolist() == [100, -200, 300]
+        assert not arr.flags.owndata and not arr.flags.writeable
+        assert unpack_values(*pack_values(["a", 1])) == ["a", 1]
+
+    def test_same_values_as_list_layout(self, tmp_path):
+        df = _make_df(4)
+        df["values"] = [[1, 2, 3], np.array([0.5, -1.5]), ["N", "A"], []]
+        for layout in ("list", "blob"):
+            with BedParquetWriter(str(tmp_path / layout), values_layout=layout) as writer:
+                writer.write_dataframe(df)
+        fn = bed_parquet_name("EUHM", "MICU", "BED01")
+        lists = pd.read_parquet(tmp_path / "list" / "stitched" / fn)
+        blobs = pd.read_parquet(tmp_path / "blob" / "stitched" / fn)
+        assert "values" not in blobs.columns
+        assert blobs["values_dtype"].tolist() == ["<i2", "<f8", "json", "<f8"]
+        assert lists.drop(columns="values").equals(blobs.drop(columns=["values_blob", "values_dtype"]))
+        assert [list(v) for v in read_row_values(blobs)] == [list(v) for v in read_row_values(lists)]
+
+    def test_flat_values(self, tmp_path):
+        df = _make_df(3)
+        df["values"] = [[1, 2, 3], [4], [5, 6]]
+        with BedParquetWriter(str(tmp_path), values_layout="blob") as writer:
+            writer.write_dataframe(df)
+        flat, offsets = read_flat_values(pd.read_parquet(tmp_path / "stitched" / bed_parquet_name("EUHM", "MICU", "BED01")))
+        assert flat.dtype == np.int16
+        assert flat.tolist() == [1, 2, 3, 4, 5, 6]
+        assert offsets.tolist() == [0, 3, 4, 6]
+
+    def test_invalid_layout(self, tmp_path):
+        with pytest.raises(ValueError):
+            BedParquetWriter(str(tmp_path), values_layout="columns")
+
+
+# ---------------------------------------------------------------------------
+# finalize_parquet — compaction of the stitched files
+# ---------------------------------------------------------------------------
+
+class TestFinalizeParquet:
+    def _append(self, tmp_path, bed, minutes, control_id, file="part-0001.hl7", part=0):
+        df = _make_df(2).assign(bed_id=bed, control_id=control_id, file=file)
+        df["start_t"] = df["start_t"] + pd.Timedelta(minutes=minutes)
+        write_hl7data_parquet(str(tmp_path / "stitched"), bed_parquet_name("EUHM", "MICU", bed, part), df)
+
+    def test_sorted_deduplicated_and_compacted(self, tmp_path):
+        for minutes, control_id, file in [(2, "C2", "part-0001.hl7"), (0, "C0", "part-0001.hl7"), (1, "C1", "part-0001.hl7"),
+                                          (0, "C0", "part-0001.hl7"), (2, "C2", "part-0002.hl7")]:
+            self._append(tmp_path, "BED01", minutes, control_id, file)
+        fn = str(self._stitched(tmp_path, "BED01"))
+        before = pd.read_parquet(fn)
+        assert len(ParquetFile(fn).row_groups) == 5
+
+        assert finalize_parquet(str(tmp_path), workers=1) == {"BED_EUHM-MICU-BED01.parquet": 8}
+        after = pd.read_parquet(fn)
+        assert len(ParquetFile(fn).row_groups) == 1
+        assert (after.dtypes == before.dtypes).all()
+        assert after["control_id"].tolist() == ["C0", "C0", "C1", "C1", "C2", "C2", "C2", "C2"]
+        assert after["start_t"].is_monotonic_increasing
+        # the row key is that of the loaders:  rows read from different files are different rows.
+        assert after["file"].tolist()[-4:] == ["part-0001.hl7"] * 2 + ["part-0002.hl7"] * 2
+        assert load_bed_parquets2([fn])[("EUHM", "MICU", "BED01")].reset_index(drop=True).equals(after)
+        assert not any(f.endswith(".tmp") for f in os.listdir(tmp_path / "stitched"))
+
+    def test_row_group_size(self, tmp_path):
+        for minutes in range(4):
+            self._append(tmp_path, "BED01", minutes, f"C{minutes}")
+        finalize_parquet(str(tmp_path), workers=1, row_group_size=3)
+        assert [rg.num_rows for rg in ParquetFile(str(self._stitched(tmp_path, "BED01"))).row_groups] == [3, 3, 2]
+
+    def test_parallel_files(self, tmp_path):
+        for bed in ["BED01", "BED02", "BED03"]:
+            for minutes in (1, 0, 1):
+                self._append(tmp_path, bed, minutes, f"C{minutes}")
+        counts = finalize_parquet(str(tmp_path), workers=2)
+        assert counts == {bed_parquet_name("EUHM", "MICU", bed): 4 for bed in ["BED01", "BED02", "BED03"]}
+        for bed in ["BED01", "BED02", "BED03"]:
+            assert pd.read_parquet(self._stitched(tmp_path, bed))["control_id"].tolist() == ["C0", "C0", "C1", "C1"]
+
+    def test_missing_directory(self, tmp_path):
+        assert finalize_parquet(str(tmp_path)) == {}
+
+    def test_parts_merged_per_bed(self, tmp_path):
+        self._append(tmp_path, "BED01", 1, "C1")
+        self._append(tmp_path, "BED01", 0, "C0", part=2)
+        self._append(tmp_path, "BED01", 1, "C1", part=2)
+        self._append(tmp_path, "BED01", 2, "C2", part=10)
+        self._append(tmp_path, "BED01", 0, "C0", "part-0002.hl7", part=10)
+        self._append(tmp_path, "BED02", 0, "C0", part=1)
+        write_hl7data_parquet(str(tmp_path / "stitched"), "2023-06-15--12-3.parquet", _make_df(2))
+        write_hl7data_parquet(str(tmp_path / "stitched"), "2023-06-15--12-3.parquet", _make_df(2))
+
+        counts = finalize_parquet(str(tmp_path), workers=2)
+        assert counts == {"2023-06-15--12-3.parquet": 2, "BED_EUHM-MICU-BED01.parquet": 8, "BED_EUHM-MICU-BED02.parquet": 2}
+        assert sorted(os.listdir(tmp_path / "stitched")) == sorted(counts)
+        # duplicates across the parts are dropped, and the parts are in numeric order.
+        after = pd.read_parquet(self._stitched(tmp_path, "BED01"))
+        assert after["control_id"].tolist() == ["C0"] * 4 + ["C1", "C1", "C2", "C2"]
+        assert after["file"].tolist()[:4] == ["part-0001.hl7"] * 2 + ["part-0002.hl7"] * 2
+        assert len(ParquetFile(str(self._stitched(tmp_path, "BED01"))).row_groups) == 1
+
+    def _stitched(self, tmp_path, bed):
+        return tmp_path / "stitched" / bed_parquet_name("EUHM", "MICU", bed)
+
+
+# ---------------------------------------------------------------------------
+# convert_directory — parallel per-bed conversion
+# ---------------------------------------------------------------------------
+
+class TestConvertDirectory:
+    def _write_part(self, part_dir, n, msg, beds):
+        os.makedirs(part_dir, exist_ok=True)
+        msgs = [msg.replace("T434", bed).replace("CTRL001", f"CTRL{n}{i}") for i, bed in enumerate(beds)]
+        with open(os.path.join(part_dir, f"part-{n:04d}.hl7"), "w") as f:
+            f.write("\n".join(msgs))
+
+    def _convert(self, tmp_path, hl7_dir, name, **kwargs):
+        out_dir = str(tmp_path / name)
+        counts = convert_directory(hl7_dir, str(tmp_path / f"{name}-hist.parquet"), str(tmp_path / f"{name}-cur.parquet"),
+                                   out_dir=out_dir, **kwargs)
+        return counts, sorted(os.listdir(os.path.join(out_dir, "stitched")))
+
+    # rows of each bed file, in file order.
+    def _bed_rows(self, tmp_path, name):
+        stitched = tmp_path / name / "stitched"
+        return {fname: pd.read_parquet(stitched / fname)[["bed_id", "control_id", "channel", "start_t", "pid", "visit_id"]]
+                for fname in os.listdir(stitched)}
+
+    def test_flat_directory_split_into_runs(self, tmp_path, oru_waveform_msg):
+        hl7_dir = str(tmp_path / "2023-06-15--12")
+        for n in range(1, 5):
+            self._write_part(hl7_dir, n, oru_waveform_msg, ["T434", "T435"])
+        counts, files = self._convert(tmp_path, hl7_dir, "serial", workers=1)
+        assert counts == {("all_beds", 0): 8}
+        assert files == ["BED_EUH-EUH_4T_NORTH_ICU-T434_01.parquet", "BED_EUH-EUH_4T_NORTH_ICU-T435_01.parquet"]
+
+        counts, files = self._convert(tmp_path, hl7_dir, "parallel", workers=2, chunk_size=1)
+        assert counts == {("all_beds", 1): 4, ("all_beds", 2): 4}
+        # the parts of the runs are merged into 1 file per bed.
+        assert files == ["BED_EUH-EUH_4T_NORTH_ICU-T434_01.parquet", "BED_EUH-EUH_4T_NORTH_ICU-T435_01.parquet"]
+        serial, parallel = self._bed_rows(tmp_path, "serial"), self._bed_rows(tmp_path, "parallel")
+        assert serial.keys() == parallel.keys()
+        for bed in serial:
+            assert parallel[bed].equals(serial[bed])
+        self._assert_same_patients(tmp_path, "serial", "parallel")
+
+    def _assert_same_patients(self, tmp_path, name1, name2):
+        # the history files hold appended row groups, so compare their compacted views.
+        store1 = PatientHistoryStore(str(tmp_path / f"{name1}-hist.parquet"), str(tmp_path / f"{name1}-cur.parquet"))
+        store2 = PatientHistoryStore(str(tmp_path / f"{name2}-hist.parquet"), str(tmp_path / f"{name2}-cur.parquet"))
+        assert store2.read_history().equals(store1.read_history())
+        assert store2.current.equals(store1.current)
+
+    # a patient change in an earlier run of a flat folder is seen by the later runs:  the previous patient is closed
+    # at the start of the next patient, as when the files are converted serially.
+    def test_runs_continue_patients(self, tmp_path, oru_waveform_msg):
+        def _msg(pid, minutes, ctrl):
+            # 12:00 -> 12:{minutes}
+            return oru_waveform_msg.replace("PAT001", pid).replace("CTRL001", ctrl).replace("20230615120", f"2023061512{minutes // 10}")
+        hl7_dir = tmp_path / "2023-06-15--12"
+        os.makedirs(hl7_dir)
+        (hl7_dir / "part-0001.hl7").write_text("\n".join([_msg("PAT002", 0, "CTRL1"), _msg("PAT002", 10, "CTRL2")]))
+        (hl7_dir / "part-0002.hl7").write_text("\n".join([_msg("PAT001", 30, "CTRL3"), _msg("PAT001", 40, "CTRL4")]))
+
+        self._convert(tmp_path, str(hl7_dir), "serial", workers=1)
+        counts, _ = self._convert(tmp_path, str(hl7_dir), "parallel", workers=2)
+        assert sorted(counts) == [("all_beds", 1), ("all_beds", 2)]
+        self._assert_same_patients(tmp_path, "serial", "parallel")
+        history = PatientHistoryStore(str(tmp_path / "parallel-hist.parquet"), str(tmp_path / "parallel-cur.parquet")).read_history()
+        assert history[history["pid"] == "PAT002"]["end_t"].tolist() == [pd.Timestamp("2023-06-15T16:30:00").value]
+        serial, parallel = self._bed_rows(tmp_path, "serial"), self._bed_rows(tmp_path, "parallel")
+        for bed in serial:
+            assert parallel[bed].equals(serial[bed])
+
+    def test_bed_directories(self, tmp_path, oru_waveform_msg, adt_msg):
+        hl7_dir = str(tmp_path / "hl7")
+        for bed in ["T434", "T435"]:
+            for n in range(1, 3):
+                self._write_part(os.path.join(hl7_dir, "EUH", "4TN", bed, "2023", "06", "15", "12"), n, oru_waveform_msg, [bed] * 2)
+        counts, files = self._convert(tmp_path, hl7_dir, "parallel", workers=2)
+        assert counts == {("EUH_4TN_T434", 1): 4, ("EUH_4TN_T435", 2): 4}
+        assert files == ["BED_EUH-EUH_4T_NORTH_ICU-T434_01.parquet", "BED_EUH-EUH_4T_NORTH_ICU-T435_01.parquet"]
+        current = pd.read_parquet(tmp_path / "parallel-cur.parquet")
+        assert sorted(current["bed_id"]) == ["T434-01", "T435-01"]
+        assert sorted(os.listdir(tmp_path / "parallel")) == ["stitched"]
+
+    # each file is read for its patient info once, by the task that converts it.
+    def test_files_scanned_once(self, tmp_path, oru_waveform_msg, monkeypatch):
+        import io_utils.parquet_io as parquet_io
+        hl7_dir = str(tmp_path / "2023-06-15--12")
+        for n in range(1, 5):
+            self._write_part(hl7_dir, n, oru_waveform_msg, ["T434", "T435"])
+        scanned = []
+        scan_hl7_file = parquet_io.scan_hl7_file
+        monkeypatch.setattr(parquet_io, "scan_hl7_file", lambda fn, **kwargs: scanned.append(os.path.basename(fn)) or scan_hl7_file(fn, **kwargs))
+        # more tasks than workers, so the runs are converted one after another in this process.
+        monkeypatch.setattr(parquet_io, "_plan_directory_tasks", lambda hl7_files, workers: _plan_directory_tasks(hl7_files, 3))
+        counts, _ = self._convert(tmp_path, hl7_dir, "runs", workers=1)
+        assert sorted(counts) == [("all_beds", 1), ("all_beds", 2), ("all_beds", 3)]
+        assert sorted(scanned) == [f"part-{n:04d}.hl7" for n in range(1, 5)]
+
+    def test_plan_keeps_beds_whole(self, tmp_path, oru_waveform_msg):
+        self._write_part(str(tmp_path / "a"), 1, oru_waveform_msg, ["T434"] * 3)
+        self._write_part(str(tmp_path / "b"), 1, oru_waveform_msg, ["T434"])
+        self._write_part(str(tmp_path / "b"), 2, oru_waveform_msg, ["T434"])
+        hl7_files = {"BED_A": [str(tmp_path / "a" / "part-0001.hl7")],
+                     "BED_B": [str(tmp_path / "b" / "part-0001.hl7"), str(tmp_path / "b" / "part-0002.hl7")]}
+        tasks = _plan_directory_tasks(hl7_files, 4)
+        assert [(bed_id, part, len(files)) for (bed_id, part, files) in tasks] == [("BED_A", 1, 1), ("BED_B", 2, 2)]
+        assert _plan_directory_tasks({"BED_B": hl7_files["BED_B"]}, 4) == [("BED_B", 0, hl7_files["BED_B"])]
+
+    # keys of different directory layouts can hold the same bed, which is 1 output file name:  each task writes its own part,
+    # and the parts are merged in part order.
+    def test_same_bed_in_different_keys(self, tmp_path, oru_waveform_msg):
+        hl7_dir = str(tmp_path / "hl7")
+        self._write_part(os.path.join(hl7_dir, "T434", "2023", "06", "15", "12"), 1, oru_waveform_msg, ["T434"] * 2)
+        self._write_part(os.path.join(hl7_dir, "EUH", "4TN", "T434", "2023", "06", "15", "12"), 1, oru_waveform_msg, ["T434"] * 3)
+        self._write_part(hl7_dir, 1, oru_waveform_msg, ["T434"])
+        counts, files = self._convert(tmp_path, hl7_dir, "parallel", workers=3)
+        assert sorted(counts.values()) == [1, 2, 3]
+        assert files == ["BED_EUH-EUH_4T_NORTH_ICU-T434_01.parquet"]
+        rows = pd.read_parquet(tmp_path / "parallel" / "stitched" / files[0])
+        assert len(rows) == 6
+        # 1 row group per part, in part order.
+        parts = {part: nrows for (_, part), nrows in counts.items()}
+        pf = ParquetFile(str(tmp_path / "parallel" / "stitched" / files[0]))
+        assert [rg.num_rows for rg in pf.row_groups] == [parts[1], parts[2], parts[3]]
+
+    def test_blob_layout(self, tmp_path, oru_waveform_msg):
+        hl7_dir = str(tmp_path / "2023-06-15--12")
+        self._write_part(hl7_dir, 1, oru_waveform_msg, ["T434"])
+        self._convert(tmp_path, hl7_dir, "list", workers=1, obx_values_as_array=True)
+        self._convert(tmp_path, hl7_dir, "blob", workers=1, obx_values_as_array=True, values_layout="blob")
+        fn = "BED_EUH-EUH_4T_NORTH_ICU-T434_01.parquet"
+        lists = pd.read_parquet(tmp_path / "list" / "stitched" / fn)
+        blobs = pd.read_parquet(tmp_path / "blob" / "stitched" / fn)
+        assert [list(v) for v in read_row_values(blobs)] == [list(v) for v in read_row_values(lists)]
+
+    def test_invalid_workers(self, tmp_path):
+        with pytest.raises(ValueError):
+            convert_directory(str(tmp_path), str(tmp_path / "h.parquet"), str(tmp_path / "c.parquet"), workers=0)
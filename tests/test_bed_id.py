@@ -5,7 +5,7 @@ import sys
 import pandas as pd
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-from hl7lite.hl7_extractor_common import extract_bed_id, _bed_id_to_wildcard, _canonical_hospitals, _canonical_units
+from hl7lite.hl7_extractor_common import extract_bed_id, _canonical_hospitals, _canonical_units
 
 #%%
 # generated by extracting PV1.3 from hl7 messages.
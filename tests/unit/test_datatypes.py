@@ -5,7 +5,10 @@ import pandas as pd
 from hl7lite.hl7_datatypes import (
     DataType,
     convert_field,
+    compile_field_converter,
+    convert_numeric_payload,
     parse_time_python,
+    parse_time,
     fix_time,
     missing_values,
 )
@@ -119,6 +122,10 @@ class TestConvertFieldScalar:
     def test_list_of_float_wraps_single(self):
         assert convert_field("2.5", DataType.LIST_OF_FLOAT, as_string=False) == [2.5]
 
+    def test_datetime_corrects_offset(self):
+        result = convert_field("20230615120000-0359", DataType.DATETIME, as_string=False)
+        assert result == np.datetime64("2023-06-15T16:00:00", "ns")
+
 
 # ---------------------------------------------------------------------------
 # convert_field — missing values for empty string
@@ -186,6 +193,7 @@ class TestConvertFieldAsString:
         # fix_time should be applied when as_string=True, DataType.DATETIME
         result = convert_field("20230615120000-0359", DataType.DATETIME, as_string=True)
         assert result == "20230615120000-0400"
+        assert parse_time(result) == parse_time("20230615120000-0359")
 
     def test_list_passthrough_for_list_type(self):
         data = ["x", "y"]
@@ -196,6 +204,32 @@ class TestConvertFieldAsString:
             convert_field(None, DataType.STR, as_string=False)
 
 
+class TestCompiledConverter:
+    @pytest.mark.parametrize("datatype", [DataType.STR, DataType.STR_OR_LIST, DataType.NUMERIC, DataType.INT, DataType.FLOAT,
+                                          DataType.LIST_OF_STR, DataType.LIST_OF_INT, DataType.LIST_OF_FLOAT, DataType.LIST_OF_NUMERIC])
+    @pytest.mark.parametrize("as_string", [True, False])
+    def test_same_as_convert_field(self, datatype, as_string):
+        convert = compile_field_converter(datatype, as_string=as_string)
+        for data in ["", "12", "1.5", ["1", "2"], ["1.5", "2"]]:
+            try:
+                expected = convert_field(data, datatype, as_string=as_string)
+            except ValueError:
+                with pytest.raises(ValueError):
+                    convert(data)
+                continue
+            # repr, so missing nan compares equal
+            assert repr(convert(data)) == repr(expected)
+
+    def test_converted_data_passes_through_as_string(self):
+        assert compile_field_converter(DataType.ANY, as_string=True)([1.0, 2.0]) is None
+        with pytest.raises(ValueError):
+            compile_field_converter(DataType.ANY, as_string=False)([1.0, 2.0])
+
+    def test_unsupported_datatype_raises(self):
+        with pytest.raises(ValueError):
+            compile_field_converter(("bogus", str, str), as_string=False)
+
+
 # ---------------------------------------------------------------------------
 # missing_values table sanity
 # ---------------------------------------------------------------------------
@@ -215,3 +249,45 @@ class TestMissingValues:
 
     def test_list_missing_is_empty_list(self):
         assert missing_values[list] == []
+
+
+# ---------------------------------------------------------------------------
+# convert_numeric_payload — NA/NR payload straight to a numpy array
+# ---------------------------------------------------------------------------
+
+class TestConvertNumericPayload:
+    @pytest.mark.parametrize("payload", ["1^2^-3", "1.5^-2^3", "7", "0.25"])
+    def test_same_values_as_convert_field(self, payload):
+        expected = convert_field(payload.split("^"), DataType.LIST_OF_NUMERIC, as_string=False)
+        out = convert_numeric_payload(payload)
+        assert isinstance(out, np.ndarray)
+        assert out.tolist() == expected
+
+    def test_bytes_payload(self):
+        assert convert_numeric_payload(b"1^2^3").tolist() == [1, 2, 3]
+
+    @pytest.mark.parametrize("payload,dtype", [
+        ("1^-2", np.int16),
+        ("1^40000", np.int32),
+        ("1^3000000000", np.int64),
+        ("1.5^2", np.float64),
+    ])
+    def test_dtype_chosen_by_content(self, payload, dtype):
+        assert convert_numeric_payload(payload).dtype == dtype
+
+    def test_float32_on_request(self):
+        out = convert_numeric_payload("1.25^-2.5", float_dtype=np.float32)
+        assert out.dtype == np.float32
+        assert out.tolist() == [1.25, -2.5]
+
+    @pytest.mark.parametrize("payload", ["1^^3", "1^2x", "a^b"])
+    def test_non_numeric_raises(self, payload):
+        with pytest.raises(ValueError):
+            convert_numeric_payload(payload)
+
+    @pytest.mark.parametrize("payload", ["99999999999999999999^1", "1^-99999999999999999999", "9223372036854775807"])
+    def test_int64_overflow_raises(self, payload):
+        # np.fromstring saturates instead of failing, so the int() list path has to be used.
+        with pytest.raises(ValueError):
+            convert_numeric_payload(payload)
+
@@ -0,0 +1,168 @@
+"""Unit tests for hl7_extractor_common: extract_bed_id caching and mapping reload."""
+import json
+import re
+import pytest
+import numpy as np
+from hl7lite.hl7_extractor_common import (
+    extract_bed_id,
+    bed_id_cache_info,
+    reload_bed_location_mappings,
+    lookup_units_from_beds,
+    _lookup_unit_from_bed,
+    _bed_wildcard_to_unit,
+    _canonical_hospitals,
+)
+
+
+# ---------------------------------------------------------------------------
+# extract_bed_id cache
+# ---------------------------------------------------------------------------
+
+class TestExtractBedIdCache:
+    def setup_method(self):
+        reload_bed_location_mappings()
+
+    def teardown_method(self):
+        reload_bed_location_mappings()
+
+    def test_repeated_lookup_hits_cache(self):
+        first = extract_bed_id(["EUHM", "4107-06"])
+        assert bed_id_cache_info().misses == 1
+        assert extract_bed_id(["EUHM", "4107-06"]) == first
+        assert bed_id_cache_info().hits == 1
+
+    def test_string_and_list_forms_cached_separately(self):
+        assert extract_bed_id("EUH-4TN-T434") == extract_bed_id(["EUH-4TN-T434"])
+        assert bed_id_cache_info().currsize == 2
+
+    def test_errors_not_cached(self):
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                extract_bed_id([""])
+        assert bed_id_cache_info().currsize == 0
+
+    def test_unhashable_components_bypass_cache(self):
+        plain = ["ICU", "", "ICU 7", "Emory Johns Creek Hospital"]
+        nested = ["ICU", ["A", "B"], "ICU 7", "Emory Johns Creek Hospital"]
+        assert extract_bed_id(nested) == extract_bed_id(plain)
+        assert bed_id_cache_info().currsize == 1
+
+    def test_reload_clears_cache_and_updates_in_place(self, tmp_path):
+        extract_bed_id("EUH-4TN-T434")
+        assert bed_id_cache_info().currsize == 1
+
+        from importlib.resources import files
+        mappings = json.loads(files("emory").joinpath("bed_location_mappings.json").read_text())
+        mappings["unit_to_canonical"]["4TN"] = ["TESTHOSP", "TEST UNIT"]
+        f = tmp_path / "mappings.json"
+        f.write_text(json.dumps(mappings))
+
+        reload_bed_location_mappings(str(f))
+        assert bed_id_cache_info().currsize == 0
+        assert "TESTHOSP" in _canonical_hospitals   # same set object as the module's
+        assert extract_bed_id("EUH-4TN-T434") == ("TESTHOSP", "TEST UNIT", "T434-01")
+
+
+# ---------------------------------------------------------------------------
+# _lookup_unit_from_bed — compiled wildcard index
+# ---------------------------------------------------------------------------
+
+# the regex rules that the compiled index replaced, as the reference for the parity test.
+_sub_re = re.compile(r'\d{1,2}$')
+_nicu_letter_re = re.compile(r'\d[A-Za-z]$')
+_nicu_suffix_re = re.compile(r'\d{2}$')
+_euh_re = re.compile(r'^([A-Za-z]\d)\d{2}(-01)?$')
+_edh_re = re.compile(r'^([A-Za-z]+)\d{2}(-?)01$')
+
+
+def _reference_unit(bed_id):
+    if bed_id[:2] in ['ER', 'PA']:
+        match = _edh_re.match(bed_id)
+        if not match:
+            return ""   # raised ValueError
+        wildcard = match.group(1) + '??' + (match.group(2) or '') + '01'
+    elif (len(bed_id) >= 4) and bed_id[0].isalpha() and bed_id[1].isdigit():
+        match = _euh_re.match(bed_id)
+        if not match:
+            return ""   # raised ValueError
+        wildcard = match.group(1) + '??' + (match.group(2) or '')
+    elif bed_id.startswith('EMS'):
+        wildcard = 'EMS?'
+    elif bed_id.startswith('NICU') and (bed_id[-1] in ['A', 'B']):
+        wildcard = _nicu_letter_re.sub('??', bed_id)
+    elif bed_id.startswith('NICU') and (bed_id[-3:] in ['-01', '-02']):
+        wildcard = _nicu_suffix_re.sub('??', bed_id)
+    else:
+        wildcard = _sub_re.sub('??', bed_id)
+    return _bed_wildcard_to_unit.get(wildcard, "")
+
+
+# bed ids for a wildcard:  the '?'s as digits, a single trailing room digit, a room letter, and a suffix after the wildcard.
+def _bed_ids_for(wildcard):
+    ids = [wildcard.replace('?', d) for d in '019']
+    if wildcard.endswith('??'):
+        ids += [wildcard[:-1].replace('?', '3'), wildcard[:-1].replace('?', '3') + 'A', wildcard[:-2].replace('?', '3') + '1B']
+    return ids + [ids[0] + '-01', ids[0] + 'H']
+
+
+class TestWildcardIndex:
+    def test_same_as_regex_rules(self):
+        for wildcard in list(_bed_wildcard_to_unit):
+            for bed_id in _bed_ids_for(wildcard):
+                # NICU??-01/02 never matched under the regex rules (NICU21-01 became NICU21-??), and now match
+                if re.fullmatch(r'NICU\d\d-0[12]', bed_id):
+                    assert _lookup_unit_from_bed(bed_id) == _bed_wildcard_to_unit["NICU??" + bed_id[-3:]]
+                    continue
+                assert _lookup_unit_from_bed(bed_id) == _reference_unit(bed_id), (wildcard, bed_id)
+
+    def test_nicu_room_letter(self):
+        assert _lookup_unit_from_bed("NICU210A") == "EDH_NICU"
+        assert _lookup_unit_from_bed("NICU4A") == "EJCH_NICU"
+        assert _lookup_unit_from_bed("NICU4C") == ""
+
+    def test_ems_prefix(self):
+        for bed_id in ["EMS", "EMS1", "EMSH", "EMS1-01", "EMSH-01"]:
+            assert _lookup_unit_from_bed(bed_id) == "EDH_ER"
+
+
+    @pytest.mark.parametrize("bed_id", [
+        "T434", "T434-01", "B471-01", "4107-06", "PICU L110", "EUH ED 21", "ICU 17", "ER1201", "PA12-01",
+        "NICU2101", "NICU4133", "EDH12", "ED 12", "ED12", "CV21", "250012", "EMS1", "EMSH", "NICUSR", "WH-TEST",
+    ])
+    def test_matches_wildcard_rules(self, bed_id):
+        expected = _reference_unit(bed_id)
+        assert _lookup_unit_from_bed(bed_id) == expected
+
+    def test_single_trailing_digit(self):
+        # room numbers vary by 2 digits, even if only 1 is presented
+        assert _lookup_unit_from_bed("ICU 7") == _bed_wildcard_to_unit["ICU ??"]
+        assert _lookup_unit_from_bed("ED 7") == _bed_wildcard_to_unit["ED ??"]
+        assert _lookup_unit_from_bed("EDH2") == _bed_wildcard_to_unit["EDH??"]
+
+    def test_wildcards_match_digits_only(self):
+        assert _lookup_unit_from_bed("T4AB") == ""
+        assert _lookup_unit_from_bed("T4AB", None) is None
+
+    def test_wildcard_with_suffix(self):
+        assert _lookup_unit_from_bed("NICU21-01") == _bed_wildcard_to_unit["NICU??-01"]
+
+    def test_no_match_does_not_raise(self):
+        assert _lookup_unit_from_bed("ERXX01") == ""
+
+    def test_new_entries_work_without_code_changes(self, tmp_path):
+        from importlib.resources import files
+        mappings = json.loads(files("emory").joinpath("bed_location_mappings.json").read_text())
+        mappings["bed_wildcard_to_unit"]["ZZ??-??X"] = "ZZUNIT"
+        f = tmp_path / "mappings.json"
+        f.write_text(json.dumps(mappings))
+        try:
+            reload_bed_location_mappings(str(f))
+            assert _lookup_unit_from_bed("ZZ12-34X") == "ZZUNIT"
+        finally:
+            reload_bed_location_mappings()
+        assert _lookup_unit_from_bed("ZZ12-34X") == ""
+
+    def test_batch_lookup(self):
+        beds = ["T434", "4107-06", "T434", "nope"]
+        assert lookup_units_from_beds(beds) == [_lookup_unit_from_bed(b) for b in beds]
+        assert lookup_units_from_beds(np.array(beds, dtype=object), None)[-1] is None
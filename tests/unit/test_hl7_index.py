@@ -0,0 +1,130 @@
+"""Unit tests for hl7_index: memory mapped message index and sidecar."""
+import os
+import pytest
+import numpy as np
+from hl7lite.hl7_index import (
+    map_hl7_file,
+    build_message_index,
+    load_message_index,
+    save_message_index,
+    index_sidecar_path,
+    read_message,
+    split_message_index,
+    split_sizes,
+    INDEX_DTYPE,
+)
+from hl7lite.hl7_tokenizer import find_message_bounds
+from hl7lite.hl7_ds import MESSAGE_KINDS
+from hl7lite.parse_time_tz import c_parse_time, NAT
+
+
+def _write(tmp_path, *msgs, sep="\r\n\r\n"):
+    f = tmp_path / "part-0001.hl7"
+    f.write_bytes(sep.join(msgs).encode())
+    return str(f)
+
+
+# ---------------------------------------------------------------------------
+# build_message_index
+# ---------------------------------------------------------------------------
+
+class TestBuildMessageIndex:
+    def test_bounds_kinds_and_times(self, tmp_path, oru_waveform_msg, adt_msg):
+        fn = _write(tmp_path, adt_msg, oru_waveform_msg, adt_msg)
+        content = open(fn, "rb").read()
+        mapped = map_hl7_file(fn)
+        index = build_message_index(mapped)
+        assert index.dtype == INDEX_DTYPE
+        assert list(zip(index["start"].tolist(), (index["start"] + index["length"]).tolist())) == find_message_bounds(content)
+        assert [MESSAGE_KINDS[k] for k in index["kind"]] == ["ADT", "Waveform", "ADT"]
+        assert index["msh_time"][1] == c_parse_time("20230615120000-0400", as_epoch_ns=True)
+        assert read_message(mapped, index, 1) == oru_waveform_msg.rstrip("\n").encode()
+        assert np.array_equal(build_message_index(content), index)
+        mapped.close()
+
+    def test_bad_messages(self, tmp_path, adt_msg):
+        fn = _write(tmp_path, adt_msg.replace("20230615090000-0400||ADT", "2023||ADT"), "PID|1|PAT001")
+        index = build_message_index(open(fn, "rb").read())
+        assert index["msh_time"].tolist() == [NAT, NAT]
+        assert MESSAGE_KINDS[index["kind"][1]] == "Other"
+
+    def test_messages_not_copied(self, tmp_path, oru_waveform_msg, adt_msg):
+        # the kind and MSH.7 are read in place, so no slice is as long as the waveform payload.
+        class _Content(bytes):
+            longest = 0
+
+            def __getitem__(self, key):
+                out = bytes.__getitem__(self, key)
+                if isinstance(key, slice):
+                    _Content.longest = max(_Content.longest, len(out))
+                return out
+
+        payload = "^".join(["100"] * 2000)
+        fn = _write(tmp_path, adt_msg, oru_waveform_msg.replace("NM|MDC_ECG_LEAD_I", "NA|MDC_ECG_LEAD_I").replace("||100|", f"||{payload}|"))
+        content = open(fn, "rb").read()
+        index = build_message_index(_Content(content))
+        assert np.array_equal(index, build_message_index(content))
+        assert [MESSAGE_KINDS[k] for k in index["kind"]] == ["ADT", "Waveform"]
+        assert 0 < _Content.longest < 200
+
+    def test_empty_file(self, tmp_path):
+        fn = _write(tmp_path)
+        assert len(load_message_index(fn)) == 0
+
+
+# ---------------------------------------------------------------------------
+# sidecar
+# ---------------------------------------------------------------------------
+
+class TestSidecar:
+    def test_saved_and_reused(self, tmp_path, oru_waveform_msg, adt_msg, monkeypatch):
+        import hl7lite.hl7_index as hl7_index
+        fn = _write(tmp_path, adt_msg, oru_waveform_msg)
+        index = load_message_index(fn, save=True)
+        assert os.path.exists(index_sidecar_path(fn))
+        monkeypatch.setattr(hl7_index, "build_message_index", lambda content: pytest.fail("index rebuilt"))
+        assert np.array_equal(load_message_index(fn), index)
+
+    def test_stale_sidecar_rebuilt(self, tmp_path, oru_waveform_msg, adt_msg):
+        fn = _write(tmp_path, adt_msg)
+        save_message_index(fn, load_message_index(fn))
+        _write(tmp_path, adt_msg, oru_waveform_msg)
+        assert len(load_message_index(fn)) == 2
+
+    def test_unreadable_sidecar_ignored(self, tmp_path, adt_msg):
+        fn = _write(tmp_path, adt_msg)
+        with open(index_sidecar_path(fn), "wb") as f:
+            f.write(b"not an npz")
+        assert len(load_message_index(fn)) == 1
+
+
+# ---------------------------------------------------------------------------
+# split_message_index
+# ---------------------------------------------------------------------------
+
+class TestSplitMessageIndex:
+    def _index(self, lengths):
+        index = np.zeros(len(lengths), dtype=INDEX_DTYPE)
+        index["length"] = lengths
+        index["start"] = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        return index
+
+    def test_balanced_by_bytes(self):
+        ranges = split_message_index(self._index([100] * 8 + [400, 400]), 2)
+        assert ranges == [(0, 8), (8, 10)]   # 800 bytes each
+
+    def test_covers_all_rows(self):
+        index = self._index(np.arange(1, 101))
+        for nparts in (1, 3, 7, 100, 500):
+            ranges = split_message_index(index, nparts)
+            assert ranges[0][0] == 0 and ranges[-1][1] == 100
+            assert all(a[1] == b[0] for a, b in zip(ranges[:-1], ranges[1:]))
+            assert len(ranges) <= nparts
+
+    def test_large_item_gets_own_part(self):
+        assert split_sizes([10, 10, 1000], 3) == [(0, 2), (2, 3)]
+        assert split_sizes([1000, 10, 10], 2) == [(0, 1), (1, 3)]
+
+    def test_invalid_nparts(self):
+        with pytest.raises(ValueError):
+            split_message_index(self._index([1]), 0)
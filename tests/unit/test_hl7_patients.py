@@ -0,0 +1,69 @@
+"""Unit tests for hl7_patients: append-only patient history store."""
+import pandas as pd
+import pytest
+from hl7lite.hl7_patients import PatientHistoryStore, compact_history
+from hl7lite.hl7_datatypes import missing_values
+
+
+def _rows(*entries):
+    return pd.DataFrame([{"hospital": "EUH", "bed_unit": "4TN", "bed_id": bed, "pid": pid, "visit_id": "V" + pid,
+                          "first_name": "F", "last_name": "L", "middle_initial": "", "start_t": start_t, "end_t": end_t}
+                         for (bed, pid, start_t, end_t) in entries])
+
+
+def _store(tmp_path, **kwargs):
+    return PatientHistoryStore(str(tmp_path / "hist.parquet"), str(tmp_path / "cur.parquet"), **kwargs)
+
+
+# ---------------------------------------------------------------------------
+# compact_history
+# ---------------------------------------------------------------------------
+
+class TestCompactHistory:
+    def test_later_row_wins(self):
+        history = compact_history(pd.concat([_rows(("B1", "A", 20, ""), ("B1", "B", 10, 20)),
+                                             _rows(("B1", "A", 20, 30))], ignore_index=True))
+        assert history[["pid", "start_t", "end_t"]].values.tolist() == [["B", 10, 20], ["A", 20, 30]]
+
+
+# ---------------------------------------------------------------------------
+# PatientHistoryStore
+# ---------------------------------------------------------------------------
+
+class TestPatientHistoryStore:
+    def test_append_and_reload(self, tmp_path):
+        store = _store(tmp_path)
+        assert store.current is None and store.read_history() is None
+        store.append(_rows(("B1", "A", 10, 20), ("B1", "B", 20, "")), _rows(("B1", "B", 20, "")))
+        store.append(_rows(("B1", "B", 20, 40), ("B1", "C", 40, "")), _rows(("B1", "C", 40, "")))
+        assert store.num_row_groups() == 2
+
+        reopened = _store(tmp_path)
+        assert reopened.current[["pid", "end_t"]].values.tolist() == [["C", missing_values[int]]]
+        history = reopened.read_history()
+        assert history[["pid", "start_t", "end_t"]].values.tolist() == [["A", 10, 20], ["B", 20, 40], ["C", 40, missing_values[int]]]
+
+    def test_same_as_full_rewrite(self, tmp_path):
+        store = _store(tmp_path)
+        full = None
+        for k in range(5):
+            rows = _rows(("B1", "A", 10, 20 + k), ("B2", "P" + str(k), 100 + k, ""), ("B1", "B", 20 + k, ""))
+            store.append(rows, rows.iloc[[2]])
+            full = compact_history(pd.concat([full, rows], ignore_index=True))
+            full["end_t"] = [missing_values[int] if t == "" else t for t in full["end_t"]]
+        assert store.read_history().equals(full.astype({"end_t": "int64"}))
+
+    def test_compacts_after_max_row_groups(self, tmp_path):
+        store = _store(tmp_path, max_row_groups=2)
+        for k in range(3):
+            store.append(_rows(("B1", "A", 10, missing_values[int])), _rows(("B1", "A", 10, missing_values[int])))
+        assert store.num_row_groups() == 1
+        assert len(pd.read_parquet(tmp_path / "hist.parquet")) == 1
+
+    def test_incompatible_history_rewritten(self, tmp_path):
+        # e.g. a history written before end_t was stored as int64
+        _rows(("B1", "A", 10, "")).to_parquet(tmp_path / "hist.parquet", engine="fastparquet", index=False)
+        store = _store(tmp_path)
+        store.append(_rows(("B1", "B", 20, missing_values[int])), _rows(("B1", "B", 20, missing_values[int])))
+        assert store.read_history()["pid"].tolist() == ["A", "B"]
+        assert store.num_row_groups() == 1
@@ -0,0 +1,239 @@
+"""Unit tests for the parse_time_tz Cython extension: DST transition table parser."""
+import os
+import pytest
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from hl7lite.parse_time_tz import (
+    TimeParser,
+    c_parse_time,
+    c_parse_time_batch,
+    c_parse_time_array,
+    get_time_parser,
+    NAT,
+    set_timezone,
+    default_tz,
+    time_cache_info,
+)
+from hl7lite.hl7_datatypes import parse_time_python, parse_time, fix_time
+
+
+def _utc(s):
+    return np.datetime64(s, "ns")
+
+
+# ---------------------------------------------------------------------------
+# local time to UTC without libc timezone state
+# ---------------------------------------------------------------------------
+
+class TestLocalTime:
+    def test_explicit_offset(self):
+        assert c_parse_time("20230615120000-0400") == _utc("2023-06-15T16:00:00")
+        assert c_parse_time("20230615120000.25+0530") == _utc("2023-06-15T06:30:00.25")
+
+    @pytest.mark.parametrize("ts", ["20230615120000", "20230115120000", "20230615120000.125", "19700101000000", "20991231235959"])
+    def test_matches_zoneinfo(self, ts):
+        assert c_parse_time(ts, as_epoch_ns=True) == parse_time_python(ts, as_epoch_ns=True)
+
+    @pytest.mark.parametrize("ts,expected", [
+        ("20240310015959", "2024-03-10T06:59:59"),   # last second of EST
+        ("20240310023000", "2024-03-10T07:30:00"),   # nonexistent, same as mktime
+        ("20240310030000", "2024-03-10T07:00:00"),   # first second of EDT
+        ("20241103013000", "2024-11-03T05:30:00"),   # ambiguous, first occurrence
+        ("20241103020000", "2024-11-03T07:00:00"),
+    ])
+    def test_dst_transitions(self, ts, expected):
+        assert c_parse_time(ts) == _utc(expected)
+
+    def test_fraction_truncated_to_ns(self):
+        assert c_parse_time("20230615120000.1234567891234-0400", as_epoch_ns=True) % 1000000000 == 123456789
+
+    @pytest.mark.parametrize("ts", ["20230615120000-0359", "20230615120000-0401", "20230615120000.5-0459", "20230615120000-0501",
+                                    "20230615120000+0530", "20230615120000-0000"])
+    def test_fix_offset_default(self, ts):
+        expected = parse_time_python(fix_time(ts), as_epoch_ns=True)
+        assert c_parse_time(ts, as_epoch_ns=True) == expected
+        assert c_parse_time_batch([ts], as_epoch_ns=True)[0] == expected
+
+    @pytest.mark.parametrize("ts", ["20230615120000+0545", "20230615120000+0559", "20230615120000+0401", "20230615120000-0259",
+                                    "20230615120000-0301", "20230615120000-0559", "20230615120000-0901"])
+    def test_fix_offset_other_offsets(self, ts):
+        # only the offsets fix_time corrects are changed.
+        assert fix_time(ts) == ts
+        assert c_parse_time(ts, as_epoch_ns=True) == c_parse_time(ts, as_epoch_ns=True, fix_offset=False) == parse_time_python(ts, as_epoch_ns=True)
+        assert c_parse_time_array(np.array([ts], dtype="S"), as_epoch_ns=True)[0] == parse_time_python(ts, as_epoch_ns=True)
+
+    def test_fix_offset_off(self):
+        assert c_parse_time("20230615120000-0359", fix_offset=False) == _utc("2023-06-15T15:59:00")
+        assert c_parse_time_batch(["20230615120000-0401"], fix_offset=False)[0] == _utc("2023-06-15T16:01:00")
+
+    def test_process_tz_untouched(self):
+        before = os.environ.get("TZ")
+        set_timezone("America/Chicago")
+        try:
+            assert os.environ.get("TZ") == before
+            assert c_parse_time("20230615120000") == _utc("2023-06-15T17:00:00")
+        finally:
+            set_timezone(default_tz)
+        assert c_parse_time("20230615120000") == _utc("2023-06-15T16:00:00")
+
+    @pytest.mark.parametrize("ts", ["", "2023061512000", "2023061512000x", "20231315120000", "20230615120000.1x"])
+    def test_invalid(self, ts):
+        with pytest.raises(ValueError):
+            c_parse_time(ts)
+
+
+# ---------------------------------------------------------------------------
+# per call and per parser timezones
+# ---------------------------------------------------------------------------
+
+class TestTimezones:
+    def test_per_call_timezone(self):
+        assert c_parse_time("20230615120000", timezone="UTC") == _utc("2023-06-15T12:00:00")
+        assert c_parse_time("20230615120000", timezone="America/Los_Angeles") == _utc("2023-06-15T19:00:00")
+        # explicit offsets ignore the timezone
+        assert c_parse_time("20230615120000-0400", timezone="UTC") == _utc("2023-06-15T16:00:00")
+
+    def test_parser_instances(self):
+        la = TimeParser("America/Los_Angeles")
+        assert la.timezone == "America/Los_Angeles"
+        assert la.parse("20230115120000") == _utc("2023-01-15T20:00:00")
+        assert la.parse_batch(["20230115120000", "20230615120000"], as_epoch_ns=True).tolist() == \
+            c_parse_time_batch(["20230115120000", "20230615120000"], as_epoch_ns=True, timezone="America/Los_Angeles").tolist()
+        assert get_time_parser("America/Los_Angeles") is get_time_parser("America/Los_Angeles")
+
+    def test_unknown_timezone(self):
+        with pytest.raises(Exception):
+            TimeParser("Not/AZone")
+
+    def test_threads(self):
+        strs = [f"2024{m:02d}15120000" for m in range(1, 13)] * 50
+        zones = ["America/New_York", "America/Chicago", "Europe/London", "UTC"]
+        expected = {tz: c_parse_time_batch(strs, True, timezone=tz).tolist() for tz in zones}
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda tz: (tz, c_parse_time_batch(strs, True, timezone=tz).tolist()), zones * 4))
+        for tz, res in results:
+            assert res == expected[tz]
+
+    def test_threads_first_use(self):
+        # new parsers, with the table not cached yet:  the threads build it at the same moment, and parse without the GIL.
+        import threading
+        from hl7lite import parse_time_tz
+        strs = np.array([f"2024{m:02d}15120000" for m in range(1, 13)] * 500, dtype="S")
+        expected = c_parse_time_array(strs, as_epoch_ns=True, timezone="Europe/Berlin").tolist()
+        for _ in range(10):
+            parse_time_tz._tables.pop("Europe/Berlin", None)
+            parser = TimeParser("Europe/Berlin")
+            barrier = threading.Barrier(8)
+
+            def run(_):
+                barrier.wait()
+                return parser.parse_array(strs, as_epoch_ns=True).tolist()
+
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                results = list(pool.map(run, range(8)))
+            assert all(res == expected for res in results)
+
+
+# ---------------------------------------------------------------------------
+# c_parse_time_array — column parser
+# ---------------------------------------------------------------------------
+
+_COLUMN = ["20230615120000-0400", "20230615120000.5-0359", "", "20230615120000", "  ", "20230615120000-0501", "20230615120000-0459"]
+
+
+def _expected(strs):
+    return [NAT if s.strip() == "" else c_parse_time(fix_time(s), as_epoch_ns=True) for s in strs]
+
+
+class TestParseArray:
+    @pytest.mark.parametrize("make", [
+        lambda x: np.array(x),
+        lambda x: np.array(x, dtype="S"),
+        lambda x: np.array(x, dtype=object),
+        lambda x: pd.Series(x),
+        lambda x: pd.Series(x, dtype="string"),
+        list,
+    ])
+    def test_column_types(self, make):
+        assert c_parse_time_array(make(_COLUMN), as_epoch_ns=True).tolist() == _expected(_COLUMN)
+
+    def test_datetime64_and_missing(self):
+        out = c_parse_time_array(pd.Series(["20230615120000-0400", None, np.nan]))
+        assert out.dtype == np.dtype("datetime64[ns]")
+        assert out[0] == _utc("2023-06-15T16:00:00")
+        assert np.isnat(out[1:]).all()
+
+    def test_fix_offset_off(self):
+        out = c_parse_time_array(np.array(["20230615120000-0359"]), as_epoch_ns=True, fix_offset=False)
+        assert out[0] == c_parse_time("20230615120000-0359", as_epoch_ns=True, fix_offset=False)
+
+    def test_timezone(self):
+        out = c_parse_time_array(np.array(["20230615120000"], dtype="S"), timezone="UTC")
+        assert out[0] == _utc("2023-06-15T12:00:00")
+
+    @pytest.mark.parametrize("bad", ["2023061512", "2023061512000x-0400", "2023061512000\u00e9"])
+    def test_invalid(self, bad):
+        for arr in (np.array([_COLUMN[0], bad]), np.array([_COLUMN[0], bad], dtype=object)):
+            with pytest.raises(ValueError):
+                c_parse_time_array(arr)
+
+    def test_parse_time_series(self):
+        series = pd.Series(_COLUMN, index=range(10, 10 + len(_COLUMN)), name="obx_start_t")
+        out = parse_time(series, as_epoch_ns=True)
+        assert isinstance(out, pd.Series)
+        assert out.index.tolist() == series.index.tolist() and out.name == "obx_start_t"
+        assert out.tolist() == _expected(_COLUMN)
+
+
+# ---------------------------------------------------------------------------
+# per second memo
+# ---------------------------------------------------------------------------
+
+class TestTimeMemo:
+    def test_fraction_applied_on_hit(self):
+        parser = TimeParser("America/New_York")
+        a = parser.parse("20230615120000.25-0400")
+        b = parser.parse("20230615120000.75-0400")
+        assert b - a == np.timedelta64(500, "ms")
+        info = parser.cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+
+    def test_cache_clear(self):
+        parser = TimeParser("America/New_York")
+        parser.parse("20230615120000-0400")
+        parser.cache_clear()
+        assert parser.cache_info() == (0, 0, 256, 0)
+        assert parser.parse("20230615120000-0400") == _utc("2023-06-15T16:00:00")
+
+    def test_bounded(self):
+        parser = TimeParser("America/New_York")
+        for i in range(1000):
+            ts = "20230615%02d%02d%02d-0400" % (i // 60 % 24, i % 60, i % 60)
+            assert parser.parse(ts) == parse_time_python(ts)
+        assert parser.cache_info().currsize <= parser.cache_info().maxsize
+
+    def test_fix_offset_keys_separate(self):
+        parser = TimeParser("America/New_York")
+        ts = "20230615120000-0359"
+        fixed = parser.parse_array(np.array([ts]), as_epoch_ns=True)[0]
+        raw = parser.parse_array(np.array([ts]), as_epoch_ns=True, fix_offset=False)[0]
+        assert fixed - raw == 60 * 10**9
+
+    def test_parse_array_counts(self):
+        parser = TimeParser("America/New_York")
+        arr = np.array(["20230615120000.%d-0400" % i for i in range(10)] + [""])
+        out = parser.parse_array(arr)
+        assert np.isnat(out[-1]) and (np.diff(out[:-1]) == np.timedelta64(100, "ms")).all()
+        info = parser.cache_info()
+        assert (info.hits, info.misses) == (9, 1)
+        # memo is merged back even when the array is rejected
+        with pytest.raises(TypeError):
+            parser.parse_array(np.array(["20230615120000-0400", 5], dtype=object))
+        assert parser.cache_info().misses == 2
+
+    def test_module_counters(self):
+        get_time_parser().cache_clear()
+        c_parse_time("20230615120000-0400")
+        c_parse_time("20230615120000.1-0400")
+        assert time_cache_info().hits == 1
@@ -1,8 +1,17 @@
 """Unit tests for hl7_tokenizer."""
 import pytest
+import numpy as np
+from hl7lite.hl7_datatypes import hl7_field_to_pandas_type
 from hl7lite.hl7_tokenizer import (
     tokenize_hl7_message,
+    tokenize_hl7_message_lazy,
+    find_message_bounds,
+    convert_obx_values_batch,
+    get_tokenizer,
+    DEFAULT_TOKENIZER,
+    LazySegment,
     get_with_default,
+    field_accessor,
     _segment_to_fields,
     _field_to_repetitions,
     _repetition_to_components,
@@ -174,6 +183,38 @@ class TestGetWithDefault:
             get_with_default(self.msh, "msh", 99)  # no mapping for index 99
 
 
+class TestFieldAccessor:
+    def test_same_as_get_with_default(self):
+        segments, _ = tokenize_hl7_message(_WITH_OBR_OBX)
+        for seg in segments:
+            name = seg[0].lower()
+            for (seg_name, index) in hl7_field_to_pandas_type:
+                if seg_name != name:
+                    continue
+                for as_string in (True, False):
+                    try:
+                        expected = get_with_default(seg, seg_name, index, as_string)
+                    except (ValueError, KeyError) as e:
+                        with pytest.raises(type(e)):
+                            field_accessor(seg_name, index, as_string)(seg)
+                        continue
+                    # repr, so missing NaT compares equal
+                    assert repr(field_accessor(seg_name, index, as_string)(seg)) == repr(expected)
+
+    def test_missing_and_none(self):
+        accessor = field_accessor("obr", 21)
+        assert accessor(None) == ""
+        assert accessor(["OBR"]) == ""
+        assert field_accessor("obx", 6)(["OBX"]) == []
+
+    def test_datetime_converted(self):
+        assert field_accessor("msh", 6, as_string=False)(["MSH", "", "", "", "", "", "20230615120000-0359"]) == np.datetime64("2023-06-15T16:00:00", "ns")
+
+    def test_unknown_field_raises(self):
+        with pytest.raises(ValueError):
+            field_accessor("msh", 99)
+
+
 # ---------------------------------------------------------------------------
 # Helper functions — depth guards
 # ---------------------------------------------------------------------------
@@ -202,3 +243,239 @@ class TestDepthHelpers:
     def test_field_to_repetitions_at_level3(self):
         result = _field_to_repetitions("A~B", level=3)
         assert result == ["A", "B"]
+
+
+# ---------------------------------------------------------------------------
+# tokenize_hl7_message_lazy — same tokens as the eager tokenizer
+# ---------------------------------------------------------------------------
+
+_WITH_REPEATS = (
+    "MSH|^~\\&|CAPSULE|EUHM|R|H|20230615120000-0400||ORU^R01|C|P|2.3\r\n"
+    "PID|1|PAT001~ALTPAT|A&B^C\r\n"
+    "\r\n"
+    "PV1|1|I|EUH-4TN-T434\r"
+    "OBX|1|NA|CODE^NAME^SYS||1^2^3|mV\n"
+)
+
+
+class TestLazyTokenizer:
+    @pytest.mark.parametrize("msg", [_MINIMAL_MSH, _WITH_OBR_OBX, _WITH_REPEATS])
+    @pytest.mark.parametrize("level", [2, 3, 4, 5, 1000])
+    def test_matches_eager_tokenizer(self, msg, level):
+        eager, eager_names = tokenize_hl7_message(msg, level=level)
+        lazy, lazy_names = tokenize_hl7_message_lazy(msg, level=level)
+        assert lazy_names == eager_names
+        assert len(lazy) == len(eager)
+        for lseg, eseg in zip(lazy, eager):
+            assert isinstance(lseg, LazySegment)
+            assert list(lseg) == eseg
+
+    def test_obx_value_conversion(self):
+        eager, _ = tokenize_hl7_message(_WITH_REPEATS, convert_obx_values=True)
+        lazy, _ = tokenize_hl7_message_lazy(_WITH_REPEATS, convert_obx_values=True)
+        assert lazy[-1][5] == eager[-1][5] == [1, 2, 3]
+
+    def test_fields_are_tokenized_on_access(self):
+        segments, _ = tokenize_hl7_message_lazy(_WITH_OBR_OBX)
+        obr = segments[3]
+        assert obr.name == "OBR"
+        assert obr.raw(4) == "69121^MDC_OBS_WAVE_CTS^MDC"
+        assert obr[4] == ["69121", "MDC_OBS_WAVE_CTS", "MDC"]
+        assert obr[-1] == "20230615120100-0400"
+
+    def test_get_with_default_on_lazy_segment(self):
+        segments, _ = tokenize_hl7_message_lazy(_MINIMAL_MSH, level=2)
+        msh = segments[0]
+        assert get_with_default(msh, "msh", 2) == "CAPSULE"
+        assert get_with_default(msh, "msh", 20) == ""
+
+    def test_raises_if_not_starting_with_msh(self):
+        with pytest.raises(ValueError, match="MSH"):
+            tokenize_hl7_message_lazy("PID|1|PAT001\nMSH|^~\\&|...\n")
+
+
+# ---------------------------------------------------------------------------
+# bytes source — message bounds found on raw bytes, fields decoded on access
+# ---------------------------------------------------------------------------
+
+class TestBytesTokenizer:
+    @pytest.mark.parametrize("msg", [_MINIMAL_MSH, _WITH_OBR_OBX, _WITH_REPEATS])
+    def test_matches_str_tokenizer(self, msg):
+        from_str, str_names = tokenize_hl7_message_lazy(msg)
+        from_bytes, bytes_names = tokenize_hl7_message_lazy(msg.encode())
+        assert bytes_names == str_names
+        assert [list(s) for s in from_bytes] == [list(s) for s in from_str]
+
+    def test_raw_keeps_source_type(self):
+        segments, _ = tokenize_hl7_message_lazy(_WITH_OBR_OBX.encode())
+        assert segments[3].name == "OBR"
+        assert segments[3].raw(4) == b"69121^MDC_OBS_WAVE_CTS^MDC"
+
+    @pytest.mark.parametrize("payload,expected", [
+        ("1^2^3", [1, 2, 3]),
+        ("1.5^-2^3", [1.5, -2.0, 3.0]),
+        ("7", [7]),
+        ("", []),
+    ])
+    def test_numeric_obx_values_without_decoding(self, payload, expected):
+        msg = _WITH_REPEATS.replace("1^2^3", payload)
+        eager, _ = tokenize_hl7_message(msg, convert_obx_values=True)
+        lazy, _ = tokenize_hl7_message_lazy(msg.encode(), convert_obx_values=True)
+        assert lazy[-1][5] == eager[-1][5] == expected
+        assert [type(v) for v in lazy[-1][5]] == [type(v) for v in eager[-1][5]]
+
+    def test_start_end_select_one_message(self):
+        content = (_MINIMAL_MSH + "\n" + _WITH_OBR_OBX).encode()
+        bounds = find_message_bounds(content)
+        assert len(bounds) == 2
+        segments, names = tokenize_hl7_message_lazy(content, start=bounds[1][0], end=bounds[1][1])
+        eager, eager_names = tokenize_hl7_message(_WITH_OBR_OBX)
+        assert names == eager_names
+        assert [list(s) for s in segments] == eager
+
+    @pytest.mark.parametrize("sep", ["\n\n", "\r\n\r\n", "\r\r", "\r\n\n", "\n\n\n"])
+    def test_message_bounds(self, sep):
+        content = "MSH|a\r\nPID|1" + sep + "MSH|b\nPV1|1\r\n"
+        bounds = find_message_bounds(content)
+        assert [content[s:e] for s, e in bounds] == ["MSH|a\r\nPID|1", "MSH|b\nPV1|1\r\n"]
+        assert find_message_bounds(content.encode()) == bounds
+
+    def test_obx_values_as_array_overflow(self):
+        msg = _WITH_REPEATS.replace("1^2^3", "99999999999999999999^2^3")
+        lazy, _ = tokenize_hl7_message_lazy(msg, obx_values_as_array=True)
+        assert lazy[-1][5] == [99999999999999999999, 2, 3]
+
+    @pytest.mark.parametrize("as_bytes", [False, True])
+    def test_obx_values_as_array(self, as_bytes):
+        msg = _WITH_REPEATS.encode() if as_bytes else _WITH_REPEATS
+        lazy, _ = tokenize_hl7_message_lazy(msg, obx_values_as_array=True)
+        values = lazy[-1][5]
+        assert isinstance(values, np.ndarray)
+        assert values.dtype == np.int16
+        assert values.tolist() == [1, 2, 3]
+
+
+# ---------------------------------------------------------------------------
+# convert_obx_values_batch — all numeric OBX.5 of a file in 1 pass
+# ---------------------------------------------------------------------------
+
+_NUMERIC_OBX = (
+    "MSH|^~\\&|CAPSULE|EUHM|R|H|20230615120000-0400||ORU^R01|C|P|2.3\r"
+    "OBX|1|NA|CODE||1^2^-3|mV\r"
+    "OBX|2|NM|CODE||7|ms\r"
+    "OBX|3|NR|CODE||1.5^2\r"
+    "OBX|4|NM|CODE||2.5\r"
+    "OBX|5|ST|CODE||text\r"
+    "OBX|6|NA|CODE||\r"
+)
+
+
+class TestConvertObxValuesBatch:
+    @pytest.mark.parametrize("as_bytes", [False, True])
+    def test_matches_per_field_conversion(self, as_bytes):
+        msgs = [_NUMERIC_OBX, _NUMERIC_OBX.replace("1^2^-3", "4^5")]
+        expected = [tokenize_hl7_message(m, convert_obx_values=True)[0] for m in msgs]
+        batched = [tokenize_hl7_message_lazy(m.encode() if as_bytes else m, convert_obx_values=True)[0] for m in msgs]
+        assert convert_obx_values_batch(batched) == 8
+        for bsegs, esegs in zip(batched, expected):
+            for bseg, eseg in zip(bsegs[1:], esegs[1:]):
+                value = bseg[5]
+                if isinstance(value, np.ndarray):
+                    assert value.tolist() == eseg[5]
+                else:
+                    assert value == eseg[5]
+                    assert type(value) is type(eseg[5])
+
+    def test_list_values_are_views_of_one_buffer(self):
+        segments, _ = tokenize_hl7_message_lazy(_NUMERIC_OBX + _NUMERIC_OBX[_NUMERIC_OBX.index("OBX"):], convert_obx_values=True)
+        convert_obx_values_batch([segments])
+        int_arrays = [seg[5] for seg in segments if seg[2] == "NA" and len(seg[5]) > 0]
+        assert len(int_arrays) == 2
+        assert int_arrays[0].base is not None
+        assert int_arrays[0].base is int_arrays[1].base
+
+    def test_same_dtypes_as_obx_values_as_array(self):
+        msg = _NUMERIC_OBX + "OBX|7|NA|CODE||1^40000\r" + "OBX|8|NA|CODE||3000000000^-1\r"
+        batched, _ = tokenize_hl7_message_lazy(msg, convert_obx_values=True)
+        convert_obx_values_batch([batched])
+        as_array, _ = tokenize_hl7_message_lazy(msg, obx_values_as_array=True)
+        for bseg, aseg in zip(batched[1:], as_array[1:]):
+            if isinstance(aseg[5], np.ndarray) and len(aseg[5]) > 0:
+                assert bseg[5].dtype == aseg[5].dtype
+                assert bseg[5].tolist() == aseg[5].tolist()
+        assert [seg[5].dtype for seg in batched if seg[2] == "NA" and len(seg[5]) > 0] == [np.int16, np.int32, np.int64]
+
+    def test_int64_overflow_converted_exactly(self):
+        big = _NUMERIC_OBX.replace("1^2^-3", "99999999999999999999^1").replace("|7|", "|-99999999999999999999|")
+        segments, _ = tokenize_hl7_message_lazy(big, convert_obx_values=True)
+        convert_obx_values_batch([segments])
+        assert list(segments[1][5]) == [99999999999999999999, 1]
+        assert segments[2][5] == -99999999999999999999
+
+    def test_bad_payload_left_for_per_field_path(self):
+        bad = _NUMERIC_OBX.replace("1^2^-3", "1^x^3")
+        segments, _ = tokenize_hl7_message_lazy(bad, convert_obx_values=True)
+        assert convert_obx_values_batch([segments]) == 3
+        assert segments[2][5] == 7
+        with pytest.raises(ValueError):
+            segments[1][5]
+
+
+# ---------------------------------------------------------------------------
+# non-default separators declared in MSH.1 / MSH.2
+# ---------------------------------------------------------------------------
+
+def _with_separators(msg: str, seps: str) -> str:
+    # seps replaces |^~\& in order
+    return msg.translate(str.maketrans("|^~\\&", seps))
+
+
+class TestCustomSeparators:
+    @pytest.mark.parametrize("msg", [_MINIMAL_MSH, _WITH_OBR_OBX, _WITH_REPEATS])
+    @pytest.mark.parametrize("level", [5, 1000])  # below 5, the unsplit text keeps the custom separators.
+    def test_same_tokens_as_default_separators(self, msg, level):
+        custom = _with_separators(msg, "#*@/%")
+        expected, expected_names = tokenize_hl7_message(msg, level=level)
+        eager, eager_names = tokenize_hl7_message(custom, level=level)
+        lazy, lazy_names = tokenize_hl7_message_lazy(custom.encode(), level=level)
+        assert eager_names == lazy_names == expected_names
+        # MSH.2 holds the separators themselves, so compare everything else.
+        assert eager[0][0] == "MSH" and eager[0][1] == "*@/%"
+        assert [seg[2:] for seg in eager] == [seg[2:] for seg in expected]
+        assert [list(seg)[2:] for seg in lazy] == [seg[2:] for seg in expected]
+
+    def test_obx_value_conversion(self):
+        custom = _with_separators(_WITH_REPEATS, "#*@/%")
+        eager, _ = tokenize_hl7_message(custom, convert_obx_values=True)
+        lazy, _ = tokenize_hl7_message_lazy(custom, convert_obx_values=True)
+        arrays, _ = tokenize_hl7_message_lazy(custom.encode(), obx_values_as_array=True)
+        assert eager[-1][5] == lazy[-1][5] == arrays[-1][5].tolist() == [1, 2, 3]
+
+    def test_tokenizers_are_cached(self):
+        assert get_tokenizer("|^~\\&") is DEFAULT_TOKENIZER
+        assert get_tokenizer(b"|^~\\&") is DEFAULT_TOKENIZER
+        tok = get_tokenizer("#*@/%")
+        assert get_tokenizer("#*@/%") is tok
+        assert (tok.field, tok.component, tok.repetition, tok.escape, tok.subcomponent) == ("#", "*", "@", "/", "%")
+        assert get_tokenizer(b"#*@/%") is tok
+
+    def test_short_msh2_cached_by_separators(self):
+        # with a short MSH.2, the prefix includes the start of MSH.3, which differs per sender.
+        tok = get_tokenizer("|^~|A")
+        assert tok.msh_2 == "^~"
+        assert get_tokenizer("|^~|B") is tok
+        assert get_tokenizer(b"|^~|C") is tok
+        assert get_tokenizer("|^~\\|") is not tok
+
+    def test_tokenizer_cache_is_bounded(self):
+        from hl7lite.hl7_tokenizer import _cached_tokenizer, TOKENIZER_CACHE_SIZE
+        for i in range(TOKENIZER_CACHE_SIZE * 2):
+            get_tokenizer(chr(0x100 + i) + "^~\\&")
+        assert _cached_tokenizer.cache_info().currsize <= TOKENIZER_CACHE_SIZE
+
+    def test_short_msh2(self):
+        # only component and repetition separators declared; & is data.
+        parsed, _ = tokenize_hl7_message("MSH|^~|APP\rPID|1|A&B^C\r")
+        assert parsed[0][1] == "^~"
+        assert parsed[1][2] == ["A&B", "C"]
+